@@ -5,14 +5,19 @@ import logging
 import os
 import subprocess
 import sys
+import traceback
 
-from dem4water.area_mapping_v2 import area_mapping
-from dem4water.cut_contourlines import cut_countourlines
-from dem4water.find_cutline_and_pdb import find_cutline_and_pdb
-from dem4water.find_pdb_and_cutline import find_pdb_and_cutline
-from dem4water.szi_to_model import szi_to_model
+from dem4water.orchestration.job_scripts import (
+    environment_exports,
+    pbs_header,
+    single_command,
+    slurm_header,
+)
 from dem4water.tools.generate_dam_json_config import write_json
-from dem4water.val_report import val_report
+
+# The processing modules pull GDAL, rasterio, geopandas, scipy or matplotlib:
+# they are imported by the functions using them, the submission modes and
+# the help message do not pay for them.
 
 
 
@@ -39,22 +44,10 @@ def get_current_git_rev():
 
 def launch_pbs(conf, log_out, log_err, cpu=12, ram=60, h_wall=1, m_wall=0):
     """Submit a job to pbs."""
-    # Export system variables simulating loading modules and venv
     pbs_file = (
-        f"#!/usr/bin/env bash\n"
-        f"#PBS -l select=1:ncpus={cpu}:mem={ram}000MB:os=rh7\n"
-        f"#PBS -l walltime={int(h_wall):02d}:{int(m_wall):02d}:0\n\n"
-        f"#PBS -e {log_err}\n"
-        f"#PBS -o {log_out}\n"
-        "\nmodule purge\n"
-        f"export PYTHONPATH={os.environ.get('PYTHONPATH')}\n"
-        f"export PATH={os.environ.get('PATH')}\n"
-        f"export LD_LIBRARY_PATH={os.environ.get('LD_LIBRARY_PATH')}\n"
-        f"export OTB_APPLICATION_PATH={os.environ.get('OTB_APPLICATION_PATH')}\n"
-        f"export GDAL_DATA={os.environ.get('GDAL_DATA')}\n"
-        f"export GEOTIFF_CSV={os.environ.get('GEOTIFF_CSV')}\n"
-        f"export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={cpu}\n\n"
-        f"dem4water single -dam_json {conf} -scheduler_type local"
+        pbs_header(log_out, log_err, cpu, ram, h_wall, m_wall)
+        + environment_exports(cpu)
+        + single_command(conf)
     )
     out_file = log_out.replace(".log", ".pbs")
     with open(out_file, "w", encoding="utf-8") as ofile:
@@ -72,34 +65,17 @@ def launch_slurm(
     m_wall=0,
     account="campus",
     dam_name=None,
+    force=False,
 ):
     """Submit a job to pbs."""
-    # Export system variables simulating loading modules and venv
     if dam_name is None:
         name = "dem4water"
     else:
         name = f"d4w_{dam_name}"
     pbs_file = (
-        "#!/bin/bash\n"
-        f"#SBATCH --job-name {name}"
-        "#SBATCH -N 1\n"
-        "#SBATCH --ntasks=1\n"
-        f"#SBATCH --cpus-per-task={cpu}\n"
-        f"#SBATCH --mem={ram}gb\n"
-        f"#SBATCH --time={int(h_wall):02d}:{int(m_wall):02d}:00\n"
-        f"#SBATCH --error={log_err}\n"
-        f"#SBATCH --output={log_out}\n"
-        f"#SBATCH --account={account}\n"
-        "\nmodule purge\n"
-        f"export PYTHONPATH={os.environ.get('PYTHONPATH')}\n"
-        f"export PATH={os.environ.get('PATH')}\n"
-        f"export LD_LIBRARY_PATH={os.environ.get('LD_LIBRARY_PATH')}\n"
-        "export OTB_APPLICATION_PATH="
-        f"{os.environ.get('OTB_APPLICATION_PATH')}\n"
-        f"export GDAL_DATA={os.environ.get('GDAL_DATA')}\n"
-        f"export GEOTIFF_CSV={os.environ.get('GEOTIFF_CSV')}\n"
-        f"export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={cpu}\n\n"
-        f"dem4water single -dam_json {conf} -scheduler_type local"
+        slurm_header(name, log_out, log_err, cpu, ram, h_wall, m_wall, account)
+        + environment_exports(cpu)
+        + single_command(conf, force)
     )
     out_file = log_out.replace(".log", ".slurm")
     with open(out_file, "w", encoding="utf-8") as ofile:
@@ -108,6 +84,465 @@ def launch_slurm(
     run_command(["sbatch", out_file])
 
 
+def write_manifest(config_list):
+    """List the dam configurations in the manifest of the campaign log folder.
+
+    Returns
+    -------
+    the manifest file and the log folder
+    """
+    with open(config_list[0], encoding="utf-8") as in_config:
+        log_folder = json.load(in_config)["chain"]["log_folder"]
+    manifest = os.path.join(log_folder, "campaign_manifest.txt")
+    with open(manifest, "w", encoding="utf-8") as manifest_file:
+        manifest_file.write("\n".join(config_list) + "\n")
+    return manifest, log_folder
+
+
+def submit_array(
+    name, command, log_folder, scheduler, array, cpu, ram, h_wall, m_wall, account
+):
+    """Write and submit a job array script running command in each task.
+
+    {index} in command is replaced by the task index variable of the
+    scheduler. The script and the task logs are written in log_folder. An
+    array of one task is submitted as a plain job with index 0, PBS refusing
+    the array 0-0.
+    """
+    if array[0] == 1:
+        array = None
+    if scheduler == "PBS":
+        index = "0" if array is None else "$PBS_ARRAY_INDEX"
+        task = "" if array is None else "_^array_index^"
+        header = pbs_header(
+            os.path.join(log_folder, f"{name}{task}_out.log"),
+            os.path.join(log_folder, f"{name}{task}_err.log"),
+            cpu,
+            ram,
+            h_wall,
+            m_wall,
+            array,
+        )
+        out_file = os.path.join(log_folder, f"{name}.pbs")
+        submit = "qsub"
+    else:
+        index = "0" if array is None else "$SLURM_ARRAY_TASK_ID"
+        task = "%j" if array is None else "%A_%a"
+        header = slurm_header(
+            name,
+            os.path.join(log_folder, f"{name}_{task}_out.log"),
+            os.path.join(log_folder, f"{name}_{task}_err.log"),
+            cpu,
+            ram,
+            h_wall,
+            m_wall,
+            account,
+            array,
+        )
+        out_file = os.path.join(log_folder, f"{name}.slurm")
+        submit = "sbatch"
+    with open(out_file, "w", encoding="utf-8") as ofile:
+        ofile.write(header + environment_exports(cpu) + command.format(index=index))
+    print(f"Submit job {'array ' if array is not None else ''}{out_file}")
+    run_command([submit, out_file])
+
+
+def launch_array(
+    config_list,
+    scheduler,
+    cpu=12,
+    ram=60,
+    h_wall=1,
+    m_wall=0,
+    array_limit=None,
+    account="campus",
+):
+    """Submit all the dams as one job array.
+
+    The dam configurations are listed in a manifest, each task of the array
+    processes the configuration at the line of its index. The manifest, the
+    job script and the task logs are written in the log folder of the campaign.
+
+    Parameters
+    ----------
+    config_list:
+        the dam configuration files, as written by write_json
+    scheduler:
+        PBS or Slurm
+    array_limit:
+        maximum number of tasks running simultaneously, no limit if None
+    """
+    if not config_list:
+        print("No dam to submit.")
+        return
+    manifest, log_folder = write_manifest(config_list)
+    print(f"{len(config_list)} dams listed in {manifest}")
+    submit_array(
+        "d4w_array",
+        f'CONF=$(sed -n "$(( {{index}} + 1 ))p" {manifest})\n'
+        + single_command('"$CONF"'),
+        log_folder,
+        scheduler,
+        (len(config_list), array_limit),
+        cpu,
+        ram,
+        h_wall,
+        m_wall,
+        account,
+    )
+
+
+def launch_queue_workers(
+    config_list,
+    scheduler,
+    nb_workers,
+    cpu=12,
+    ram=60,
+    h_wall=1,
+    m_wall=0,
+    account="campus",
+):
+    """Submit workers pulling the dams of the campaign manifest.
+
+    The nb_workers jobs, submitted as one job array, claim the dams one by one
+    until none is left (see orchestration/work_queue.py): the walltime is the
+    one of a worker, not of a dam.
+    """
+    if not config_list:
+        print("No dam to submit.")
+        return
+    manifest, log_folder = write_manifest(config_list)
+    print(f"{len(config_list)} dams queued in {manifest}")
+    submit_array(
+        "d4w_worker",
+        f"dem4water worker -manifest {manifest}",
+        log_folder,
+        scheduler,
+        (nb_workers, None),
+        cpu,
+        ram,
+        h_wall,
+        m_wall,
+        account,
+    )
+
+
+def print_plan(costs, packs, model=None):
+    """Print the estimated cost of each dam and the packs of dams."""
+    # pylint: disable=import-outside-toplevel
+    from dem4water.orchestration.cost_model import resources_request
+
+    if model is None:
+        print(f"{'dam':<40} {'geometry cost':>14}")
+        for cost in costs:
+            value = "unknown" if cost.runtime is None else f"{cost.runtime:.3g}"
+            print(f"{os.path.basename(os.path.dirname(cost.conf)):<40} {value:>14}")
+        return
+    print(f"{'dam':<40} {'runtime':>10} {'memory':>10} {'walltime':>9} {'ram':>6}")
+    for cost in costs:
+        name = os.path.basename(os.path.dirname(cost.conf))
+        if cost.runtime is None:
+            print(f"{name:<40} {'unknown, default resources':>38}")
+            continue
+        dam_ram, dam_h, dam_m = resources_request(cost.runtime, cost.memory)
+        print(
+            f"{name:<40} {cost.runtime / 60:9.1f}m {cost.memory / 1024:8.2f}GB "
+            f"{dam_h:6d}:{dam_m:02d} {dam_ram:4d}GB"
+        )
+    if packs is not None:
+        print(f"{len(costs)} dams packed in {len(packs)} jobs")
+
+
+def plan_campaign(
+    config_list, cost_model=None, order="database", pack_walltime=None, dry_run=False
+):
+    """Order the dams of a campaign by cost and predict their resources.
+
+    Parameters
+    ----------
+    cost_model:
+        model fitted by cost-model predicting the runtime and memory of the dams
+    order:
+        "database" to keep the order, "lpt" to process the longest dams first
+    pack_walltime:
+        with a cost model, pack the dams into jobs of at most this walltime (min)
+    dry_run:
+        print the cost of each dam
+
+    The costs are only estimated, which reads the DEM extent of each dam,
+    when one of cost_model, "lpt" or dry_run asks for them.
+
+    Returns
+    -------
+    the ordered configurations, the (ram in GB, walltime hours, walltime
+    minutes) of each dam with a known cost, and the (configurations, request)
+    of each job with pack_walltime, None otherwise
+    """
+    # pylint: disable=import-outside-toplevel
+    from dem4water.orchestration.cost_model import resources_request
+    from dem4water.orchestration.job_packing import (
+        estimate_costs,
+        lpt_order,
+        pack_dams,
+        pack_request,
+    )
+
+    model = None
+    if cost_model is not None:
+        with open(cost_model, encoding="utf-8") as model_in:
+            model = json.load(model_in)
+    elif pack_walltime is not None:
+        raise ValueError("-pack_walltime needs a -cost_model to predict the dam runtimes")
+    if model is None and order == "database" and not dry_run:
+        return config_list, {}, None
+    costs = estimate_costs(config_list, model)
+    if order == "lpt":
+        costs = lpt_order(costs)
+    resources = {}
+    if model is not None:
+        resources = {
+            cost.conf: resources_request(cost.runtime, cost.memory)
+            for cost in costs
+            if cost.runtime is not None
+        }
+    packs = None
+    if pack_walltime is not None:
+        packs = [
+            ([cost.conf for cost in pack], pack_request(pack))
+            for pack in pack_dams(costs, 60 * pack_walltime)
+        ]
+    if dry_run:
+        print_plan(costs, packs, model)
+    return [cost.conf for cost in costs], resources, packs
+
+
+def pack_logs(pack):
+    """Return the job name and log files of a pack of dams.
+
+    A single dam keeps its own log files, a pack of dams uses the log files
+    of its first dam with a _pack suffix.
+    """
+    conf = pack[0]
+    name = conf.split("/")[-1].split("_")[-1].split(".")[0]
+    with open(conf, encoding="utf-8") as in_config:
+        chain = json.load(in_config)["chain"]
+    if len(pack) == 1:
+        return name, chain["log_out"], chain["log_err"]
+    return (
+        f"{name}_pack{len(pack)}",
+        chain["log_out"].replace("_out.log", "_pack_out.log"),
+        chain["log_err"].replace("_err.log", "_pack_err.log"),
+    )
+
+
+def largest_request(resources):
+    """Return the largest ram and walltime of the dam resources."""
+    ram = max(dam_ram for dam_ram, _, _ in resources.values())
+    h_wall, m_wall = divmod(max(60 * h + m for _, h, m in resources.values()), 60)
+    return ram, h_wall, m_wall
+
+
+def launch_monitored(
+    config_list,
+    scheduler,
+    cpu=12,
+    ram=60,
+    h_wall=1,
+    m_wall=0,
+    max_active=50,
+    max_attempts=3,
+    workers=1,
+    debug=False,
+    resources=None,
+    poll_interval=60,
+):
+    """Submit the dams and follow their jobs, resubmitting the failed ones.
+
+    The status of the campaign is written in the log folder of the campaign,
+    with the local scheduler the jobs run as workers local processes.
+    """
+    # pylint: disable=import-outside-toplevel
+    from dem4water.orchestration.job_monitor import monitor_campaign
+
+    logging_format = (
+        "%(asctime)s - %(filename)s:%(lineno)s - %(levelname)s - %(message)s"
+    )
+    if debug is True:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.DEBUG, format=logging_format
+        )
+    else:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.INFO, format=logging_format
+        )
+    if not config_list:
+        print("No dam to submit.")
+        return None
+    with open(config_list[0], encoding="utf-8") as in_config:
+        log_folder = json.load(in_config)["chain"]["log_folder"]
+    return monitor_campaign(
+        config_list,
+        scheduler,
+        cpu,
+        ram,
+        h_wall,
+        m_wall,
+        max_active,
+        max_attempts,
+        poll_interval,
+        status_file=os.path.join(log_folder, "campaign_monitor.json"),
+        slots=workers,
+        resources=resources,
+    )
+
+
+def launch_local(
+    config_list, workers=1, timeout=None, max_memory=None, debug=False, io_workers=None
+):
+    """Run the dams in parallel local processes, a failing dam does not stop the others.
+
+    With io_workers, the stages of the dams are pipelined: the extractions run
+    in io_workers threads while the other stages run in workers processes.
+    The summary of the run is written in the log folder of the campaign.
+    """
+    summary_file = None
+    if config_list:
+        with open(config_list[0], encoding="utf-8") as in_config:
+            log_folder = json.load(in_config)["chain"]["log_folder"]
+        summary_file = os.path.join(log_folder, "local_campaign_summary.json")
+    if io_workers is not None:
+        # pylint: disable=import-outside-toplevel
+        from dem4water.orchestration.dag_scheduler import run_dag_campaign
+
+        return run_dag_campaign(
+            config_list,
+            workers,
+            io_workers,
+            max_memory=max_memory,
+            summary_file=summary_file,
+            debug=debug,
+            timeout=timeout,
+        )
+    # pylint: disable=import-outside-toplevel
+    from dem4water.orchestration.local_executor import run_local_campaign
+
+    return run_local_campaign(
+        config_list, workers, timeout, max_memory, summary_file, debug
+    )
+
+
+def launch_packs(packs, scheduler, cpu, ram, walltime_hour, walltime_minutes):
+    """Submit one PBS or Slurm job per pack of dams.
+
+    packs lists the (dam configurations, (ram, walltime hours, walltime
+    minutes) or None for the default resources) of each job.
+    """
+    for pack, request in packs:
+        name, log_out, log_err = pack_logs(pack)
+        dam_ram, dam_h, dam_m = request or (ram, walltime_hour, walltime_minutes)
+        if scheduler == "PBS":
+            launch_pbs(
+                pack,
+                log_out,
+                log_err,
+                h_wall=dam_h,
+                m_wall=dam_m,
+                ram=dam_ram,
+                cpu=cpu,
+            )
+        elif scheduler == "Slurm":
+            launch_slurm(
+                pack,
+                log_out,
+                log_err,
+                h_wall=dam_h,
+                m_wall=dam_m,
+                ram=dam_ram,
+                cpu=cpu,
+                dam_name=name,
+            )
+
+
+def submit_campaign(
+    config_list,
+    scheduler,
+    walltime_hour=1,
+    walltime_minutes=0,
+    ram=60,
+    cpu=12,
+    workers=1,
+    timeout=None,
+    max_memory=None,
+    debug=False,
+    job_array=False,
+    array_limit=None,
+    queue_workers=None,
+    io_workers=None,
+    monitor=False,
+    max_active=50,
+    max_attempts=3,
+    cost_model=None,
+    dry_run=False,
+    order="database",
+    pack_walltime=None,
+    poll_interval=60,
+):
+    """Process the dam configurations of a campaign with the chosen scheduler.
+
+    The dams are ordered and their resources predicted by plan_campaign, then
+    monitored, run locally, pulled by queue workers, submitted as a job array
+    or as one job per dam (or pack of dams).
+    """
+    config_list, resources, packs = plan_campaign(
+        config_list, cost_model, order, pack_walltime, dry_run
+    )
+    if resources and job_array:
+        # One request for all the tasks of the array
+        ram, walltime_hour, walltime_minutes = largest_request(resources)
+    if dry_run:
+        print(f"Dry run: {len(config_list)} dams not submitted.")
+    elif monitor:
+        launch_monitored(
+            config_list,
+            scheduler,
+            cpu,
+            ram,
+            walltime_hour,
+            walltime_minutes,
+            max_active,
+            max_attempts,
+            workers,
+            debug,
+            resources,
+            poll_interval,
+        )
+    elif scheduler == "local":
+        launch_local(config_list, workers, timeout, max_memory, debug, io_workers)
+    elif queue_workers is not None:
+        launch_queue_workers(
+            config_list,
+            scheduler,
+            queue_workers,
+            cpu,
+            ram,
+            walltime_hour,
+            walltime_minutes,
+        )
+    elif job_array:
+        launch_array(
+            config_list,
+            scheduler,
+            cpu,
+            ram,
+            walltime_hour,
+            walltime_minutes,
+            array_limit,
+        )
+    else:
+        if packs is None:
+            packs = [([conf], resources.get(conf)) for conf in config_list]
+        launch_packs(packs, scheduler, cpu, ram, walltime_hour, walltime_minutes)
+
 
 def launch_campaign(
     json_campaign,
@@ -117,45 +552,19 @@ def launch_campaign(
     ram,
     cpu,
     input_force_list,
+    **options,
 ):
-    """Launch on PBS or local."""
+    """Launch on PBS or local.
+
+    options are the submission options of submit_campaign.
+    """
 
     config_list = write_json(json_campaign, input_force_list=input_force_list)
 
     # config_list = [config_list[0]]
-    if scheduler == "local":
-        for conf in config_list:
-            launch_full_process(conf)
-    else:
-        for conf in config_list:
-            name = conf.split("/")[-1].split("_")[-1].split(".")[0]
-
-            with open(conf, encoding="utf-8") as in_config:
-                config = json.load(in_config)
-                log_out = config["chain"]["log_out"]
-                log_err = config["chain"]["log_err"]
-                if scheduler == "PBS":
-                    launch_pbs(
-                        conf,
-                        log_out,
-                        log_err,
-                        h_wall=walltime_hour,
-                        m_wall=walltime_minutes,
-                        ram=ram,
-                        cpu=cpu,
-                    )
-                elif scheduler == "Slurm":
-                    launch_slurm(
-                        conf,
-                        log_out,
-                        log_err,
-                        h_wall=walltime_hour,
-                        m_wall=walltime_minutes,
-                        ram=ram,
-                        cpu=cpu,
-                        dam_name=name,
-                    )
-
+    submit_campaign(
+        config_list, scheduler, walltime_hour, walltime_minutes, ram, cpu, **options
+    )
 
 
 def launch_reference_validation_campaign(
@@ -168,8 +577,13 @@ def launch_reference_validation_campaign(
     ram,
     cpu,
     only_ref,
+    stage_cache=None,
+    **options,
 ):
-    """Launch andalousie or occitanie reference campaign."""
+    """Launch andalousie or occitanie reference campaign.
+
+    options are the submission options of submit_campaign.
+    """
     config_list = []
     git_folder = os.path.dirname(__file__)
     json_campaign_andalousie = os.path.join(
@@ -188,6 +602,7 @@ def launch_reference_validation_campaign(
                 output_folder,
                 campaign_name,
                 ref_only=only_ref,
+                stage_cache=stage_cache,
             )
     if "occitanie" in targets:
         if not os.path.exists(json_campaign_occitanie):
@@ -200,94 +615,218 @@ def launch_reference_validation_campaign(
                 campaign_name,
                 concat=True,
                 ref_only=only_ref,
+                stage_cache=stage_cache,
             )
 
     # config_list = [config_list[0]]
+    submit_campaign(
+        config_list, scheduler, walltime_hour, walltime_minutes, ram, cpu, **options
+    )
+
+
+def launch_pack(config_list, force=False):
+    """Process dams one after the other, a failing dam does not stop the next ones.
+
+    Returns
+    -------
+    0 if all the dams succeeded, 1 otherwise
+    """
+    failed = []
+    for conf in config_list:
+        print(f"Processing {conf}")
+        try:
+            launch_full_process(conf, force)
+        except SystemExit as error:
+            if error.code not in (None, 0):
+                print(f"{conf} exited with code {error.code}")
+                failed.append(conf)
+        except Exception:  # pylint: disable=broad-except
+            traceback.print_exc()
+            failed.append(conf)
+    print(f"{len(config_list) - len(failed)} dams processed, {len(failed)} failed")
+    for conf in failed:
+        print(f"Failed: {conf}")
+    return 1 if failed else 0
+
+
+def launch_single(
+    config_list, scheduler, walltime_hour, walltime_minutes, ram, cpu, force=False
+):
+    """Launch a single dam, or dams packed in one job, on PBS or local mode."""
     if scheduler == "local":
-        for conf in config_list:
-            launch_full_process(conf)
-    else:
-        for conf in config_list:
-            with open(conf, encoding="utf-8") as in_config:
-                config = json.load(in_config)
-                log_out = config["chain"]["log_out"]
-                log_err = config["chain"]["log_err"]
-                launch_pbs(
-                    conf,
-                    log_out,
-                    log_err,
-                    h_wall=walltime_hour,
-                    m_wall=walltime_minutes,
-                    ram=ram,
-                    cpu=cpu,
-                )
-
-
-def launch_single(conf, scheduler, walltime_hour, walltime_minutes, ram, cpu):
-    """Launch a single dam on PBS or local mode."""
-    if scheduler == "local":
+        if len(config_list) == 1:
+            return launch_full_process(config_list[0], force)
+        return launch_pack(config_list, force)
+    name, log_out, log_err = pack_logs(config_list)
+    launch_slurm(
+        config_list,
+        log_out,
+        log_err,
+        h_wall=walltime_hour,
+        m_wall=walltime_minutes,
+        ram=ram,
+        cpu=cpu,
+        dam_name=name,
+        force=force,
+    )
+    return 0
 
-        launch_full_process(conf)
-    else:
-        name = conf.split("/")[-1].split("_")[-1].split(".")[0]
 
-        with open(conf, encoding="utf-8") as in_config:
-            config = json.load(in_config)
-            log_out = config["chain"]["log_out"]
-            log_err = config["chain"]["log_err"]
-            launch_slurm(
+def launch_full_process(input_config_json, force=False):
+    """Console script for dem4water.
 
-                conf,
-                log_out,
-                log_err,
-                h_wall=walltime_hour,
-                m_wall=walltime_minutes,
-                ram=ram,
-                cpu=cpu,
-                dam_name=name,
+    The stages already run with the same inputs, parameters and code are
+    skipped, unless force is set (see orchestration/pipeline.py).
+    """
+    # pylint: disable=import-outside-toplevel
+    from dem4water.orchestration.pipeline import run_pipeline
 
-            )
+    return run_pipeline(input_config_json, force)
 
 
-def launch_full_process(input_config_json):
-    """Console script for dem4water."""
+# Options of add_scheduler_arguments (and --debug) passed to submit_campaign
+SCHEDULER_OPTIONS = [
+    "workers",
+    "timeout",
+    "max_memory",
+    "debug",
+    "job_array",
+    "array_limit",
+    "queue_workers",
+    "io_workers",
+    "monitor",
+    "max_active",
+    "max_attempts",
+    "cost_model",
+    "dry_run",
+    "order",
+    "pack_walltime",
+    "poll_interval",
+]
 
-    with open(input_config_json, encoding="utf-8") as in_config:
-        config = json.load(in_config)
 
-    # extract_watermap = config["area_mapping"]["out_wmap"]
-    if "find_pdb_and_cutline" in config:
-        extract_dem = config["find_pdb_and_cutline"]["dem"]
-    else:
-        extract_dem = config["find_cutline_and_pdb"]["dem_raster"]
-    # algo = config["area_mapping"]["mode"]
-    # if (os.path.exists(extract_watermap) and
-    if os.path.exists(extract_dem):
-        logging.info(
-            # f"{extract_watermap} already exists.\n"
-            f"{extract_dem} already exists.\n"
-            ".Skipping area_mapping"
-        )
-    else:
-        area_mapping(**config["area_mapping"])
-    skip = False
-    if (
-        "_custom" in config["cut_contourlines"]["info"]
-        and "_custom" in config["cut_contourlines"]["cutline"]
-    ):
-        logging.info("Skip cutline and daminfo generation because customs files found.")
-        skip = True
-    if not skip:
-        if "find_cutline_and_pdb" in config:
-            find_cutline_and_pdb(**config["find_cutline_and_pdb"])
-        else:
-            find_pdb_and_cutline(**config["find_pdb_and_cutline"])
-    # cutline_score(**config["cutline_score"])
-    cut_countourlines(**config["cut_contourlines"])
-    szi_to_model(**config["szi_to_model"])
-    if "val_report" in config:
-        val_report(**config["val_report"])
-    return 0
+def scheduler_options(parser, args):
+    """Return the submission options of the parsed arguments of a campaign mode.
+
+    Exit with a parser error on -pack_walltime without -cost_model, or with a
+    submission keeping one task per dam.
+    """
+    if args.pack_walltime is not None:
+        if args.cost_model is None:
+            parser.error(
+                "-pack_walltime needs -cost_model: the packs add up predicted runtimes, "
+                "the geometry cost of a dam is not a duration"
+            )
+        if (
+            args.scheduler_type == "local"
+            or args.job_array
+            or args.queue_workers is not None
+            or args.monitor
+        ):
+            parser.error(
+                "-pack_walltime only applies to one job per dam submissions, not to "
+                "the local scheduler, -job_array, -queue_workers or -monitor"
+            )
+    return {name: getattr(args, name) for name in SCHEDULER_OPTIONS}
+
+
+def add_scheduler_arguments(parser):
+    """Add the local scheduler and job array parameters to a mode parser."""
+    parser.add_argument(
+        "-workers",
+        type=int,
+        default=1,
+        help="Local scheduler: number of dams processed simultaneously",
+    )
+    parser.add_argument(
+        "-timeout",
+        type=float,
+        default=None,
+        help="Local scheduler: maximum duration of a dam (s)",
+    )
+    parser.add_argument(
+        "-max_memory",
+        type=float,
+        default=None,
+        help="Local scheduler: maximum memory of a dam (GB)",
+    )
+    parser.add_argument(
+        "-io_workers",
+        type=int,
+        default=None,
+        help="Local scheduler: pipeline the stages, extracting the next dams in this "
+        "number of threads while -workers processes compute the other stages",
+    )
+    parser.add_argument(
+        "-job_array",
+        action="store_true",
+        help="PBS or Slurm: submit all the dams as a single job array",
+    )
+    parser.add_argument(
+        "-array_limit",
+        type=int,
+        default=None,
+        help="PBS or Slurm: maximum number of array tasks running simultaneously",
+    )
+    parser.add_argument(
+        "-queue_workers",
+        type=int,
+        default=None,
+        help="PBS or Slurm: submit this number of workers pulling the dams from a queue",
+    )
+    parser.add_argument(
+        "-monitor",
+        action="store_true",
+        help="Submit the dams and follow their jobs until the end, resubmitting the "
+        "failed ones with a longer walltime or more memory",
+    )
+    parser.add_argument(
+        "-max_active",
+        type=int,
+        default=50,
+        help="Monitor: maximum number of jobs queued or running at once",
+    )
+    parser.add_argument(
+        "-max_attempts",
+        type=int,
+        default=3,
+        help="Monitor: maximum number of jobs submitted for a dam stopped by the "
+        "scheduler (timeout, memory, node failure)",
+    )
+    parser.add_argument(
+        "-poll_interval",
+        type=float,
+        default=60,
+        help="Monitor: seconds between two polls of the job states",
+    )
+    parser.add_argument(
+        "-cost_model",
+        default=None,
+        help="PBS or Slurm: model fitted by cost-model setting the walltime and "
+        "memory of each dam",
+    )
+    parser.add_argument(
+        "-dry_run",
+        action="store_true",
+        help="Print the estimated cost of each dam, predicted with -cost_model, "
+        "submit nothing",
+    )
+    parser.add_argument(
+        "-order",
+        default="database",
+        choices=["database", "lpt"],
+        help="Submission order of the dams: database order, or longest first from "
+        "their estimated cost (reads the DEM extent of each dam before submitting)",
+    )
+    parser.add_argument(
+        "-pack_walltime",
+        type=float,
+        default=None,
+        help="PBS or Slurm with -cost_model, one job per dam: process the small dams "
+        "one after the other in jobs of at most this walltime (minutes). The "
+        "walltime of a pack is the sum of the runtimes predicted by the model. "
+        "Job arrays, queue workers and the monitor keep one task per dam",
+    )
 
 
 def process_parameters():
@@ -322,15 +861,16 @@ def process_parameters():
     )
     parser_camp.add_argument(
         "-scheduler_type",
-        help="Local or Slurm",
+        help="Local, PBS or Slurm",
         default="Slurm",
-        choices=["local", "Slurm"],
+        choices=["local", "PBS", "Slurm"],
     )
     parser_camp.add_argument(
         "-input_force_list",
         help="Text file containing id_dam,dam_name to force the processing of these dams.",
         default=None,
     )
+    add_scheduler_arguments(parser_camp)
     # mode autovalidation
     # lancer les 40  fichiers json andalousie & occitanie
     parser_ref = sub_parsers.add_parser(
@@ -338,7 +878,9 @@ def process_parameters():
         help="3- Launch the pre-designed Andalousie and /or Occitanie campaign.",
     )
     parser_ref.add_argument(
-        "-name", help="name the output folder", default=get_current_git_rev()
+        "-name",
+        help="name the output folder, the current git revision by default",
+        default=None,
     )
     parser_ref.add_argument(
         "-output_folder", help="path to store outputs", required=True
@@ -358,13 +900,22 @@ def process_parameters():
         default="Slurm",
         choices=["local", "PBS", "Slurm"],
     )
+    parser_ref.add_argument(
+        "-stage_cache",
+        default=None,
+        help="Folder of stage results shared between reference campaigns",
+    )
+    add_scheduler_arguments(parser_ref)
     # mode DAM unique
     # dem4water --json agly.json
     parser_single = sub_parsers.add_parser(
         "single", help="2- Single mode, process one dam"
     )
     parser_single.add_argument(
-        "-dam_json", help="Configuration for an unique dam", required=True
+        "-dam_json",
+        nargs="+",
+        help="Configuration for an unique dam, or dams processed one after the other",
+        required=True,
     )
     parser_single.add_argument(
         "-scheduler_type",
@@ -372,12 +923,137 @@ def process_parameters():
         default="Slurm",
         choices=["local", "PBS", "Slurm"],
     )
+    parser_single.add_argument(
+        "-force",
+        action="store_true",
+        help="Run all the stages, even those unchanged since their last run",
+    )
+    # mode fit models
+    # refit all dams of a campaign from their S(Zi) files
+    parser_fit = sub_parsers.add_parser(
+        "fit-models",
+        help="4- Fit the models of a campaign from existing S(Zi) files, without plots.",
+    )
+    parser_fit.add_argument(
+        "-campaign_path",
+        help="Campaign output path, containing the camp folder",
+        required=True,
+    )
+    parser_fit.add_argument(
+        "-outfile", help="Output table (.csv or .parquet)", required=True
+    )
+    parser_fit.add_argument(
+        "-json_campaign",
+        help="Campaign configuration file providing the szi_to_model parameters",
+        default=None,
+    )
+    parser_fit.add_argument(
+        "-workers", type=int, default=None, help="Number of processes"
+    )
+    # mode sweep
+    # rank szi_to_model parameter sets against references
+    parser_sweep = sub_parsers.add_parser(
+        "sweep",
+        help="5- Rank szi_to_model parameter sets on existing S(Zi) files.",
+    )
+    parser_sweep.add_argument("-config", help="Sweep configuration file", required=True)
+    parser_sweep.add_argument("-outdir", help="Output folder", required=True)
+    parser_sweep.add_argument(
+        "-workers", type=int, default=None, help="Number of processes"
+    )
+    # mode validate
+    # compare all the models of a campaign to the reference
+    parser_val = sub_parsers.add_parser(
+        "validate",
+        help="6- Compare all the models of a campaign to a reference file.",
+    )
+    parser_val.add_argument(
+        "-campaign_path",
+        help="Campaign output path, containing the camp folder",
+        required=True,
+    )
+    parser_val.add_argument(
+        "-reffile", help="validation_DB.json file in SI units", required=True
+    )
+    parser_val.add_argument("-outfile", help="Output json file", required=True)
+    parser_val.add_argument(
+        "-plots",
+        default="none",
+        choices=["none", "minimal", "full", "deferred"],
+        help="Report figures written in the folder of each dam",
+    )
+    # mode render-plots
+    # draw the figures recorded in deferred plots mode
+    parser_render = sub_parsers.add_parser(
+        "render-plots",
+        help="7- Draw the figures recorded by a campaign run with deferred plots.",
+    )
+    parser_render.add_argument(
+        "-campaign_path",
+        help="Campaign output path, containing the camp folder",
+        required=True,
+    )
+    parser_render.add_argument(
+        "-dams", nargs="+", default=None, help="Dam folders to render, all if omitted"
+    )
+    parser_render.add_argument(
+        "-outdir",
+        default=None,
+        help="Output folder, next to the plots files if omitted",
+    )
+    parser_render.add_argument(
+        "-dpi", type=int, default=None, help="Figures resolution"
+    )
+    parser_render.add_argument(
+        "-workers", type=int, default=None, help="Number of processes"
+    )
+
+    # mode worker
+    # pull the dams of a campaign manifest until none is left
+    parser_worker = sub_parsers.add_parser(
+        "worker",
+        help="8- Process the dams of a campaign manifest until none is left to claim.",
+    )
+    parser_worker.add_argument("-manifest", help="Campaign manifest", required=True)
+    parser_worker.add_argument(
+        "-worker_id", default=None, help="Name of the worker, <host>_<pid> by default"
+    )
+    parser_worker.add_argument(
+        "-timeout", type=float, default=None, help="Maximum duration of a dam (s)"
+    )
+    parser_worker.add_argument(
+        "-max_memory", type=float, default=None, help="Maximum memory of a dam (GB)"
+    )
+    parser_worker.add_argument(
+        "-lease",
+        type=float,
+        default=600,
+        help="Duration (s) after which the claim of an interrupted worker is taken over",
+    )
+    parser_worker.add_argument(
+        "-status", action="store_true", help="Print the queue status and exit"
+    )
+
+    # mode cost model
+    # fit the walltime and memory model used by -cost_model
+    parser_cost = sub_parsers.add_parser(
+        "cost-model",
+        help="9- Fit the runtime and memory model of the dams on past campaigns.",
+    )
+    parser_cost.add_argument(
+        "-campaign_path",
+        nargs="+",
+        help="Campaign output paths, containing the camp folder",
+        required=True,
+    )
+    parser_cost.add_argument("-outfile", help="Output model (.json)", required=True)
 
     return parser
 
 
 def main():
     """."""
+    # pylint: disable=import-outside-toplevel
     parser = process_parameters()
     args = parser.parse_args()
 
@@ -390,28 +1066,82 @@ def main():
             args.ram,
             args.cpu,
             args.input_force_list,
+            **scheduler_options(parser, args),
         )
     elif args.mode == "single":
-        launch_single(
+        return launch_single(
             args.dam_json,
             args.scheduler_type,
             args.walltime_hour,
             args.walltime_minutes,
             args.ram,
             args.cpu,
+            args.force,
         )
     elif args.mode == "camp_ref":
         launch_reference_validation_campaign(
             args.sites,
             args.output_folder,
-            args.name,
+            args.name if args.name is not None else get_current_git_rev(),
             args.scheduler_type,
             args.walltime_hour,
             args.walltime_minutes,
             args.ram,
             args.cpu,
             args.only_ref,
+            args.stage_cache,
+            **scheduler_options(parser, args),
+        )
+    elif args.mode == "fit-models":
+        from dem4water.fit_models import fit_models
+
+        fit_models(
+            args.campaign_path,
+            args.outfile,
+            args.json_campaign,
+            args.workers,
+            args.debug,
+        )
+    elif args.mode == "sweep":
+        from dem4water.sweep_models import sweep_models
+
+        sweep_models(args.config, args.outdir, args.workers, args.debug)
+    elif args.mode == "validate":
+        from dem4water.val_report import val_report_campaign
+
+        val_report_campaign(
+            args.campaign_path, args.reffile, args.outfile, args.plots, args.debug
         )
+    elif args.mode == "worker":
+        from dem4water.orchestration.work_queue import queue_status, run_worker
+
+        if args.status:
+            print(json.dumps(queue_status(args.manifest, args.lease), indent=4))
+        else:
+            run_worker(
+                args.manifest,
+                args.worker_id,
+                args.timeout,
+                args.max_memory,
+                args.debug,
+                args.lease,
+            )
+    elif args.mode == "cost-model":
+        from dem4water.orchestration.cost_model import fit_cost_model
+
+        fit_cost_model(args.campaign_path, args.outfile, args.debug)
+    elif args.mode == "render-plots":
+        from dem4water.render_plots import render_plots
+
+        render_plots(
+            args.campaign_path,
+            args.dams,
+            args.outdir,
+            args.dpi,
+            args.workers,
+            args.debug,
+        )
+    return 0
 
 
 if __name__ == "__main__":
@@ -5,10 +5,13 @@ import json
 import logging
 import math
 import sys
-from statistics import median
+from dataclasses import dataclass, replace
+from statistics import NormalDist, median
+from typing import Optional
 
 import geopandas as gpd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 logger = logging.getLogger("compute_model")
 log = logging.getLogger()
@@ -17,54 +20,105 @@ logging.getLogger("geopandas").setLevel(logging.WARNING)
 
 
 
-def remove_jump_szi(infile, z_i=None, s_zi=None, jump_ratio=4):
-    """Use a ratio to remove first jump found.
+@dataclass
+class SziSeries:
+    """Class holding the S(Z_i) values of a dam, read once from its SZi.dat file.
 
-    PARAMETERS
-    ---------
-    args: argparse object
-    z_i: optional list of altitude
-    s_zi: optional list of surface
-    jump_ratio: ratio between current and previous surface.
+    ``z_i`` and ``s_zi`` keep the file order: decreasing elevations, the PDB
+    being the last value. ``water_body_area`` is the area of the dam in the
+    database, read along with the file when the database is provided.
     """
-    if z_i is None and s_zi is None:
-        print(infile)
-        data = np.loadtxt(infile)
 
+    z_i: np.ndarray
+    s_zi: np.ndarray
+    szi_file: Optional[str] = None
+    water_body_area: Optional[float] = None
+
+    @classmethod
+    def from_file(cls, infile, database=None):
+        """Read a SZi.dat file, and the water body area if a database is given."""
+        data = np.loadtxt(infile)
         if data.size <= 2:
             logger.error(f"Not enough S(Zi) data inside file {infile}")
             sys.exit("Error")
+        water_body_area = None
+        if database is not None:
+            water_body = gpd.read_file(database)
+            water_body_area = water_body.geometry.area.values[0]
+            logger.info(f"water body area: {water_body_area}")
+        return cls(data[:, 0], data[:, 1], infile, water_body_area)
+
+    def subset(self, index):
+        """Return the series restricted to an index, a slice or a mask."""
+        return replace(self, z_i=self.z_i[index], s_zi=self.s_zi[index])
 
-        z_i = data[:, 0]
-        s_zi = data[:, 1]
+    def remove_jump(self, jump_ratio=4):
+        """Use a ratio to remove the values before the first jump found.
 
-    # remove outliers / virtual surface overflow
-    stop_i = 0
-    break_found = False
-    prev = s_zi[1]
-    for s_z in s_zi:
-        if s_z != 0:
-            ratio = prev / s_z
+        A jump is found when a surface is jump_ratio times smaller than the
+        previous one (than the second one for the first value).
+        """
+        prev = np.concatenate((self.s_zi[1:2], self.s_zi[:-1]))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratio = np.where(self.s_zi != 0, prev / self.s_zi, 1)
+        # written as a negation to stop on NaN ratios too
+        jumps = np.flatnonzero(~(ratio < jump_ratio))
+        if jumps.size == 0:
+            logger.debug("No outliers detected, keeping all S_ZI data.")
+            return self
+        logger.debug(
+            f"Dropping S_ZI after index {jumps[0]} with a delta ratio of "
+            f"{ratio[jumps[0]]}."
+        )
+        return self.subset(slice(jumps[0], None))
+
+    def filter_area(self, max_elev, min_elev, area_threshold=15):
+        """Remove the surfaces smaller than area_threshold % of the water body.
+
+        The last value, the PDB, is always kept.
+        """
+        if self.water_body_area is None:
+            raise ValueError(
+                f"No water body area for {self.szi_file}, a database is required."
+            )
+        thres_wb = (self.water_body_area * area_threshold) / 100
+        logger.info(f"Minimal surface allowed : {thres_wb}")
+        # zi[-1] is the PDB Alt are stored in reverse order
+        zi_min = self.z_i[-2]
+        zi_max = self.z_i[1]
+        if zi_max > max_elev:
+            logger.info("Too high contour detected filter S_ZI data")
         else:
-            ratio = 1
-        if ratio < jump_ratio:
-            prev = s_z
-            stop_i = stop_i + 1
+            logger.info("Contour seems correct for max bound. Process")
+        if zi_min < min_elev:
+            logger.info("Too low contour detected filter S_ZI data")
         else:
-            break_found = True
-            break
+            logger.info("Contour seems correct for min bound. Process")
 
-    if break_found is True:
+        keep = np.append(self.s_zi[:-1] > thres_wb, True)
+        for val_zi, val_szi in zip(self.z_i[~keep], self.s_zi[~keep]):
+            logger.info(
+                f"Szi {val_szi} for altitude {val_zi} is too small. Check the cutline."
+            )
+        return self.subset(keep)
 
-        logger.debug(
-            f"Dropping S_ZI after index {stop_i} with a delta ratio of {ratio}."
-        )
-        z_i = z_i[stop_i:]
-        s_zi = s_zi[stop_i:]
-    else:
-        logger.debug("No outliers detected, keeping all S_ZI data.")
 
-    return z_i, s_zi
+def remove_jump_szi(infile, z_i=None, s_zi=None, jump_ratio=4):
+    """Use a ratio to remove first jump found.
+
+    PARAMETERS
+    ---------
+    args: argparse object
+    z_i: optional list of altitude
+    s_zi: optional list of surface
+    jump_ratio: ratio between current and previous surface.
+    """
+    if z_i is None and s_zi is None:
+        series = SziSeries.from_file(infile)
+    else:
+        series = SziSeries(np.asarray(z_i, dtype=float), np.asarray(s_zi, dtype=float))
+    series = series.remove_jump(jump_ratio)
+    return series.z_i, series.s_zi
 
 
 def filter_szi(
@@ -78,46 +132,12 @@ def filter_szi(
     area_threshold=15,
 ):
     """Filter szi looking at the watermap."""
-    data = np.loadtxt(infile)
-    if data.size <= 2:
-        logger.error(f"Not enough S(Zi) data inside file {infile}")
-        sys.exit("Error")
-
-    z_i = data[:, 0]
-    s_zi = data[:, 1]
-    water_body = gpd.read_file(database)
-    water_body_area = water_body.geometry.area.values[0]
     # shp_wmap = wb.create_water_mask(watermap, water_map_thres)
     # water_body_area = wb.compute_area_from_water_body(daminfo, shp_wmap)
     # water_body_area = wb.compute_area_from_database_geom(database, damname, shp_wmap)
-    logger.info(f"water body area: {water_body_area}")
-    thres_wb = (water_body_area * area_threshold) / 100
-    logger.info(f"Minimal surface allowed : {thres_wb}")
-    # zi[-1] is the PDB Alt are stored in reverse order
-    zi_min = z_i[-2]
-    zi_max = z_i[1]
-    if zi_max > max_elev:
-        logger.info("Too high contour detected filter S_ZI data")
-    else:
-        logger.info("Contour seems correct for max bound. Process")
-    if zi_min < min_elev:
-        logger.info("Too low contour detected filter S_ZI data")
-    else:
-        logger.info("Contour seems correct for min bound. Process")
-
-    filter_zi_out = []
-    filter_szi_out = []
-    for val_zi, val_szi in zip(z_i[:-1], s_zi[:-1]):
-        if val_szi > thres_wb:
-            filter_zi_out.append(val_zi)
-            filter_szi_out.append(val_szi)
-        else:
-            logger.info(
-                f"Szi {val_szi} for altitude {val_zi} is too small. Check the cutline."
-            )
-    filter_szi_out.append(s_zi[-1])
-    filter_zi_out.append(z_i[-1])
-    return filter_zi_out, filter_szi_out
+    series = SziSeries.from_file(infile, database)
+    series = series.filter_area(max_elev, min_elev, area_threshold)
+    return series.z_i, series.s_zi
 
 
 def get_info_dam(daminfo):
@@ -137,25 +157,14 @@ def get_info_dam(daminfo):
 
 def select_lower_szi(z_i, sz_i, damelev, max_offset, winsize):
     """Select all valid point under the damelev to find law."""
-    filtered_szi = [
-        szi for zi_, szi in zip(z_i, sz_i) if zi_ < float(damelev) + float(max_offset)
-    ]
-    filtered_zi = [
-        zi_ for zi_, szi in zip(z_i, sz_i) if zi_ < float(damelev) + float(max_offset)
-    ]
+    z_i = np.asarray(z_i, dtype=float)
+    sz_i = np.asarray(sz_i, dtype=float)
+    lower = z_i < float(damelev) + float(max_offset)
     # Add 1 to winsize as the first point is Z0, and it must not be used as a valid point
     # to compute model
-    if len(filtered_szi) < winsize + 1:
-        if len(z_i) > winsize + 1:
-            filtered_szi = sz_i[: winsize + 1]
-            filtered_zi = z_i[: winsize + 1]
-        else:
-            filtered_szi = sz_i[:]
-            filtered_zi = z_i[:]
-    else:
-        filtered_szi = filtered_szi[: winsize + 1]
-        filtered_zi = filtered_zi[: winsize + 1]
-    return filtered_zi, filtered_szi
+    if np.count_nonzero(lower) < winsize + 1:
+        return z_i[: winsize + 1], sz_i[: winsize + 1]
+    return z_i[lower][: winsize + 1], sz_i[lower][: winsize + 1]
 
 
 def compute_model(z_i, s_zi, z_0, s_z0):
@@ -175,3 +184,136 @@ def compute_model(z_i, s_zi, z_0, s_z0):
     logger.info(f"MAE computed: {mae}")
 
     return alpha, beta, mae, poly
+
+
+@dataclass
+class ModelBatch:
+    """Class providing the models computed on a batch of S(Z_i) windows.
+
+    Each attribute has one value per window, ``poly`` rows being the
+    [slope, intercept] of the linear fit like ``np.polyfit``.
+    """
+
+    alpha: np.ndarray
+    beta: np.ndarray
+    mae: np.ndarray
+    poly: np.ndarray
+    z_med: np.ndarray
+    s_med: np.ndarray
+
+
+def compute_model_batch(z_win, s_win, z_0, s_z0):
+    """Compute models from a 2-D array of windows, one window per row.
+
+    Vectorized equivalent of compute_model: the linear slope is computed in closed
+    form from the centered window sums, then alpha, beta and the local MAE of every
+    window are derived at once.
+    """
+    z_win = np.asarray(z_win, dtype=float)
+    s_win = np.asarray(s_win, dtype=float)
+    z_med = np.median(z_win, axis=1)
+    s_med = np.median(s_win, axis=1)
+    z_mean = np.mean(z_win, axis=1)
+    s_mean = np.mean(s_win, axis=1)
+    z_cent = z_win - z_mean[:, np.newaxis]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slope = np.sum(z_cent * (s_win - s_mean[:, np.newaxis]), axis=1) / np.sum(
+            z_cent**2, axis=1
+        )
+        beta = slope * (z_med - z_0) / (s_med - s_z0)
+        alpha = slope * np.power(z_med - z_0, 1 - beta) / beta
+        surf = s_z0 + alpha[:, np.newaxis] * np.power(z_win - z_0, beta[:, np.newaxis])
+        mae = np.mean(np.abs(s_win - surf), axis=1)
+    poly = np.column_stack((slope, s_mean - slope * z_mean))
+
+    return ModelBatch(alpha, beta, mae, poly, z_med, s_med)
+
+
+def compute_sliding_models(z_i, s_zi, z_0, s_z0, winsize):
+    """Compute the model of every window of ``winsize`` consecutive S(Z_i)."""
+    logger.info(f"Local models computed using windows of {winsize} values.")
+    return compute_model_batch(
+        sliding_window_view(np.asarray(z_i, dtype=float), winsize),
+        sliding_window_view(np.asarray(s_zi, dtype=float), winsize),
+        z_0,
+        s_z0,
+    )
+
+
+def resample_indices(nb_values, method="bootstrap", nb_resamples=1000, seed=None):
+    """Build the 2-D index array of the resamples of a window, one per row.
+
+    bootstrap draws nb_resamples rows of nb_values indices with replacement,
+    jackknife gives the nb_values rows leaving one value out.
+    """
+    if method == "bootstrap":
+        rng = np.random.default_rng(seed)
+        return rng.integers(0, nb_values, size=(nb_resamples, nb_values))
+    if method == "jackknife":
+        return np.broadcast_to(np.arange(nb_values), (nb_values, nb_values))[
+            ~np.eye(nb_values, dtype=bool)
+        ].reshape(nb_values, nb_values - 1)
+    raise ValueError(f"{method} is not a known resampling method")
+
+
+def jackknife_interval(estimate, values, confidence=95):
+    """Return the normal interval of an estimate from its leave-one-out values.
+
+    The standard error is sqrt((n - 1) / n * sum((values - mean)^2)), None if
+    it can not be computed.
+    """
+    if values.size < 2 or not np.isfinite(estimate):
+        return None
+    std_error = math.sqrt(
+        (values.size - 1) / values.size * np.sum((values - values.mean()) ** 2)
+    )
+    half_width = NormalDist().inv_cdf(0.5 + confidence / 200) * std_error
+    return [float(estimate - half_width), float(estimate + half_width)]
+
+
+def compute_model_intervals(
+    z_i, s_zi, z_0, s_z0, method="bootstrap", nb_resamples=None, confidence=95, seed=None
+):
+    """Compute confidence intervals of the model parameters by resampling.
+
+    All the resamples of the S(Z_i) window are fitted at once with
+    compute_model_batch. Degenerated resamples (a single elevation drawn) give
+    NaN parameters and are ignored. bootstrap gives percentile intervals over
+    nb_resamples resamples (1000 if None), jackknife gives standard error
+    intervals around the fit of the whole window, its resamples being the
+    leave-one-out windows (nb_resamples can not be set).
+
+    Returns
+    -------
+    a dict with the [low, high] interval of alpha, beta and mae, None when it
+    can not be computed, and the number of valid resamples
+    """
+    if method == "jackknife" and nb_resamples is not None:
+        raise ValueError("jackknife has one resample per value, nb_resamples can not be set")
+    if nb_resamples is None:
+        nb_resamples = 1000
+    z_i = np.asarray(z_i, dtype=float)
+    s_zi = np.asarray(s_zi, dtype=float)
+    index = resample_indices(len(z_i), method, nb_resamples, seed)
+    models = compute_model_batch(z_i[index], s_zi[index], z_0, s_z0)
+    valid = np.isfinite(models.alpha) & np.isfinite(models.beta)
+    intervals = {"method": method, "confidence": confidence, "resamples": len(index)}
+    intervals["valid_resamples"] = int(np.count_nonzero(valid))
+    if method == "jackknife":
+        full = compute_model_batch(z_i[np.newaxis], s_zi[np.newaxis], z_0, s_z0)
+    bounds = [(100 - confidence) / 2, 100 - (100 - confidence) / 2]
+    for name in ["alpha", "beta", "mae"]:
+        values = getattr(models, name)[valid]
+        if method == "jackknife":
+            intervals[name] = jackknife_interval(
+                getattr(full, name)[0], values, confidence
+            )
+        else:
+            intervals[name] = (
+                np.percentile(values, bounds).tolist() if values.size else None
+            )
+    logger.info(
+        f"{method} {confidence}% intervals over {intervals['valid_resamples']} "
+        f"resamples: alpha {intervals['alpha']} - beta {intervals['beta']}"
+    )
+    return intervals
@@ -11,16 +11,17 @@ from time import perf_counter
 
 import geopandas as gpd
 import numpy as np
-import pandas as pd
 import rasterio as rio
-
 import shapely
 import shapely.wkt
 from osgeo import gdal, ogr, osr
+from rasterio import features, windows
+from rasterio.mask import mask
+from scipy import ndimage
 from shapely.geometry import shape
 from shapely.ops import polygonize, split, unary_union
 
-from dem4water.plot_lib import plot_szi_points
+from dem4water.plot_record import PLOTS_SUFFIX, get_plotter
 
 
 logger = logging.getLogger("cut_contourlines")
@@ -171,63 +172,268 @@ def ensure_elev_in_dem(dem, start_elev, target_elev, pdb_alt):
         return start_elev, target_elev
 
 
+def shrink_dem_to_reservoir(dem, line, in_w, target_elev, out_file, margin=2):
+    """Restrict the DEM to the valley hydrologically connected to the reservoir.
+
+    Only pixels lower than ``target_elev`` and connected to the insider point are
+    kept, the cutline acting as a barrier between the reservoir and the valley
+    downstream. The component is dilated by ``margin`` pixels so that contours
+    close to the target elevation and to the cutline are still interpolated
+    correctly, every other pixel is set to nodata and the raster is cropped to the
+    bounding window of the component.
+
+    Parameters
+    ----------
+    dem:
+        the DEM extract
+    line:
+        the cutline as a shapely geometry, in the DEM projection
+    in_w:
+        a point inside the water body, in the DEM projection
+    target_elev:
+        the highest elevation used for contour generation
+    out_file:
+        the reduced DEM file
+    margin:
+        the number of pixels kept around the connected component
+
+    Returns
+    -------
+    the reduced DEM file, or the input DEM if no valid component is found
+    """
+    with rio.open(dem) as dem_raster:
+        dem_array = dem_raster.read(1)
+        profile = dem_raster.profile
+        transform = dem_raster.transform
+        nodata = dem_raster.nodata if dem_raster.nodata is not None else -10000
+        row, col = dem_raster.index(in_w.x, in_w.y)
+
+    valid = dem_array != nodata
+    barrier = features.rasterize(
+        [(line, 1)],
+        out_shape=dem_array.shape,
+        transform=transform,
+        all_touched=True,
+        dtype="uint8",
+    ).astype(bool)
+    candidates = valid & (dem_array <= target_elev) & ~barrier
+    if not (0 <= row < dem_array.shape[0] and 0 <= col < dem_array.shape[1]):
+        logger.warning("Insider point is outside the DEM. Keep the whole DEM.")
+        return dem
+    if not candidates[row, col]:
+        logger.warning(
+            f"Insider point elevation {dem_array[row, col]} is not under the target "
+            f"elevation {target_elev}. Keep the whole DEM."
+        )
+        return dem
+    # 4-connectivity: the rasterized cutline (all_touched) is a tight barrier
+    labels, _ = ndimage.label(candidates)
+    component = labels == labels[row, col]
+    component = ndimage.binary_dilation(component, iterations=margin) & valid
+
+    rows = np.flatnonzero(component.any(axis=1))
+    cols = np.flatnonzero(component.any(axis=0))
+    window = windows.Window(
+        cols[0], rows[0], cols[-1] - cols[0] + 1, rows[-1] - rows[0] + 1
+    )
+    reduced = np.where(component, dem_array, nodata)[window.toslices()]
+    logger.info(
+        f"DEM reduced to the connected valley: {reduced.shape} pixels"
+        f" instead of {dem_array.shape} ({np.count_nonzero(component)} valid)."
+    )
+    profile.update(
+        {
+            "height": reduced.shape[0],
+            "width": reduced.shape[1],
+            "transform": windows.transform(window, transform),
+            "nodata": nodata,
+            "driver": "GTiff",
+        }
+    )
+    with rio.open(out_file, "w", **profile) as out_raster:
+        out_raster.write(reduced, 1)
+    return out_file
+
+
+def simplify_contour(polygon, tolerance, elev):
+    """Simplify a contour polygon while preserving its topology.
+
+    Every vertex of the simplified boundary lies within ``tolerance`` of the
+    original one, so the area error is bounded by the area of the band of width
+    ``tolerance`` around the original rings: 2 * tolerance * perimeter plus a disk
+    of radius ``tolerance`` per ring.
+
+    Parameters
+    ----------
+    polygon:
+        the contour polygon of one level
+    tolerance:
+        the simplification tolerance in meters
+    elev:
+        the level elevation, only used for logging
+
+    Returns
+    -------
+    the simplified polygon, the measured area error and its bound
+    """
+    simplified = polygon.simplify(tolerance, preserve_topology=True)
+    nb_rings = shapely.get_num_interior_rings(polygon) + 1
+    area_error = abs(simplified.area - polygon.area)
+    area_error_bound = 2 * tolerance * polygon.length + np.pi * tolerance**2 * nb_rings
+    logger.info(
+        f"Elevation: {elev}m - Simplified from "
+        f"{shapely.get_num_coordinates(polygon)} to "
+        f"{shapely.get_num_coordinates(simplified)} vertices - "
+        f"Area error: {area_error} m2 (bound: {area_error_bound} m2)"
+    )
+    return simplified, area_error, area_error_bound
+
+
+def read_dem_under_polygon(dem, polygon):
+    """Read the DEM window of a polygon to compute volumes under its inner levels.
+
+    Returns
+    -------
+    the DEM values masked outside the polygon, the window transform and the
+    pixel area
+    """
+    with rio.open(dem) as dem_raster:
+        dem_array, transform = mask(dem_raster, [polygon], crop=True, filled=False)
+        pixel_area = abs(dem_raster.res[0] * dem_raster.res[1])
+    return dem_array[0].astype(np.float64), transform, pixel_area
+
+
+def volume_under_polygon(elev, polygon, dem_array, transform, pixel_area):
+    """Compute the volume of water under ``elev`` within a level polygon.
+
+    The volume is the sum of (elev - DEM) over the pixels of the polygon lower
+    than elev, so that the pits of the DEM window outside the reservoir level
+    are not counted. polygon must lie within the window of dem_array.
+    """
+    inside = features.geometry_mask(
+        [polygon], dem_array.shape, transform, all_touched=False, invert=True
+    )
+    values = dem_array.data[inside & ~np.ma.getmaskarray(dem_array)]
+    values = values[values < elev]
+    return float(pixel_area * np.sum(elev - values))
+
+
 def create_contour_lines(
-    dem, elev_sampling, start_elev, end_elev, tmp_path, level_file
+    dem, elev_sampling, start_elev, end_elev, level_file, simplify_tolerance=0
 ):
+    """Generate the contour polygon of each level, from the highest to the lowest.
+
+    Each level is computed in memory, keeping only its largest polygon, appended to
+    ``level_file`` and yielded as soon as it is available, so that only one level
+    geometry is held at a time.
+
+    Yields
+    ------
+    the level elevation and its polygon
+    """
     ds = gdal.Open(dem)
+    band = ds.GetRasterBand(1)
     proj = osr.SpatialReference(wkt=ds.GetProjection())
-    list_gdf = []
-    list_temp_file_to_remove = []
-    for elev in range(start_elev, end_elev, elev_sampling):
-        output_shp = os.path.join(tmp_path, f"contour_{elev}.gpkg")
-        ogr_ds = ogr.GetDriverByName("GPKG").CreateDataSource(output_shp)
-        ogr_lyr = ogr_ds.CreateLayer("contour", geom_type=ogr.wkbMultiPolygon, srs=proj)
-        field_defn = ogr.FieldDefn("ID", ogr.OFTInteger)
-        ogr_lyr.CreateField(field_defn)
-        field_defn = ogr.FieldDefn("elevMin", ogr.OFTReal)
-        ogr_lyr.CreateField(field_defn)
-        field_defn = ogr.FieldDefn("level", ogr.OFTReal)
-        ogr_lyr.CreateField(field_defn)
-
-        gdal.ContourGenerateEx(
-            ds.GetRasterBand(1),
-            ogr_lyr,
-            options=[
-                f"FIXED_LEVELS={elev}",
-                "ID_FIELD=0",
-                "ELEV_FIELD_MIN=1",
-                "ELEV_FIELD_MAX=2",
-                "POLYGONIZE=TRUE",
-                f"NODATA={ds.GetRasterBand(1).GetNoDataValue()}",
-            ],
+    # Tolerance is provided in pixels
+    tolerance = simplify_tolerance * abs(ds.GetGeoTransform()[1])
+
+    level_ds = ogr.GetDriverByName("GeoJSON").CreateDataSource(level_file)
+    level_lyr = level_ds.CreateLayer("contour", geom_type=ogr.wkbPolygon, srs=proj)
+    for name, field_type in [
+        ("ID", ogr.OFTInteger),
+        ("elevMin", ogr.OFTReal),
+        ("level", ogr.OFTReal),
+        ("area_error", ogr.OFTReal),
+        ("area_error_bound", ogr.OFTReal),
+    ]:
+        level_lyr.CreateField(ogr.FieldDefn(name, field_type))
+    try:
+        for elev in reversed(range(start_elev, end_elev, elev_sampling)):
+            mem_ds = ogr.GetDriverByName("Memory").CreateDataSource(f"contour_{elev}")
+            mem_lyr = mem_ds.CreateLayer(
+                "contour", geom_type=ogr.wkbMultiPolygon, srs=proj
+            )
+            mem_lyr.CreateField(ogr.FieldDefn("ID", ogr.OFTInteger))
+            mem_lyr.CreateField(ogr.FieldDefn("elevMin", ogr.OFTReal))
+            mem_lyr.CreateField(ogr.FieldDefn("level", ogr.OFTReal))
+
+            gdal.ContourGenerateEx(
+                band,
+                mem_lyr,
+                options=[
+                    f"FIXED_LEVELS={elev}",
+                    "ID_FIELD=0",
+                    "ELEV_FIELD_MIN=1",
+                    "ELEV_FIELD_MAX=2",
+                    "POLYGONIZE=TRUE",
+                    f"NODATA={band.GetNoDataValue()}",
+                ],
+            )
+            # Remove small surface not related with the biggest
+            parts = shapely.get_parts(
+                [
+                    shapely.from_wkb(bytes(feat.GetGeometryRef().ExportToWkb()))
+                    for feat in mem_lyr
+                    if feat.GetField("level") == elev
+                ]
+            )
+            mem_ds = None
+            if len(parts) == 0:
+                logger.info(f"Contour is empty. Ignore surface for {elev}.")
+                continue
+            # Ensure no multipolygon
+            polygon = parts[np.argmax(shapely.area(parts))]
+            del parts
+            area_error = area_error_bound = 0.0
+            if tolerance > 0:
+                polygon, area_error, area_error_bound = simplify_contour(
+                    polygon, tolerance, elev
+                )
+
+            feat = ogr.Feature(feature_def=level_lyr.GetLayerDefn())
+            feat.SetGeometryDirectly(ogr.CreateGeometryFromWkb(shapely.to_wkb(polygon)))
+            feat.SetField("ID", elev)
+            feat.SetField("level", elev)
+            feat.SetField("area_error", area_error)
+            feat.SetField("area_error_bound", area_error_bound)
+            level_lyr.CreateFeature(feat)
+            feat = None
+            yield float(elev), polygon
+    finally:
+        level_ds = None
+
+
+def read_contour_lines(level_file):
+    """Read the contour polygons of a level file one level at a time.
+
+    Yields
+    ------
+    the level elevation and its polygon
+    """
+    level_ds = ogr.Open(level_file)
+    for feat in level_ds.GetLayer():
+        yield float(feat.GetField("level")), shapely.from_wkb(
+            bytes(feat.GetGeometryRef().ExportToWkb())
         )
-        ogr_ds = None
-        del ogr_ds
-        # Remove small surface not related with the biggest
-        gdf = gpd.read_file(output_shp)
-        gdf = gdf.loc[gdf.level == elev]
-        gdf = gdf.explode(ignore_index=True)
-        # Ensure no multipolygon
-        gdf = gdf.loc[gdf.area == np.max(gdf.area)]
-        if not gdf.empty:
-            gdf.to_file(output_shp)
-            list_gdf.append(gdf)
-        else:
-            logger.info(f"{output_shp} is empty. Ignore surface for {elev}.")
-        list_temp_file_to_remove.append(output_shp)
-    # reverse to store them in a visual convenience
-
-    list_gdf.reverse()
-    gdf_final = pd.concat(list_gdf)
-    gdf_final.to_file(level_file)
-    for file_to_rm in list_temp_file_to_remove:
-        os.remove(file_to_rm)
+    level_ds = None
 
 
 def generate_countourlines(
-    cache, dam_path, elev_sampling, dam_elev, elevoffset, dem, pdb_elev, tmp
+    cache,
+    dam_path,
+    elev_sampling,
+    dam_elev,
+    elevoffset,
+    dem,
+    pdb_elev,
+    tmp,
+    simplify_tolerance=0,
 ):
-    """Generate countourlines using gdal."""
+    """Generate countourlines using gdal.
+
+    The contour file is written to the cache while the returned generator of
+    (elevation, polygon) is consumed.
+    """
     logger.debug("No contour line provided, generating to cache.")
     # Generate contour lines from DEM
     logger.debug(
@@ -255,6 +461,7 @@ def generate_countourlines(
     logger.info(f"end elev: {end_elev} ")
     logger.info(f"output file: {level_file} ")
     logger.info(f"TMPDIR: {tmp} ")
+    logger.info(f"simplify tolerance: {simplify_tolerance} pixels")
 
 
     if start_elev > end_elev:
@@ -262,14 +469,20 @@ def generate_countourlines(
             f"Start elevation {start_elev} is upper than target_elev {end_elev}"
         )
 
-    create_contour_lines(dem, elev_sampling, start_elev, end_elev, cache, level_file)
     # path for auxillary script
     # script_path = os.path.dirname(__file__)
     # os.system(
     #     f"{script_path}/gen_contourline_polygons.sh {dem} {int(pdb_elev - elev_margin)} "
     #     f"{elevsampling} {int(target_elev + elev_margin)} {contourline_fname} {tmp}"
     # )
-    return level_file
+    return create_contour_lines(
+        dem,
+        elev_sampling,
+        start_elev,
+        end_elev,
+        level_file,
+        simplify_tolerance,
+    )
 
 
 def cut_countourlines(
@@ -283,10 +496,15 @@ def cut_countourlines(
     tmp,
     out,
     mode,
+    roi_shrink=False,
+    simplify_tolerance=0,
     debug=False,
-
+    plots="full",
 ):
-    """Cut contour lines based on the cutline to estimate the virtual water surface."""
+    """Cut contour lines based on the cutline to estimate the virtual water surface.
+
+    The S(Z_i) plot is drawn unless plots is none.
+    """
     t1_start = perf_counter()
     logging_format = (
         "%(asctime)s - %(filename)s:%(lineno)s - %(levelname)s - %(message)s"
@@ -341,7 +559,15 @@ def cut_countourlines(
 
 
     if level is None:
-        level = generate_countourlines(
+        if roi_shrink is True:
+            dem = shrink_dem_to_reservoir(
+                dem,
+                line,
+                in_w,
+                float(dam_elev) + float(elevoffset),
+                os.path.join(tmp, f"dem_roi_{dam_path}.tif"),
+            )
+        levels = generate_countourlines(
             cache,
             dam_path,
             elevsampling,
@@ -350,60 +576,84 @@ def cut_countourlines(
             dem,
             pdb_elev,
             tmp,
+            simplify_tolerance,
         )
+    else:
+        # If provided, load GeoJSON file containing contour lines
+        logger.debug("Using provided contour line file.")
+        levels = read_contour_lines(level)
 
-    # If provided, load GeoJSON file containing contour lines
-    logger.debug("Using provided contour line file.")
-
-    with open(level, "r", encoding="utf-8") as lvl:
-        jsl = json.load(lvl)
-
+    shapely.prepare(line)
     r_id = 1
     r_elev = []
     r_area = []
 
-    for feature in jsl["features"]:
-        level = shape(feature["geometry"])
-        results = split(level, line)
-        found = False
-        max_area = -10000
-        max_elev = float(feature["properties"]["level"])
-        for poly in results.geoms:
-            if poly.contains(in_w):
-                max_area = poly.area
-                # max_elev = float(feature["properties"]["level"])
-                found = True
-                logger.info(f"Elevation: {max_elev}m - Area: {poly.area} m2")
+    # DEM window of the highest reservoir polygon, used to integrate volumes
+    dem_array = None
+    # Each level is split, written and forgotten before the next one is generated
+    with open(
+        os.path.join(out, damname + "_SZi.dat"), "w", encoding="utf-8"
+    ) as szi_out, open(
+        os.path.join(out, damname + "_SVZi.dat"), "w", encoding="utf-8"
+    ) as svzi_out:
+        for max_elev, level_poly in levels:
+            # Levels not crossed by the cutline do not need to be split
+            if line.intersects(level_poly):
+                pieces = shapely.get_parts(split(level_poly, line))
+            else:
+                pieces = np.array([level_poly])
+            inside = np.flatnonzero(shapely.contains(pieces, in_w))
+            found = inside.size > 0
+            max_area = -10000
+            if found is True:
+                r_poly = pieces[inside[-1]]
+                max_area = r_poly.area
+                logger.info(f"Elevation: {max_elev}m - Area: {max_area} m2")
 
                 r_feat = ogr.Feature(feature_def=dst_layer.GetLayerDefn())
-                r_p = ogr.CreateGeometryFromWkt(poly.wkt)
+                r_p = ogr.CreateGeometryFromWkb(shapely.to_wkb(r_poly))
                 r_feat.SetGeometryDirectly(r_p)
                 r_feat.SetField("ID", str(r_id))
                 r_feat.SetField("level", max_elev)
-
-
-        if found is True:
-            dst_layer.CreateFeature(r_feat)
-            r_feat.Destroy()
-            r_elev.append(max_elev)
-            r_area.append(max_area)
-            r_id = r_id + 1
-        else:
-
-            logger.debug(f"No relevant polygon found for Elevation {max_elev} m")
-
-    logger.debug(f"Identified levels: {r_id}")
-
-
-    r_elev.append(pdb_elev)
-    r_area.append(0.0)
-
-    plot_szi_points(
-        r_elev, r_area, pdb_elev, damname, os.path.join(out, damname + "_SZi.png")
-    )
-
-    data = np.column_stack((r_elev, r_area))
-    np.savetxt(os.path.join(out, damname + "_SZi.dat"), data)
+                dst_layer.CreateFeature(r_feat)
+                r_feat.Destroy()
+                szi_out.write(f"{max_elev:.18e} {max_area:.18e}\n")
+                # Levels are processed from the highest, whose polygon contains
+                # the lower ones
+                if dem_array is None:
+                    dem_array, transform, pixel_area = read_dem_under_polygon(
+                        dem, r_poly
+                    )
+                volume = volume_under_polygon(
+                    max_elev, r_poly, dem_array, transform, pixel_area
+                )
+                logger.info(f"Elevation: {max_elev}m - Volume: {volume} m3")
+                svzi_out.write(f"{max_elev:.18e} {max_area:.18e} {volume:.18e}\n")
+                r_elev.append(max_elev)
+                r_area.append(max_area)
+                r_id = r_id + 1
+            else:
+
+                logger.debug(f"No relevant polygon found for Elevation {max_elev} m")
+
+        logger.debug(f"Identified levels: {r_id}")
+
+        r_elev.append(pdb_elev)
+        r_area.append(0.0)
+        szi_out.write(f"{float(pdb_elev):.18e} {0.0:.18e}\n")
+        svzi_out.write(f"{float(pdb_elev):.18e} {0.0:.18e} {0.0:.18e}\n")
+    dst_ds = None
+
+    if plots != "none":
+        plot = get_plotter(plots, os.path.join(out, damname + "_SZi" + PLOTS_SUFFIX))
+        plot(
+            "plot_szi_points",
+            r_elev=r_elev,
+            r_area=r_area,
+            pdb_elev=pdb_elev,
+            damname=damname,
+            outfile=os.path.join(out, damname + "_SZi.png"),
+        )
     t1_stop = perf_counter()
     logger.info(f"Elapsed time: {t1_stop}s {t1_start}s")
     logger.info(f"Elapsed time during the whole program in s : {t1_stop-t1_start}s")
@@ -419,6 +669,9 @@ def cut_countourlines_ars():
     parser.add_argument("-d", "--dem", help="Input DEM")
     parser.add_argument("-c", "--cut", help="cutline.json file")
     parser.add_argument("-l", "--level", help="contourline.json file")
+    parser.add_argument(
+        "--mode", help="Mode used to generate the cutline", choices=["GDP", "standard"]
+    )
     parser.add_argument(
         "--elevoffset",
         type=float,
@@ -435,9 +688,26 @@ def cut_countourlines_ars():
         "--cache",
         help="Cache directory to store <DAM>_contourlines@*m.json files.",
     )
+    parser.add_argument(
+        "--roi_shrink",
+        action="store_true",
+        help="Restrict contour generation to the valley connected to the reservoir",
+    )
+    parser.add_argument(
+        "--simplify_tolerance",
+        type=float,
+        default=0,
+        help="Contour polygons simplification tolerance in pixels (0 to disable)",
+    )
     parser.add_argument("-t", "--tmp", help="Temporary directory")
     parser.add_argument("-o", "--out", help="Output directory")
     parser.add_argument("--debug", action="store_true", help="Activate Debug Mode")
+    parser.add_argument(
+        "--plots",
+        default="full",
+        choices=["none", "minimal", "full", "deferred"],
+        help="Figures to draw, none skips matplotlib entirely",
+    )
     return parser
 
 
@@ -446,16 +716,20 @@ def main():
     parser = cut_countourlines_ars()
     args = parser.parse_args()
     cut_countourlines(
-        args.info,
-        args.dem,
-        args.cut,
-        args.level,
-        args.elevoffset,
-        args.elevsampling,
-        args.cache,
-        args.tmp,
-        args.out,
-        args.debug,
+        info=args.info,
+        dem=args.dem,
+        cutline=args.cut,
+        level=args.level,
+        elevoffset=args.elevoffset,
+        elevsampling=args.elevsampling,
+        cache=args.cache,
+        tmp=args.tmp,
+        out=args.out,
+        mode=args.mode,
+        roi_shrink=args.roi_shrink,
+        simplify_tolerance=args.simplify_tolerance,
+        debug=args.debug,
+        plots=args.plots,
     )
 
 
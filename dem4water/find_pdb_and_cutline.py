@@ -10,13 +10,13 @@ import sys
 from math import ceil, sqrt
 from time import perf_counter
 
-import matplotlib.pyplot as plt
 import numpy as np
 
 import rasterio as rio
 from osgeo import gdal, ogr, osr
 from shapely.geometry import shape
 
+from dem4water.plot_record import PLOTS_SUFFIX, get_plotter
 from dem4water.tools.extract_roi import ExtractROIParam, extract_roi
 from dem4water.tools.save_raster import save_image
 from dem4water.tools.superimpose import SuperimposeParam, superimpose
@@ -95,8 +95,12 @@ def find_pdb_and_cutline(
     out,
     radius=None,
     debug=False,
+    plots="full",
 ):  # noqa: C901  #FIXME: Function is too complex
-    """Find the PDB and create the cutline."""
+    """Find the PDB and create the cutline.
+
+    The PDB profile plot is only drawn (or recorded) in full (or deferred) plots mode.
+    """
     t1_start = perf_counter()
 
     logging_format = (
@@ -347,15 +351,9 @@ def find_pdb_and_cutline(
 
         d = nderiv(alt_l, rad_l)
 
-        fig, axs = plt.subplots(2)
-        axs[0].plot(rad_l, alt_l, "r")
-        axs[0].set(xlabel="Search Area to the Dam (m)", ylabel="Minimum Elevation")
-        axs[0].label_outer()
-        axs[1].plot(rad_l, abs(d), "b")
-        axs[1].set(xlabel="Search Area to the Dam (m)", ylabel="d(Minimum Elevation)")
-        axs[1].label_outer()
-
         found_pdb = False
+        detection = None
+        d_pdb = 0
         rad_pdb = 0
         alt_pdb = 0
 
@@ -366,9 +364,8 @@ def find_pdb_and_cutline(
                 found_pdb = True
                 rad_pdb = i_r
                 alt_pdb = i_a
-                fig.suptitle("PDB profile (1st pass detection)")
-                axs[0].plot(rad_pdb, alt_pdb, "x")
-                axs[1].plot(rad_pdb, abs(i_d), "x")
+                detection = "1st pass"
+                d_pdb = i_d
                 break
 
         if found_pdb is True:
@@ -380,9 +377,8 @@ def find_pdb_and_cutline(
                     found_pdb = True
                     rad_pdb = i_r
                     alt_pdb = i_a
-                    fig.suptitle("PDB profile (2nd pass detection)")
-                    axs[0].plot(rad_pdb, alt_pdb, "x")
-                    axs[1].plot(rad_pdb, abs(i_d), "x")
+                    detection = "2nd pass"
+                    d_pdb = i_d
                     logging.warning(
                         "PDB found during 2nd pass - It may not be reliable"
                     )
@@ -400,7 +396,19 @@ def find_pdb_and_cutline(
                         + str(i_d)
                     )
 
-        fig.savefig(os.path.join(tmp, "pdb_profile.png"))
+        if plots in ("full", "deferred"):
+            plot = get_plotter(plots, os.path.join(tmp, "pdb_profile" + PLOTS_SUFFIX))
+            plot(
+                "plot_pdb_profile",
+                rad_l=rad_l,
+                alt_l=alt_l,
+                d=d,
+                rad_pdb=rad_pdb,
+                alt_pdb=alt_pdb,
+                d_pdb=d_pdb,
+                outfile=os.path.join(tmp, "pdb_profile.png"),
+                detection=detection,
+            )
 
         if found_pdb is False:
             logging.error("404 - PDB not Found")
@@ -979,6 +987,12 @@ def find_pdb_and_cutline_parameters():
     parser.add_argument("-t", "--tmp", help="Temporary directory")
     parser.add_argument("-o", "--out", help="Output directory")
     parser.add_argument("--debug", action="store_true", help="Activate Debug Mode")
+    parser.add_argument(
+        "--plots",
+        default="full",
+        choices=["none", "minimal", "full", "deferred"],
+        help="Figures to draw, none skips matplotlib entirely",
+    )
     return parser
 
 
@@ -1003,6 +1017,7 @@ def main():
         args.out,
         args.radius,
         args.debug,
+        args.plots,
     )
 
 
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""Fit the S(Z) models of a whole campaign from existing S(Z_i) files.
+
+Only szi_to_model is run, without any plot, which allows to try new model
+parameters on a campaign without launching the full chain for each dam.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from itertools import repeat
+from time import perf_counter
+
+from dem4water import compute_model as cm
+from dem4water.szi_to_model import (
+    compute_hsv_model,
+    load_szi,
+    szi_to_model_parameters,
+)
+
+logger = logging.getLogger("fit_models")
+
+MODEL_PARAMETERS = [
+    "winsize",
+    "maemode",
+    "zmaxoffset",
+    "zminoffset",
+    "dslopethresh",
+    "selection_mode",
+    "jump_ratio",
+    "filter_area",
+]
+FIELDS = [
+    "dam_path",
+    "ID",
+    "Name",
+    "Elevation",
+    "Z0",
+    "S0",
+    "alpha",
+    "beta",
+    "MAE",
+    "window_index",
+    "data_shortage",
+    "nb_szi",
+    "szi_file",
+    "error",
+]
+
+
+def get_model_parameters(json_campaign=None):
+    """Read the szi_to_model parameters of a campaign.
+
+    The szi_to_model section of the campaign file, if provided, overrides the
+    default values of the szi_to_model parser.
+    """
+    defaults = vars(szi_to_model_parameters().parse_args([]))
+    params = {key: defaults[key] for key in MODEL_PARAMETERS}
+    if json_campaign is not None:
+        with open(json_campaign, encoding="utf-8") as in_config:
+            config = json.load(in_config)
+        params.update(
+            {
+                key: value
+                for key, value in config.get("szi_to_model", {}).items()
+                if key in MODEL_PARAMETERS
+            }
+        )
+    return params
+
+
+def find_campaign_dams(campaign_path):
+    """List the dams of a campaign folder for which a S(Z_i) file exists.
+
+    Custom S(Z_i) and daminfo files are preferred, as in the full chain.
+
+    Returns
+    -------
+    a list of dict with the dam folder name, the S(Z_i), daminfo and database files
+    """
+    dams = []
+    for dam_folder in sorted(glob(os.path.join(campaign_path, "camp", "*", ""))):
+        dam_path = os.path.basename(os.path.normpath(dam_folder))
+        files = {}
+        for key, suffixes in (
+            ("szi_file", ["_SZi_custom.dat", "_SZi.dat"]),
+            ("daminfo", ["_daminfo_custom.json", "_daminfo.json"]),
+        ):
+            for suffix in suffixes:
+                candidate = os.path.join(dam_folder, f"{dam_path}{suffix}")
+                if os.path.exists(candidate):
+                    files[key] = candidate
+                    break
+        if len(files) != 2:
+            logger.warning(f"{dam_path}: no S(Z_i) or daminfo file found, skipped.")
+            continue
+        dams.append(
+            {
+                "dam_path": dam_path,
+                "database": os.path.join(
+                    campaign_path, "extracts", dam_path, f"DB_{dam_path}.geojson"
+                ),
+                **files,
+            }
+        )
+    return dams
+
+
+def fit_dam(dam, params):
+    """Fit the model of one dam and return it as a table row.
+
+    A failing dam does not stop the campaign, the error is kept in the row.
+    """
+    row = {"dam_path": dam["dam_path"], "szi_file": dam["szi_file"]}
+    try:
+        damname, damelev, dam_id = cm.get_info_dam(dam["daminfo"])
+        row.update({"ID": dam_id, "Name": damname, "Elevation": damelev})
+        z_i, s_zi = load_szi(
+            dam["szi_file"],
+            dam["database"],
+            params["jump_ratio"],
+            params["filter_area"],
+        )
+        fit = compute_hsv_model(
+            z_i,
+            s_zi,
+            damname,
+            damelev,
+            params["winsize"],
+            params["maemode"],
+            params["zmaxoffset"],
+            params["zminoffset"],
+            params["dslopethresh"],
+            params["selection_mode"],
+        )
+    # remove_jump_szi exits when the S(Z_i) file is empty
+    except (Exception, SystemExit) as err:  # pylint: disable=broad-except
+        logger.error(f"{dam['dam_path']}: {err}")
+        row["error"] = str(err)
+        return row
+    row.update(
+        {
+            "Z0": float(fit["z_i"][0]),
+            "S0": float(fit["s_zi"][0]),
+            "alpha": float(fit["alpha"]),
+            "beta": float(fit["beta"]),
+            "MAE": float(fit["mae"]),
+            "window_index": int(fit["best_i"]),
+            "data_shortage": fit["data_shortage"],
+            "nb_szi": len(fit["z_i"]),
+        }
+    )
+    return row
+
+
+def write_table(rows, out_file):
+    """Write the fitted models as CSV, or Parquet if the extension asks so."""
+    if os.path.splitext(out_file)[1] == ".parquet":
+        # pylint: disable=import-outside-toplevel
+        import pandas as pd
+
+        pd.DataFrame(rows, columns=FIELDS).to_parquet(out_file, index=False)
+    else:
+        with open(out_file, "w", encoding="utf-8", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def fit_models(campaign_path, out_file, json_campaign=None, workers=None, debug=False):
+    """Fit every dam of a campaign and write a single table of models.
+
+    Parameters
+    ----------
+    campaign_path:
+        the campaign output path, containing the camp and extracts folders
+    out_file:
+        the output table, .csv or .parquet
+    json_campaign:
+        campaign configuration file providing the szi_to_model parameters
+    workers:
+        number of processes, all the CPUs if None
+    """
+    t1_start = perf_counter()
+    logging_format = (
+        "%(asctime)s - %(filename)s:%(lineno)s - %(levelname)s - %(message)s"
+    )
+    if debug is True:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.DEBUG, format=logging_format
+        )
+    else:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.INFO, format=logging_format
+        )
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    # The per dam logs of szi_to_model are only useful for debugging
+    for name in ["szi_to_model", "compute_model"]:
+        logging.getLogger(name).setLevel(logging.DEBUG if debug else logging.WARNING)
+
+    params = get_model_parameters(json_campaign)
+    logger.info(f"Model parameters: {params}")
+    dams = find_campaign_dams(campaign_path)
+    logger.info(f"{len(dams)} dams found in {campaign_path}")
+    if workers is None:
+        workers = os.cpu_count()
+    chunksize = max(1, len(dams) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        rows = list(executor.map(fit_dam, dams, repeat(params), chunksize=chunksize))
+    write_table(rows, out_file)
+    nb_errors = sum(1 for row in rows if "error" in row)
+    logger.info(f"{len(rows) - nb_errors} models written to {out_file}")
+    if nb_errors:
+        logger.warning(f"{nb_errors} dams failed, see the error column.")
+    logger.info(f"Elapsed time: {perf_counter() - t1_start}s")
+    return rows
+
+
+def fit_models_parameters():
+    """Define fit_models parser arguments."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "-campaign_path",
+        help="Campaign output path, containing the camp folder",
+        required=True,
+    )
+    parser.add_argument(
+        "-outfile", help="Output table (.csv or .parquet)", required=True
+    )
+    parser.add_argument(
+        "-json_campaign",
+        help="Campaign configuration file providing the szi_to_model parameters",
+        default=None,
+    )
+    parser.add_argument("-workers", type=int, default=None, help="Number of processes")
+    parser.add_argument("-debug", action="store_true", help="Activate Debug Mode")
+    return parser
+
+
+def main():
+    """Cli for fit_models.py."""
+    parser = fit_models_parameters()
+    args = parser.parse_args()
+    fit_models(
+        args.campaign_path,
+        args.outfile,
+        args.json_campaign,
+        args.workers,
+        args.debug,
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Evaluate the HSV models computed by szi_to_model.
+
+The model of a dam is the power law S(Z) = S0 + alpha * (Z - Z0) ^ beta and its
+integral V(Z) = V0 + (Z - Z0) * (S0 + alpha * (Z - Z0) ^ beta / (beta + 1)).
+The functions are vectorized and elevations below Z0 (surfaces below S0) are
+clipped to the dam bottom.
+"""
+import json
+from dataclasses import dataclass
+
+import numpy as np
+
+
+def _clipped_delta(values, origin):
+    """Compute values - origin as a new float array, negative values set to 0."""
+    delta = np.asarray(np.subtract(values, origin, dtype=float))
+    np.maximum(delta, 0, out=delta)
+    return delta
+
+
+def surface(elev, z_0, s_0, alpha, beta):
+    """Compute the water surface S(Z) of elevations."""
+    height = _clipped_delta(elev, z_0)
+    np.power(height, beta, out=height)
+    height *= alpha
+    height += s_0
+    return height
+
+
+def volume(elev, z_0, s_0, v_0, alpha, beta):
+    """Compute the water volume V(Z) of elevations."""
+    height = _clipped_delta(elev, z_0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vol = np.power(height, beta)
+        vol *= alpha / (beta + 1.0)
+    vol += s_0
+    vol *= height
+    vol += v_0
+    return vol
+
+
+def elevation(surf, z_0, s_0, alpha, beta):
+    """Compute the elevation Z(S) of water surfaces."""
+    height = _clipped_delta(surf, s_0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        height /= alpha
+        np.power(height, 1 / beta, out=height)
+    height += z_0
+    return height
+
+
+def volume_from_surface(surf, s_0, v_0, alpha, beta):
+    """Compute the water volume V(S) of water surfaces."""
+    delta = _clipped_delta(surf, s_0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vol = np.power(delta / alpha, 1 / beta)
+        delta /= beta + 1.0
+    delta += s_0
+    vol *= delta
+    vol += v_0
+    return vol
+
+
+@dataclass
+class HSVModels:
+    """Class holding the models of several dams, one array per parameter.
+
+    The evaluation methods take values whose first axis is the dam axis, for
+    instance an array of dams x time steps, or a single array when only one
+    model is held.
+    """
+
+    ids: np.ndarray
+    names: np.ndarray
+    elevation: np.ndarray
+    z_0: np.ndarray
+    s_0: np.ndarray
+    v_0: np.ndarray
+    alpha: np.ndarray
+    beta: np.ndarray
+
+    @classmethod
+    def from_models(cls, models):
+        """Build from a list of models, as loaded from _model.json files."""
+        return cls(
+            np.array([model["ID"] for model in models]),
+            np.array([model["Name"] for model in models]),
+            np.array([model["Elevation"] for model in models], dtype=float),
+            *(
+                np.array([model["Model"][key] for model in models], dtype=float)
+                for key in ["Z0", "S0", "V0", "alpha", "beta"]
+            ),
+        )
+
+    @classmethod
+    def from_json_files(cls, json_files):
+        """Load the models of several _model.json files."""
+        models = []
+        for json_file in json_files:
+            with open(json_file, encoding="utf-8") as model_in:
+                models.append(json.load(model_in))
+        return cls.from_models(models)
+
+    def __len__(self):
+        """Return the number of dams."""
+        return len(self.ids)
+
+    def select(self, index):
+        """Return the models of a subset of dams (index, slice or mask)."""
+        return HSVModels(
+            *(
+                getattr(self, key)[index]
+                for key in self.__dataclass_fields__  # pylint: disable=no-member
+            )
+        )
+
+    def _along_dams(self, param, values):
+        """Shape a parameter array to broadcast along the dam axis of values."""
+        return param.reshape((len(self),) + (1,) * max(np.ndim(values) - 1, 0))
+
+    def _params(self, values, *keys):
+        """Shape the parameters to broadcast along the dam axis of values."""
+        return [self._along_dams(getattr(self, key), values) for key in keys]
+
+    def surface(self, elev):
+        """Compute S(Z)."""
+        return surface(elev, *self._params(elev, "z_0", "s_0", "alpha", "beta"))
+
+    def volume(self, elev):
+        """Compute V(Z)."""
+        return volume(elev, *self._params(elev, "z_0", "s_0", "v_0", "alpha", "beta"))
+
+    def elevation_from_surface(self, surf):
+        """Compute Z(S)."""
+        return elevation(surf, *self._params(surf, "z_0", "s_0", "alpha", "beta"))
+
+    def volume_from_surface(self, surf):
+        """Compute V(S)."""
+        return volume_from_surface(
+            surf, *self._params(surf, "s_0", "v_0", "alpha", "beta")
+        )
+
+    def filling_rate(self, elev, full_elev=None):
+        """Compute the filling rate V(Z) / V(Z_full).
+
+        The dam elevation is used as full reservoir elevation by default.
+        """
+        if full_elev is None:
+            full_elev = self.elevation
+        full_volume = volume(
+            full_elev, self.z_0, self.s_0, self.v_0, self.alpha, self.beta
+        )
+        return self.volume(elev) / self._along_dams(full_volume, elev)
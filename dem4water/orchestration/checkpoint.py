@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""Record the stages run for a dam to skip them when nothing changed.
+
+The manifest of a dam stores, for each stage, the fingerprint of the input
+files found in its parameters, the parameters themselves and the fingerprint
+of the source code of the stage, with the fingerprint of the files it
+produced. A stage is skipped when all of them are unchanged. As the outputs
+of a stage are the inputs of the next ones, the downstream stages run again
+only when an upstream output actually changed.
+"""
+import ast
+import hashlib
+import importlib.util
+import json
+import os
+import time
+from functools import lru_cache
+
+# Above this size, files are identified by size and modification time
+# instead of a content hash (national databases, DEM mosaics...)
+HASH_MAX_SIZE = 64 * 1024**2
+# Parameters without effect on the stage results
+IGNORED_PARAMETERS = ["debug"]
+# Package whose modules are part of the code fingerprint of the stages
+PACKAGE = "dem4water"
+
+
+def sha256_file(path):
+    """Return the sha256 hex digest of the content of a file."""
+    sha = hashlib.sha256()
+    with open(path, "rb") as in_file:
+        for block in iter(lambda: in_file.read(1024**2), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def file_fingerprint(path):
+    """Return the sha256 of a file, or its size and mtime if it is large."""
+    stat = os.stat(path)
+    if stat.st_size > HASH_MAX_SIZE:
+        return f"stat:{stat.st_size}:{stat.st_mtime_ns}"
+    return f"sha256:{sha256_file(path)}"
+
+
+def files_fingerprint(paths):
+    """Return the fingerprints of the existing files among paths."""
+    return {path: file_fingerprint(path) for path in sorted(paths) if os.path.isfile(path)}
+
+
+def normalize_parameters(params):
+    """Return the parameters of a stage affecting its results, as sorted json."""
+    return json.loads(
+        json.dumps(
+            {key: value for key, value in params.items() if key not in IGNORED_PARAMETERS},
+            sort_keys=True,
+        )
+    )
+
+
+def input_files(params, outputs=()):
+    """Return the existing files among the parameter values of a stage.
+
+    The outputs of the stage, also found in its parameters, are not inputs.
+    """
+    return [
+        value
+        for value in params.values()
+        if isinstance(value, str) and value not in outputs and os.path.isfile(value)
+    ]
+
+
+def module_source(module):
+    """Return the source file of a module of the package, None for packages."""
+    try:
+        spec = importlib.util.find_spec(module)
+    except (ImportError, ValueError):
+        return None
+    if spec is None or spec.origin is None or spec.submodule_search_locations:
+        return None
+    return spec.origin
+
+
+@lru_cache(maxsize=None)
+def imported_modules(module):
+    """Return the modules of the package imported by a module, lazy imports included."""
+    with open(module_source(module), "rb") as source:
+        tree = ast.parse(source.read())
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module)
+            # from package import module
+            names.update(f"{node.module}.{alias.name}" for alias in node.names)
+    return sorted(
+        name
+        for name in names
+        if name.split(".")[0] == PACKAGE and module_source(name) is not None
+    )
+
+
+def module_dependencies(modules):
+    """Return modules and the modules of the package they import, recursively."""
+    found = set()
+    pending = list(modules)
+    while pending:
+        module = pending.pop()
+        if module not in found:
+            found.add(module)
+            pending.extend(imported_modules(module))
+    return sorted(found)
+
+
+@lru_cache(maxsize=None)
+def source_fingerprint(modules):
+    """Return the sha256 of the source files of modules (a tuple of names).
+
+    The modules of the package they import, directly or not, are included.
+    """
+    sha = hashlib.sha256()
+    for module in module_dependencies(modules):
+        origin = importlib.util.find_spec(module).origin
+        with open(origin, "rb") as source:
+            sha.update(module.encode() + b"\0" + source.read())
+    return f"sha256:{sha.hexdigest()}"
+
+
+def stage_entry(params, modules, outputs=()):
+    """Return the inputs, parameters and code fingerprint of a stage run."""
+    return {
+        "inputs": files_fingerprint(input_files(params, outputs)),
+        "params": normalize_parameters(params),
+        "code": source_fingerprint(tuple(modules)),
+    }
+
+
+class Checkpoint:
+    """Stage manifest of a dam, stored as json."""
+
+    def __init__(self, manifest_file):
+        """Load the manifest file if it exists."""
+        self.manifest_file = manifest_file
+        self.stages = {}
+        if os.path.exists(manifest_file):
+            with open(manifest_file, encoding="utf-8") as manifest_in:
+                self.stages = json.load(manifest_in)
+
+    def is_done(self, stage, entry, outputs):
+        """Check if a stage already ran with this entry and its outputs are intact."""
+        record = self.stages.get(stage)
+        if record is None or any(record[key] != entry[key] for key in entry):
+            return False
+        if not outputs or not all(os.path.isfile(output) for output in outputs):
+            return False
+        return record["outputs"] == files_fingerprint(outputs)
+
+    def record(self, stage, entry, outputs, duration, peak_rss_mb=None, restored=False):
+        """Store a successful stage run and save the manifest.
+
+        restored marks the runs whose outputs were copied from a stage cache,
+        their duration and memory are not the ones of the stage.
+        """
+        self.stages[stage] = {
+            **entry,
+            "outputs": files_fingerprint(outputs),
+            "duration": duration,
+            "peak_rss_mb": peak_rss_mb,
+            "restored": restored,
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        self.save()
+
+    def invalidate(self, stage):
+        """Forget a stage and save the manifest, for instance when it failed."""
+        if self.stages.pop(stage, None) is not None:
+            self.save()
+
+    def save(self):
+        """Write the manifest file."""
+        # Written aside then renamed, an interrupted run never leaves a partial file
+        with open(self.manifest_file + ".tmp", "w", encoding="utf-8") as manifest_out:
+            json.dump(self.stages, manifest_out, indent=4)
+        os.replace(self.manifest_file + ".tmp", self.manifest_file)
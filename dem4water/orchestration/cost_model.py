@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""Predict the runtime and memory of a dam from cheap features.
+
+The stage checkpoints of the dams (params_<dam>_stages.json) record the
+duration and the peak resident memory of each stage. Their totals per dam are
+fitted against features known before running, read from the dam database and
+the dam configuration:
+
+- area: area of the water body polygon (m2)
+- pixels: number of pixels of the DEM extract, from the buffered bounding box
+  of the polygon and the target resolution
+- levels: number of contour levels, from the dam depth, the elevation offset
+  and the elevation sampling
+
+The model is a power law, a least squares fit of log(cost) on the log of the
+features. Resource requests add a margin of two standard deviations of the
+residuals, so that most dams fit in their request.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import resource
+import sys
+from functools import lru_cache
+from glob import glob
+
+import numpy as np
+
+logger = logging.getLogger("cost_model")
+
+FEATURES = ["area", "pixels", "levels"]
+EARTH_RADIUS = 6371008.8
+# Defaults of area_mapping and cut_contourlines
+BUFFER_ROI = 1000
+TARGET_RESOLUTION = 5
+ELEVOFFSET = 50
+ELEVSAMPLING = 1
+# Resource requests: margin in standard deviations of the log residuals,
+# minimum walltime (minutes) and memory (GB)
+MARGIN = 2
+MIN_WALLTIME = 10
+MIN_RAM = 2
+
+
+def reset_peak_rss():
+    """Reset the peak resident memory of the process (Linux 4.0 and above).
+
+    Returns
+    -------
+    the peak resident memory of the children waited for so far (kB), which
+    can not be reset, to pass to peak_rss
+    """
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+
+def peak_rss(children_start=0):
+    """Return the peak resident memory of the process and its children in MB.
+
+    The peak of the process is the one since the last reset_peak_rss. The
+    children only count if the largest of the children waited for rose above
+    children_start, returned by reset_peak_rss: a child of a previous stage
+    or dam is not counted again, a child smaller than it is missed.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        with open("/proc/self/status", encoding="utf-8") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    peak = int(line.split()[1])
+    except OSError:
+        pass
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if children <= children_start:
+        children = 0
+    return max(peak, children) / 1024
+
+
+def ring_area(ring):
+    """Return the area (m2) of a lon/lat ring.
+
+    The ring is projected on the plane tangent at its first point, accurate
+    enough at the scale of a reservoir.
+    """
+    coords = np.asarray(ring, dtype=float)[:, :2]
+    lon0, lat0 = coords[0]
+    x_m = np.radians(coords[:, 0] - lon0) * EARTH_RADIUS * math.cos(math.radians(lat0))
+    y_m = np.radians(coords[:, 1] - lat0) * EARTH_RADIUS
+    return 0.5 * abs(np.dot(x_m[:-1], y_m[1:]) - np.dot(x_m[1:], y_m[:-1]))
+
+
+def polygon_area_extent(geometry):
+    """Return the area (m2) and the bounding box width and height (m) of a geometry."""
+    polygons = geometry["coordinates"]
+    if geometry["type"] == "Polygon":
+        polygons = [polygons]
+    area = 0.0
+    lons, lats = [], []
+    for polygon in polygons:
+        # Outer ring minus the holes
+        area += ring_area(polygon[0])
+        area -= sum(ring_area(hole) for hole in polygon[1:])
+        lons += [point[0] for point in polygon[0]]
+        lats += [point[1] for point in polygon[0]]
+    lat = math.radians(sum(lats) / len(lats))
+    width = math.radians(max(lons) - min(lons)) * EARTH_RADIUS * math.cos(lat)
+    height = math.radians(max(lats) - min(lats)) * EARTH_RADIUS
+    return area, width, height
+
+
+@lru_cache(maxsize=4)
+def load_database(database, id_column):
+    """Return the features of a dam database (geojson in lon/lat) by dam id."""
+    with open(database, encoding="utf-8") as database_file:
+        features = json.load(database_file)["features"]
+    return {str(feature["properties"][id_column]): feature for feature in features}
+
+
+def dam_features(conf):
+    """Return the features of a dam configuration, as a dict."""
+    with open(conf, encoding="utf-8") as in_config:
+        config = json.load(in_config)
+    area_mapping = config["area_mapping"]
+    feature = load_database(
+        area_mapping["dam_database"], area_mapping.get("dam_id_col", "ID_DB")
+    )[str(area_mapping["dam_id"])]
+    area, width, height = polygon_area_extent(feature["geometry"])
+    buffer_roi = float(area_mapping.get("buffer_roi", BUFFER_ROI))
+    resolution = float(area_mapping.get("target_resolution", TARGET_RESOLUTION))
+    contours = config["cut_contourlines"]
+    depth = feature["properties"].get("DEPTH_M") or 0
+    levels = (float(depth) + float(contours.get("elevoffset", ELEVOFFSET))) / float(
+        contours.get("elevsampling", ELEVSAMPLING)
+    )
+    return {
+        "area": area,
+        "pixels": (width + 2 * buffer_roi) * (height + 2 * buffer_roi) / resolution**2,
+        "levels": levels,
+    }
+
+
+def design_matrix(features):
+    """Return the log features of a list of feature dicts, with a constant column."""
+    return np.column_stack(
+        [np.ones(len(features))]
+        + [np.log1p([dam[name] for dam in features]) for name in FEATURES]
+    )
+
+
+def dam_costs(stages_file):
+    """Return the total duration (s) and the peak memory (MB) of a dam checkpoint.
+
+    The stages run in threads of the DAG scheduler have no peak memory (None)
+    and only count in the duration. None if a stage was restored from a stage
+    cache or has no measures, or if no stage measured its memory.
+    """
+    with open(stages_file, encoding="utf-8") as stages_in:
+        stages = json.load(stages_in)
+    if not stages or any(
+        stage.get("restored") or "peak_rss_mb" not in stage for stage in stages.values()
+    ):
+        return None
+    peaks = [
+        stage["peak_rss_mb"]
+        for stage in stages.values()
+        if stage["peak_rss_mb"] is not None
+    ]
+    if not peaks:
+        return None
+    return sum(stage["duration"] for stage in stages.values()), max(peaks)
+
+
+def collect_samples(campaign_paths):
+    """Return the features and costs of the dams of campaigns."""
+    features, costs = [], []
+    for campaign_path in campaign_paths:
+        for stages_file in sorted(
+            glob(os.path.join(campaign_path, "camp", "*", "params_*_stages.json"))
+        ):
+            cost = dam_costs(stages_file)
+            if cost is None:
+                continue
+            conf = stages_file.replace("_stages.json", ".json")
+            try:
+                features.append(dam_features(conf))
+            except (OSError, KeyError, ValueError) as error:
+                logger.warning(f"No features for {conf}: {error}")
+                continue
+            costs.append(cost)
+    return features, costs
+
+
+def fit_cost_model(campaign_paths, outfile=None, debug=False):
+    """Fit the runtime and memory model on the dams of campaigns.
+
+    Returns
+    -------
+    the model: features, coefficients and residual standard deviation of
+    the runtime and of the memory
+    """
+    logging_format = (
+        "%(asctime)s - %(filename)s:%(lineno)s - %(levelname)s - %(message)s"
+    )
+    if debug is True:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.DEBUG, format=logging_format
+        )
+    else:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.INFO, format=logging_format
+        )
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    features, costs = collect_samples(campaign_paths)
+    if len(features) <= len(FEATURES) + 1:
+        raise ValueError(
+            f"{len(features)} dams with stage measures found, at least "
+            f"{len(FEATURES) + 2} needed"
+        )
+    matrix = design_matrix(features)
+    model = {"features": FEATURES, "nb_dams": len(features)}
+    for target, values in zip(("runtime", "memory"), np.array(costs).T):
+        log_values = np.log(np.maximum(values, 1e-3))
+        coefficients = np.linalg.lstsq(matrix, log_values, rcond=None)[0]
+        residuals = log_values - matrix @ coefficients
+        model[target] = {
+            "coefficients": coefficients.tolist(),
+            "sigma": float(residuals.std(ddof=matrix.shape[1])),
+        }
+        logger.info(
+            f"{target}: coefficients {np.round(coefficients, 3).tolist()}, "
+            f"residual std {model[target]['sigma']:.3f} (log)"
+        )
+    if outfile is not None:
+        with open(outfile, "w", encoding="utf-8") as model_out:
+            json.dump(model, model_out, indent=4)
+        logger.info(f"Model fitted on {len(features)} dams written to {outfile}")
+    return model
+
+
+def predict_costs(model, features):
+    """Return the predicted runtime (s) and peak memory (MB) of the features of a dam."""
+    row = design_matrix([features])[0]
+    return tuple(
+        float(np.exp(row @ np.array(model[target]["coefficients"])))
+        for target in ("runtime", "memory")
+    )
+
+
+def request_costs(model, features):
+    """Return the runtime (s) and peak memory (MB) to request for a dam, margin included."""
+    runtime, memory = predict_costs(model, features)
+    return (
+        runtime * math.exp(MARGIN * model["runtime"]["sigma"]),
+        memory * math.exp(MARGIN * model["memory"]["sigma"]),
+    )
+
+
+def resources_request(runtime, memory):
+    """Return the (ram in GB, walltime hours, walltime minutes) for a runtime (s), memory (MB)."""
+    walltime = max(MIN_WALLTIME, math.ceil(runtime / 60))
+    ram = max(MIN_RAM, math.ceil(memory / 1024))
+    return ram, walltime // 60, walltime % 60
+
+
+def predict_resources(model, features):
+    """Return the (ram in GB, walltime hours, walltime minutes) to request for a dam."""
+    return resources_request(*request_costs(model, features))
+
+
+def cost_model_parameters():
+    """Define cost_model parser arguments."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "-campaign_path",
+        nargs="+",
+        help="Campaign output paths, containing the camp folder",
+        required=True,
+    )
+    parser.add_argument("-outfile", help="Output model (.json)", required=True)
+    parser.add_argument("-debug", action="store_true", help="Activate Debug Mode")
+    return parser
+
+
+def main():
+    """Cli for cost_model.py."""
+    parser = cost_model_parameters()
+    args = parser.parse_args()
+    fit_cost_model(args.campaign_path, args.outfile, args.debug)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
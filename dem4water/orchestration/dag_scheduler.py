@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""Run the stages of the dams of a campaign as a pipeline.
+
+Each (dam, stage) is a task depending on the previous stage of the dam. The
+I/O bound stages (area_mapping, reading the national DEM and watermap) run in
+a thread pool while the compute stages run in their own process each, at most
+one per core: the extracts of the next dams are prefetched while the previous
+dams are computed. At most prefetch dams wait for a compute slot once
+extracted, which bounds the extracts written ahead.
+
+The compute processes are started from a forkserver, never forked from the
+scheduler whose I/O threads may hold GDAL locks. As each compute stage has its
+own process, a crash or a timeout only affects the dam running it.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from dem4water.orchestration.local_executor import get_dam_logs
+from dem4water.orchestration.pipeline import (
+    STAGES,
+    dam_stages,
+    load_pipeline,
+    run_config_stage,
+)
+
+logger = logging.getLogger("dag_scheduler")
+
+
+class StageCrashed(Exception):
+    """The process of a compute stage died without reporting its result."""
+
+
+class StageTimeout(Exception):
+    """A dam exceeded its maximum duration."""
+
+
+def process_context():
+    """Return the multiprocessing context of the compute processes."""
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def limit_memory(max_memory):
+    """Limit the address space of the process to max_memory GB."""
+    if max_memory is not None:
+        limit = int(max_memory * 1024**3)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+@contextmanager
+def dam_logs(conf):
+    """Redirect the outputs of the process to the log files of a dam."""
+    saved = []
+    for log_file, stream in zip(get_dam_logs(conf), (sys.stdout, sys.stderr)):
+        if log_file is not None:
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+            stream.flush()
+            saved.append((os.dup(stream.fileno()), stream))
+            with open(log_file, "a", encoding="utf-8") as log:
+                os.dup2(log.fileno(), stream.fileno())
+    try:
+        yield
+    finally:
+        for fileno, stream in saved:
+            stream.flush()
+            os.dup2(fileno, stream.fileno())
+            os.close(fileno)
+
+
+def run_dam_stage(conf, stage_name, force=False, in_thread=False):
+    """Task entry point: run a stage of a dam, return its duration.
+
+    A stage run in_thread, sharing the scheduler process with other stages,
+    keeps its outputs and does not record its peak memory. A stage exiting
+    (sys.exit) is turned into an error of the task.
+    """
+    stage = next(stage for stage in STAGES if stage.name == stage_name)
+    t_start = time.monotonic()
+    config, checkpoint, cache = load_pipeline(conf)
+    try:
+        if in_thread:
+            run_config_stage(stage, config, checkpoint, cache, force, False)
+        else:
+            with dam_logs(conf):
+                run_config_stage(stage, config, checkpoint, cache, force)
+    except SystemExit as error:
+        raise RuntimeError(f"{stage_name} exited with code {error.code}") from None
+    return time.monotonic() - t_start
+
+
+def stage_process(conf, stage_name, force, max_memory, result):
+    """Process entry point: run a compute stage and send its result."""
+    limit_memory(max_memory)
+    try:
+        result.send(("success", run_dam_stage(conf, stage_name, force)))
+    except Exception as error:  # pylint: disable=broad-except
+        result.send(("failed", str(error)))
+
+
+def run_stage_process(context, conf, stage_name, force, max_memory, timeout):
+    """Run a compute stage in its own process and wait for it, return its duration.
+
+    The process is killed after timeout seconds.
+    """
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(
+        target=stage_process,
+        args=(conf, stage_name, force, max_memory, sender),
+        name=f"{stage_name}:{conf}",
+    )
+    process.start()
+    sender.close()
+    process.join(timeout)
+    if process.exitcode is None:
+        process.kill()
+        process.join()
+        raise StageTimeout(f"killed after {timeout:.0f}s")
+    try:
+        status, value = receiver.recv()
+    except EOFError:
+        raise StageCrashed(f"process exited with code {process.exitcode}") from None
+    if status != "success":
+        raise RuntimeError(value)
+    return value
+
+
+class DagScheduler:
+    """Pipelined execution of the (dam, stage) tasks of a campaign."""
+
+    def __init__(
+        self, workers, io_workers, prefetch, max_memory=None, force=False, timeout=None
+    ):
+        """Create the thread pools running the tasks."""
+        self.workers = workers
+        self.io_workers = io_workers
+        self.prefetch = prefetch
+        self.max_memory = max_memory
+        self.force = force
+        self.timeout = timeout
+        self.context = process_context()
+        self.io_pool = ThreadPoolExecutor(io_workers, thread_name_prefix="io")
+        # Each thread waits for the process of a compute stage
+        self.compute_pool = ThreadPoolExecutor(workers, thread_name_prefix="compute")
+        # future: (dam configuration, remaining stages)
+        self.running = {}
+        # Dams out of the I/O stages, computing or waiting for a compute slot
+        self.computing = set()
+        self.retried = set()
+        self.starts = {}
+        self.durations = {}
+        self.records = []
+
+    def nb_io_running(self):
+        """Return the number of I/O bound tasks running or queued."""
+        return sum(1 for _, stages in self.running.values() if stages[0].io_bound)
+
+    def can_start(self):
+        """Check if a new dam can start its extraction."""
+        return (
+            self.nb_io_running() < self.io_workers
+            and len(self.computing) < self.workers + self.prefetch
+        )
+
+    def remaining(self, conf):
+        """Return the time left to a dam before its timeout, None without timeout."""
+        if self.timeout is None:
+            return None
+        return self.timeout - (time.monotonic() - self.starts[conf])
+
+    def start(self, conf, stages):
+        """Start a dam."""
+        self.starts[conf] = time.monotonic()
+        self.durations[conf] = {}
+        if stages:
+            self.submit(conf, stages)
+        else:
+            self.finish(conf, "success")
+
+    def submit(self, conf, stages):
+        """Submit the next stage of a dam to the pool matching its kind."""
+        stage = stages[0]
+        remaining = self.remaining(conf)
+        if remaining is not None and remaining <= 0:
+            # The I/O threads can not be interrupted, the dam stops after them
+            stages.clear()
+            self.finish(conf, "timeout", f"{stage.name}: not started, timeout reached")
+            return
+        if stage.io_bound:
+            # Threads share the outputs and the memory of the process
+            future = self.io_pool.submit(
+                run_dam_stage, conf, stage.name, self.force, True
+            )
+        else:
+            self.computing.add(conf)
+            future = self.compute_pool.submit(
+                run_stage_process,
+                self.context,
+                conf,
+                stage.name,
+                self.force,
+                self.max_memory,
+                remaining,
+            )
+        self.running[future] = (conf, stages)
+
+    def finish(self, conf, status, error=None):
+        """Record the end of a dam."""
+        self.computing.discard(conf)
+        duration = time.monotonic() - self.starts[conf]
+        self.records.append(
+            {
+                "config": conf,
+                "status": status,
+                "error": error,
+                "duration": duration,
+                "stages": self.durations[conf],
+            }
+        )
+        log = logger.info if status == "success" else logger.error
+        log(f"{status} {conf} in {duration:.1f}s ({len(self.records)} dams done)")
+
+    def crashed(self, conf, stages, stage, error):
+        """Retry once the stage of a dam whose process crashed."""
+        if conf in self.retried:
+            logger.error(f"{conf}: {stage.name} {error}")
+            self.finish(conf, "failed", f"{stage.name}: {error}")
+        else:
+            logger.warning(f"{conf}: {stage.name} {error}, retrying")
+            self.retried.add(conf)
+            stages.appendleft(stage)
+            self.submit(conf, stages)
+
+    def completed(self, future):
+        """Submit the next stage of the dam of a completed task."""
+        conf, stages = self.running.pop(future)
+        stage = stages.popleft()
+        try:
+            self.durations[conf][stage.name] = future.result()
+        except StageCrashed as error:
+            self.crashed(conf, stages, stage, error)
+            return
+        except StageTimeout as error:
+            logger.error(f"{conf}: {stage.name} {error}")
+            self.finish(conf, "timeout", f"{stage.name}: {error}")
+            return
+        except Exception as error:  # pylint: disable=broad-except
+            logger.error(f"{conf}: {stage.name} failed: {error}")
+            self.finish(conf, "failed", f"{stage.name}: {error}")
+            return
+        logger.debug(f"{conf}: {stage.name} done")
+        if stages:
+            self.submit(conf, stages)
+        else:
+            self.finish(conf, "success")
+
+    def run(self, dams):
+        """Run a deque of (dam configuration, deque of stages) to completion."""
+        try:
+            while dams or self.running:
+                # Start new dams while extraction threads are free and the
+                # compute stages are not too far behind
+                while dams and self.can_start():
+                    self.start(*dams.popleft())
+                if self.running:
+                    finished, _ = wait(list(self.running), return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        self.completed(future)
+        finally:
+            self.io_pool.shutdown()
+            self.compute_pool.shutdown()
+        return self.records
+
+
+def run_dag_campaign(
+    config_list,
+    workers=None,
+    io_workers=4,
+    prefetch=None,
+    max_memory=None,
+    force=False,
+    summary_file=None,
+    debug=False,
+    timeout=None,
+):
+    """Run the dams of a campaign, overlapping extractions and computations.
+
+    Parameters
+    ----------
+    config_list:
+        the dam configuration files, as written by write_json
+    workers:
+        number of processes of the compute stages, all the CPUs if None
+    io_workers:
+        number of threads of the I/O bound stages
+    prefetch:
+        maximum number of extracted dams waiting for a compute slot,
+        2 * workers if None
+    max_memory:
+        maximum memory of a compute process in GB
+    timeout:
+        maximum duration of a dam (s), its compute process being killed when
+        it is reached
+    summary_file:
+        json file receiving the status and stage durations of each dam
+
+    Returns
+    -------
+    the list of dam records of the summary
+    """
+    logging_format = (
+        "%(asctime)s - %(filename)s:%(lineno)s - %(levelname)s - %(message)s"
+    )
+    if debug is True:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.DEBUG, format=logging_format
+        )
+    else:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.INFO, format=logging_format
+        )
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    if workers is None:
+        workers = os.cpu_count()
+    if prefetch is None:
+        prefetch = 2 * workers
+    t_start = time.monotonic()
+
+    dams = deque()
+    for conf in config_list:
+        config, _, _ = load_pipeline(conf)
+        dams.append((conf, deque(dam_stages(config))))
+    records = DagScheduler(
+        workers, io_workers, prefetch, max_memory, force, timeout
+    ).run(dams)
+
+    summary = {
+        "workers": workers,
+        "io_workers": io_workers,
+        "prefetch": prefetch,
+        "max_memory": max_memory,
+        "timeout": timeout,
+        "duration": time.monotonic() - t_start,
+        "nb_dams": len(records),
+        "nb_success": sum(1 for record in records if record["status"] == "success"),
+        "nb_failed": sum(1 for record in records if record["status"] == "failed"),
+        "nb_timeout": sum(1 for record in records if record["status"] == "timeout"),
+        "dams": records,
+    }
+    logger.info(
+        f"{summary['nb_success']} dams processed, {summary['nb_failed']} failed, "
+        f"{summary['nb_timeout']} timed out in {summary['duration']:.1f}s"
+    )
+    if summary_file is not None:
+        with open(summary_file, "w", encoding="utf-8") as out_summary:
+            json.dump(summary, out_summary, indent=4)
+        logger.info(f"Summary written to {summary_file}")
+    return records
@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""Submit the dams of a campaign and follow their jobs until the end.
+
+The jobs are submitted with a bounded number of jobs queued or running, the
+states of all of them are polled with one scheduler call (squeue and sacct,
+or qstat), and the dams whose job was stopped by the scheduler are
+resubmitted: with a longer walltime after a timeout, with more memory after a
+memory kill, unchanged after a node failure. A dam failing by itself (exit
+code of the chain) is reported at once, running it again would fail the same
+way. The number of
+dams per hour and the estimated end of the campaign are logged at each poll
+and written in a status file.
+
+The Slurm and PBS backends call the scheduler commands; the local backend
+runs the job scripts as local processes, to run or test the monitor without
+a cluster.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from typing import List, Optional
+
+from dem4water.orchestration.job_scripts import (
+    environment_exports,
+    pbs_header,
+    single_command,
+    slurm_header,
+)
+
+logger = logging.getLogger("job_monitor")
+
+# Slurm job states (sacct, squeue) and PBS job states (qstat)
+SLURM_STATES = {
+    "PENDING": "queued",
+    "CONFIGURING": "queued",
+    "REQUEUED": "queued",
+    "SUSPENDED": "queued",
+    "RUNNING": "running",
+    "COMPLETING": "running",
+    "COMPLETED": "success",
+}
+SLURM_REASONS = {
+    "TIMEOUT": "timeout",
+    "OUT_OF_MEMORY": "memory",
+    "NODE_FAIL": "node",
+    "BOOT_FAIL": "node",
+    "PREEMPTED": "node",
+}
+PBS_STATES = {"Q": "queued", "H": "queued", "W": "queued", "T": "queued"}
+# PBS Pro exit status of the jobs killed by the server, the other negative
+# ones being failures of the job execution (JOB_EXEC_*)
+PBS_REASONS = {-29: "timeout", -27: "memory", -26: "memory"}
+# Failure reasons worth a resubmission: scheduler or resources, not the chain
+RETRIED_REASONS = {"timeout", "memory", "node", "submission"}
+# Exit code of a local job killed by the kernel out of memory killer
+SIGKILL_EXIT = 137
+
+
+@dataclass
+class Job:
+    """A dam to process and the resources of its next job."""
+
+    conf: str
+    name: str
+    log_out: str
+    log_err: str
+    cpu: int
+    ram: int
+    walltime: int
+    attempt: int = 0
+    job_id: Optional[str] = None
+    state: str = "pending"
+    reason: Optional[str] = None
+    history: List[dict] = field(default_factory=list)
+
+    @classmethod
+    def from_config(cls, conf, cpu, ram, h_wall, m_wall):
+        """Create the job of a dam configuration, walltime given in hours and minutes."""
+        with open(conf, encoding="utf-8") as in_config:
+            chain = json.load(in_config)["chain"]
+        name = os.path.basename(os.path.dirname(os.path.abspath(conf)))
+        return cls(
+            conf,
+            name,
+            chain["log_out"],
+            chain["log_err"],
+            int(cpu),
+            int(ram),
+            60 * int(h_wall) + int(m_wall),
+        )
+
+    def log_file(self, log_file):
+        """Return a log file of the current attempt, suffixed after the first one."""
+        if self.attempt <= 1:
+            return log_file
+        return log_file.replace(".log", f"_{self.attempt}.log")
+
+
+async def run_process(*args):
+    """Run a command, return its exit code and standard output."""
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        logger.debug(f"{' '.join(args)}: {stderr.decode('utf-8').strip()}")
+    return process.returncode, stdout.decode("utf-8")
+
+
+class SlurmBackend:
+    """Slurm submission and batch polling."""
+
+    suffix = ".slurm"
+
+    def __init__(self, account="campus"):
+        """Set the account charged for the jobs."""
+        self.account = account
+
+    def script(self, job, command):
+        """Return the job script of a job."""
+        return (
+            slurm_header(
+                f"d4w_{job.name}",
+                job.log_file(job.log_out),
+                job.log_file(job.log_err),
+                job.cpu,
+                job.ram,
+                job.walltime // 60,
+                job.walltime % 60,
+                self.account,
+            )
+            + environment_exports(job.cpu)
+            + command(job.conf)
+        )
+
+    async def submit(self, job, script_file):
+        """Submit a job script, return the job id."""
+        code, output = await run_process("sbatch", "--parsable", script_file)
+        if code != 0:
+            raise RuntimeError(f"sbatch {script_file} failed")
+        return output.strip().split(";")[0]
+
+    async def poll(self, job_ids):
+        """Return the (state, reason) of the jobs, with one squeue and one sacct call."""
+        states = {}
+        _, output = await run_process(
+            "squeue", "-h", "-o", "%i %T", "-j", ",".join(job_ids)
+        )
+        for line in output.splitlines():
+            job_id, state = line.split()[:2]
+            states[job_id] = (SLURM_STATES.get(state, "running"), None)
+        ended = [job_id for job_id in job_ids if job_id not in states]
+        if ended:
+            _, output = await run_process(
+                "sacct", "-n", "-X", "-P", "-o", "JobID,State", "-j", ",".join(ended)
+            )
+            for line in output.splitlines():
+                job_id, state = line.split("|")[:2]
+                # For instance "CANCELLED by 1234"
+                state = state.split()[0]
+                if state in SLURM_STATES:
+                    states[job_id] = (SLURM_STATES[state], None)
+                else:
+                    states[job_id] = ("failed", SLURM_REASONS.get(state, state.lower()))
+        return states
+
+
+class PBSBackend:
+    """PBS Pro submission and batch polling."""
+
+    suffix = ".pbs"
+
+    def script(self, job, command):
+        """Return the job script of a job."""
+        return (
+            pbs_header(
+                job.log_file(job.log_out),
+                job.log_file(job.log_err),
+                job.cpu,
+                job.ram,
+                job.walltime // 60,
+                job.walltime % 60,
+            )
+            + environment_exports(job.cpu)
+            + command(job.conf)
+        )
+
+    async def submit(self, job, script_file):
+        """Submit a job script, return the job id."""
+        code, output = await run_process("qsub", script_file)
+        if code != 0:
+            raise RuntimeError(f"qsub {script_file} failed")
+        return output.strip()
+
+    async def poll(self, job_ids):
+        """Return the (state, reason) of the jobs, with one qstat call."""
+        _, output = await run_process("qstat", "-x", "-f", "-F", "json", *job_ids)
+        states = {}
+        if not output:
+            return states
+        for job_id, info in json.loads(output).get("Jobs", {}).items():
+            if info["job_state"] != "F":
+                states[job_id] = (PBS_STATES.get(info["job_state"], "running"), None)
+            elif int(info.get("Exit_status", 1)) == 0:
+                states[job_id] = ("success", None)
+            else:
+                exit_status = int(info.get("Exit_status", 1))
+                if exit_status in PBS_REASONS:
+                    reason = PBS_REASONS[exit_status]
+                elif exit_status < 0:
+                    reason = "node"
+                else:
+                    reason = f"exit {exit_status}"
+                states[job_id] = ("failed", reason)
+        return states
+
+
+class LocalBackend:
+    """Stand-in scheduler running the job scripts as local processes.
+
+    At most slots jobs run at once, the others are queued. A job exceeding
+    its walltime is killed, one minute of walltime lasting minute_duration
+    seconds.
+    """
+
+    suffix = ".sh"
+
+    def __init__(self, slots=1, minute_duration=60):
+        """Set the number of simultaneous jobs and the duration of a walltime minute."""
+        self.slots = asyncio.Semaphore(slots)
+        self.minute_duration = minute_duration
+        self.states = {}
+        self.tasks = {}
+
+    def script(self, job, command):
+        """Return the job script of a job."""
+        return (
+            "#!/usr/bin/env bash\n"
+            f"{command(job.conf)} >> {job.log_file(job.log_out)} "
+            f"2>> {job.log_file(job.log_err)}\n"
+        )
+
+    async def run(self, job_id, script_file, walltime):
+        """Run a job script when a slot is free."""
+        async with self.slots:
+            self.states[job_id] = ("running", None)
+            process = await asyncio.create_subprocess_exec("bash", script_file)
+            try:
+                code = await asyncio.wait_for(
+                    process.wait(), walltime * self.minute_duration
+                )
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                self.states[job_id] = ("failed", "timeout")
+                return
+        if code == 0:
+            self.states[job_id] = ("success", None)
+        elif code in (SIGKILL_EXIT, -9):
+            self.states[job_id] = ("failed", "memory")
+        else:
+            self.states[job_id] = ("failed", f"exit {code}")
+
+    async def submit(self, job, script_file):
+        """Queue a job script, return the job id."""
+        job_id = str(len(self.states) + 1)
+        self.states[job_id] = ("queued", None)
+        self.tasks[job_id] = asyncio.ensure_future(
+            self.run(job_id, script_file, job.walltime)
+        )
+        return job_id
+
+    async def poll(self, job_ids):
+        """Return the (state, reason) of the jobs."""
+        return {job_id: self.states[job_id] for job_id in job_ids}
+
+
+class CampaignMonitor:
+    """Submission, polling and resubmission of the jobs of a campaign."""
+
+    def __init__(
+        self,
+        backend,
+        max_active=50,
+        poll_interval=60,
+        max_attempts=3,
+        escalation=2.0,
+        max_walltime=None,
+        max_ram=None,
+        status_file=None,
+        command=single_command,
+    ):
+        """Set the scheduler backend and the submission policy.
+
+        max_active bounds the jobs queued or running at once, escalation is
+        the factor applied to the walltime or memory of a resubmitted dam,
+        up to max_walltime (minutes) and max_ram (GB).
+        """
+        self.backend = backend
+        self.max_active = max_active
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.escalation = escalation
+        self.max_walltime = max_walltime
+        self.max_ram = max_ram
+        self.status_file = status_file
+        self.command = command
+        self.submissions = asyncio.Semaphore(8)
+        self.start = None
+
+    async def submit(self, job):
+        """Write the job script of a job and submit it."""
+        job.attempt += 1
+        script_file = job.log_out.replace(".log", self.backend.suffix)
+        with open(script_file, "w", encoding="utf-8") as script_out:
+            script_out.write(self.backend.script(job, self.command))
+        async with self.submissions:
+            try:
+                job.job_id = await self.backend.submit(job, script_file)
+            except RuntimeError as error:
+                logger.error(f"{job.name}: {error}")
+                self.ended(job, "failed", "submission")
+                return
+        job.state = "queued"
+        logger.info(f"{job.name}: job {job.job_id} submitted (attempt {job.attempt})")
+
+    def escalate(self, job):
+        """Increase the resources of a job after a timeout or a memory kill."""
+        if job.reason == "timeout":
+            job.walltime = int(job.walltime * self.escalation)
+            if self.max_walltime is not None:
+                job.walltime = min(job.walltime, self.max_walltime)
+        elif job.reason == "memory":
+            job.ram = int(job.ram * self.escalation)
+            if self.max_ram is not None:
+                job.ram = min(job.ram, self.max_ram)
+
+    def ended(self, job, state, reason=None):
+        """Record the end of a job.
+
+        The dam is resubmitted if its job failed for a reason of
+        RETRIED_REASONS and it has attempts left.
+        """
+        job.history.append(
+            {
+                "job_id": job.job_id,
+                "state": state,
+                "reason": reason,
+                "walltime": job.walltime,
+                "ram": job.ram,
+            }
+        )
+        job.state, job.reason = state, reason
+        if (
+            state == "failed"
+            and reason in RETRIED_REASONS
+            and job.attempt < self.max_attempts
+        ):
+            self.escalate(job)
+            logger.warning(
+                f"{job.name}: job {job.job_id} failed ({reason}), resubmitted with "
+                f"{job.walltime} min and {job.ram} GB"
+            )
+            job.state = "pending"
+        elif state == "failed" and reason in RETRIED_REASONS:
+            logger.error(f"{job.name}: job {job.job_id} failed ({reason}), giving up")
+        elif state == "failed":
+            logger.error(f"{job.name}: job {job.job_id} failed ({reason}), not resubmitted")
+
+    async def poll(self, jobs):
+        """Update the states of the active jobs with one backend call."""
+        active = {job.job_id: job for job in jobs if job.state in ("queued", "running")}
+        if not active:
+            return
+        states = await self.backend.poll(list(active))
+        for job_id, job in active.items():
+            if job_id not in states:
+                continue
+            state, reason = states[job_id]
+            if state in ("queued", "running"):
+                job.state = state
+            else:
+                self.ended(job, state, reason)
+
+    def status(self, jobs):
+        """Return the count of jobs per state, the throughput and the ETA."""
+        counts = {state: 0 for state in ("pending", "queued", "running", "success", "failed")}
+        for job in jobs:
+            counts[job.state] += 1
+        elapsed = time.monotonic() - self.start
+        finished = counts["success"] + counts["failed"]
+        throughput = finished * 3600 / elapsed if elapsed > 0 else 0.0
+        remaining = len(jobs) - finished
+        eta = remaining * 3600 / throughput if throughput > 0 else None
+        return {
+            **counts,
+            "dams": len(jobs),
+            "elapsed": elapsed,
+            "dams_per_hour": throughput,
+            "eta": eta,
+        }
+
+    def report(self, jobs):
+        """Log the status of the campaign and write the status file."""
+        status = self.status(jobs)
+        eta = "unknown" if status["eta"] is None else f"{status['eta'] / 60:.1f} min"
+        logger.info(
+            f"{status['success']}/{status['dams']} done, {status['failed']} failed, "
+            f"{status['running']} running, {status['queued']} queued, "
+            f"{status['pending']} to submit - {status['dams_per_hour']:.1f} dams/h, "
+            f"ETA {eta}"
+        )
+        if self.status_file is not None:
+            with open(self.status_file + ".tmp", "w", encoding="utf-8") as status_out:
+                json.dump(
+                    {**status, "jobs": [asdict(job) for job in jobs]}, status_out, indent=4
+                )
+            os.replace(self.status_file + ".tmp", self.status_file)
+        return status
+
+    async def run(self, jobs):
+        """Submit the jobs and follow them until all succeeded or gave up."""
+        self.start = time.monotonic()
+        while True:
+            nb_active = sum(1 for job in jobs if job.state in ("queued", "running"))
+            to_submit = [job for job in jobs if job.state == "pending"]
+            to_submit = to_submit[: max(0, self.max_active - nb_active)]
+            await asyncio.gather(*(self.submit(job) for job in to_submit))
+            if all(job.state in ("success", "failed") for job in jobs):
+                return self.report(jobs)
+            await asyncio.sleep(self.poll_interval)
+            await self.poll(jobs)
+            if not all(job.state in ("success", "failed") for job in jobs):
+                self.report(jobs)
+
+
+def get_backend(scheduler, account="campus", slots=1):
+    """Return the backend of a scheduler type (local, PBS or Slurm)."""
+    if scheduler == "Slurm":
+        return SlurmBackend(account)
+    if scheduler == "PBS":
+        return PBSBackend()
+    return LocalBackend(slots)
+
+
+def monitor_campaign(
+    config_list,
+    scheduler,
+    cpu=12,
+    ram=60,
+    h_wall=1,
+    m_wall=0,
+    max_active=50,
+    max_attempts=3,
+    poll_interval=60,
+    status_file=None,
+    slots=1,
+    account="campus",
+    resources=None,
+):
+    """Submit the dam configurations and follow their jobs until the end.
+
+    With the local scheduler, the jobs run as local processes, slots at once.
+    resources gives the (ram, h_wall, m_wall) of dams requesting other than
+    the defaults.
+
+    Returns
+    -------
+    the final status of the campaign
+    """
+    resources = resources or {}
+    jobs = [
+        Job.from_config(conf, cpu, *resources.get(conf, (ram, h_wall, m_wall)))
+        for conf in config_list
+    ]
+
+    async def run():
+        # The local backend semaphore belongs to the running event loop
+        monitor = CampaignMonitor(
+            get_backend(scheduler, account, slots),
+            max_active,
+            poll_interval,
+            max_attempts,
+            status_file=status_file,
+        )
+        return await monitor.run(jobs)
+
+    return asyncio.run(run())
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Order the dams of a campaign by cost and pack the small ones into jobs.
+
+The dams are sorted longest first (LPT): with workers or jobs running at once,
+the long dams start first and the short ones fill the gaps at the end of the
+campaign, which keeps its makespan within 4/3 of the optimum. The cost of a
+dam is its runtime predicted by a cost model (see cost_model.py) or, without
+model, the number of pixels of its DEM extract times its number of contour
+levels, both computed from the database geometry.
+
+With a cost model, small dams are packed into jobs processing them one after
+the other, first fit decreasing up to a target walltime, so that they pay the
+job start-up and the imports once per job instead of once per dam.
+"""
+import logging
+import math
+from dataclasses import dataclass
+from typing import Optional
+
+from dem4water.orchestration.cost_model import (
+    dam_features,
+    request_costs,
+    resources_request,
+)
+
+logger = logging.getLogger("job_packing")
+
+
+@dataclass
+class DamCost:
+    """Estimated cost of a dam, None when its features are unknown."""
+
+    conf: str
+    # Runtime to request (s) with a cost model, geometry cost without
+    runtime: Optional[float] = None
+    # Memory to request (MB), only with a cost model
+    memory: Optional[float] = None
+
+
+def estimate_costs(config_list, model=None):
+    """Return the DamCost of dam configurations, with a cost model if provided."""
+    costs = []
+    for conf in config_list:
+        try:
+            features = dam_features(conf)
+        except (OSError, KeyError, ValueError) as error:
+            logger.warning(f"No features for {conf}: {error}")
+            costs.append(DamCost(conf))
+            continue
+        if model is None:
+            costs.append(DamCost(conf, features["pixels"] * features["levels"]))
+        else:
+            costs.append(DamCost(conf, *request_costs(model, features)))
+    return costs
+
+
+def lpt_order(costs):
+    """Sort DamCost longest first, the dams of unknown cost leading."""
+    return sorted(
+        costs, key=lambda cost: -math.inf if cost.runtime is None else -cost.runtime
+    )
+
+
+def pack_dams(costs, target):
+    """Pack DamCost into jobs of at most target seconds, first fit decreasing.
+
+    The dams of unknown cost and those longer than target get their own job.
+
+    Returns
+    -------
+    the list of packs, each a list of DamCost, in the order of their longest dam
+    """
+    packs, loads = [], []
+    for cost in lpt_order(costs):
+        if cost.runtime is None or cost.runtime >= target:
+            packs.append([cost])
+            loads.append(target)
+            continue
+        for index, load in enumerate(loads):
+            if load + cost.runtime <= target:
+                packs[index].append(cost)
+                loads[index] += cost.runtime
+                break
+        else:
+            packs.append([cost])
+            loads.append(cost.runtime)
+    return packs
+
+
+def pack_request(pack):
+    """Return the (ram in GB, walltime hours, walltime minutes) of a pack.
+
+    None if the cost of a dam of the pack is unknown.
+    """
+    if any(cost.runtime is None or cost.memory is None for cost in pack):
+        return None
+    return resources_request(
+        sum(cost.runtime for cost in pack), max(cost.memory for cost in pack)
+    )
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Job scripts of the dams submitted to PBS or Slurm."""
+import os
+
+
+def environment_exports(cpu):
+    """Return the job script lines exporting the current environment."""
+    # Export system variables simulating loading modules and venv
+    return (
+        "\nmodule purge\n"
+        f"export PYTHONPATH={os.environ.get('PYTHONPATH')}\n"
+        f"export PATH={os.environ.get('PATH')}\n"
+        f"export LD_LIBRARY_PATH={os.environ.get('LD_LIBRARY_PATH')}\n"
+        "export OTB_APPLICATION_PATH="
+        f"{os.environ.get('OTB_APPLICATION_PATH')}\n"
+        f"export GDAL_DATA={os.environ.get('GDAL_DATA')}\n"
+        f"export GEOTIFF_CSV={os.environ.get('GEOTIFF_CSV')}\n"
+        f"export ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS={cpu}\n\n"
+    )
+
+
+def array_range(nb_tasks, limit=None):
+    """Return the task indices of a job array, with the simultaneous tasks limit."""
+    if limit is None:
+        return f"0-{nb_tasks - 1}"
+    return f"0-{nb_tasks - 1}%{limit}"
+
+
+def pbs_header(log_out, log_err, cpu, ram, h_wall, m_wall, array=None):
+    """Return the PBS directives of a job script.
+
+    array is the (number of tasks, maximum simultaneous tasks or None) of a
+    job array.
+    """
+    header = (
+        f"#!/usr/bin/env bash\n"
+        f"#PBS -l select=1:ncpus={cpu}:mem={ram}000MB:os=rh7\n"
+        f"#PBS -l walltime={int(h_wall):02d}:{int(m_wall):02d}:0\n\n"
+        f"#PBS -e {log_err}\n"
+        f"#PBS -o {log_out}\n"
+    )
+    if array is not None:
+        header += f"#PBS -J {array_range(*array)}\n"
+    return header
+
+
+def slurm_header(
+    name, log_out, log_err, cpu, ram, h_wall, m_wall, account, array=None
+):
+    """Return the Slurm directives of a job script.
+
+    array is the (number of tasks, maximum simultaneous tasks or None) of a
+    job array.
+    """
+    header = (
+        "#!/bin/bash\n"
+        f"#SBATCH --job-name {name}\n"
+        "#SBATCH -N 1\n"
+        "#SBATCH --ntasks=1\n"
+        f"#SBATCH --cpus-per-task={cpu}\n"
+        f"#SBATCH --mem={ram}gb\n"
+        f"#SBATCH --time={int(h_wall):02d}:{int(m_wall):02d}:00\n"
+        f"#SBATCH --error={log_err}\n"
+        f"#SBATCH --output={log_out}\n"
+        f"#SBATCH --account={account}\n"
+    )
+    if array is not None:
+        header += f"#SBATCH --array={array_range(*array)}\n"
+    return header
+
+
+def single_command(conf, force=False):
+    """Return the job script line processing one dam, or a list of dams one after the other."""
+    if isinstance(conf, list):
+        conf = " ".join(conf)
+    command = f"dem4water single -dam_json {conf} -scheduler_type local"
+    return command + " -force" if force else command
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""Run the dams of a campaign in parallel local processes.
+
+Each dam runs the full chain in its own process, so a stage exiting (for
+instance when the PDB search fails) or crashing only fails this dam. The
+number of simultaneous dams, a per dam timeout and a memory ceiling can be
+set, and a summary of the run is written as json.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from collections import deque
+from multiprocessing.connection import wait
+
+logger = logging.getLogger("local_executor")
+
+
+def get_dam_logs(conf):
+    """Return the log files of a dam configuration, (None, None) if not set."""
+    with open(conf, encoding="utf-8") as in_config:
+        chain = json.load(in_config).get("chain", {})
+    return chain.get("log_out"), chain.get("log_err")
+
+
+def run_dam(conf, max_memory=None):
+    """Process entry point: run the full chain of one dam.
+
+    The outputs are redirected to the dam log files, and the address space of
+    the process is limited to max_memory GB if provided.
+    """
+    # pylint: disable=import-outside-toplevel
+    from dem4water.cli import launch_full_process
+
+    if max_memory is not None:
+        limit = int(max_memory * 1024**3)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    log_out, log_err = get_dam_logs(conf)
+    for log_file, stream in ((log_out, sys.stdout), (log_err, sys.stderr)):
+        if log_file is not None:
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+            with open(log_file, "a", encoding="utf-8") as log:
+                stream.flush()
+                os.dup2(log.fileno(), stream.fileno())
+    sys.exit(launch_full_process(conf))
+
+
+def run_dam_process(conf, timeout=None, max_memory=None):
+    """Run the full chain of one dam in a child process and wait for it.
+
+    Returns
+    -------
+    the record of the dam: configuration, status, exit code and duration
+    """
+    start = time.monotonic()
+    process = multiprocessing.Process(
+        target=run_dam, args=(conf, max_memory), name=conf
+    )
+    process.start()
+    process.join(timeout)
+    if process.exitcode is None:
+        process.kill()
+        process.join()
+        status = "timeout"
+    else:
+        status = "success" if process.exitcode == 0 else "failed"
+    return {
+        "config": conf,
+        "status": status,
+        "exitcode": process.exitcode,
+        "duration": time.monotonic() - start,
+    }
+
+
+def run_local_campaign(
+    config_list,
+    workers=None,
+    timeout=None,
+    max_memory=None,
+    summary_file=None,
+    debug=False,
+):
+    """Run the dam configurations in at most workers simultaneous processes.
+
+    Parameters
+    ----------
+    config_list:
+        the dam configuration files, as written by write_json
+    workers:
+        number of simultaneous dams, all the CPUs if None
+    timeout:
+        maximum duration of a dam in seconds, the dam is killed beyond
+    max_memory:
+        maximum memory of a dam process in GB
+    summary_file:
+        json file receiving the status, exit code and duration of each dam
+
+    Returns
+    -------
+    the list of dam records of the summary
+    """
+    logging_format = (
+        "%(asctime)s - %(filename)s:%(lineno)s - %(levelname)s - %(message)s"
+    )
+    if debug is True:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.DEBUG, format=logging_format
+        )
+    else:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.INFO, format=logging_format
+        )
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    if workers is None:
+        workers = os.cpu_count()
+    t_start = time.monotonic()
+    pending = deque(config_list)
+    running = {}
+    records = []
+    while pending or running:
+        while pending and len(running) < workers:
+            conf = pending.popleft()
+            process = multiprocessing.Process(
+                target=run_dam, args=(conf, max_memory), name=conf
+            )
+            process.start()
+            running[process.sentinel] = (process, conf, time.monotonic())
+            logger.info(f"Started {conf}")
+
+        wait_time = None
+        if timeout is not None:
+            now = time.monotonic()
+            wait_time = max(
+                0, min(start + timeout - now for _, _, start in running.values())
+            )
+        finished = wait(list(running), timeout=wait_time)
+
+        now = time.monotonic()
+        for sentinel in list(running):
+            process, conf, start = running[sentinel]
+            if sentinel in finished:
+                process.join()
+                status = "success" if process.exitcode == 0 else "failed"
+            elif timeout is not None and now - start >= timeout:
+                process.kill()
+                process.join()
+                status = "timeout"
+            else:
+                continue
+            del running[sentinel]
+            records.append(
+                {
+                    "config": conf,
+                    "status": status,
+                    "exitcode": process.exitcode,
+                    "duration": now - start,
+                }
+            )
+            log = logger.info if status == "success" else logger.error
+            log(
+                f"{status} {conf} in {now - start:.1f}s "
+                f"({len(records)}/{len(config_list)})"
+            )
+
+    summary = {
+        "workers": workers,
+        "timeout": timeout,
+        "max_memory": max_memory,
+        "duration": time.monotonic() - t_start,
+        "nb_dams": len(records),
+        "nb_success": sum(1 for record in records if record["status"] == "success"),
+        "nb_failed": sum(1 for record in records if record["status"] == "failed"),
+        "nb_timeout": sum(1 for record in records if record["status"] == "timeout"),
+        "dams": records,
+    }
+    logger.info(
+        f"{summary['nb_success']} dams processed, {summary['nb_failed']} failed, "
+        f"{summary['nb_timeout']} timed out in {summary['duration']:.1f}s"
+    )
+    if summary_file is not None:
+        with open(summary_file, "w", encoding="utf-8") as out_summary:
+            json.dump(summary, out_summary, indent=4)
+        logger.info(f"Summary written to {summary_file}")
+    return records
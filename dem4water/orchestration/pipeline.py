@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""Stages of the dem4water chain for one dam.
+
+Each stage is described by the key of its parameters in the dam
+configuration, the function running it and the files it produces. Its code
+fingerprint covers its module and the dem4water modules it imports, found in
+their sources (see checkpoint.source_fingerprint). The stages are imported
+only when they run.
+"""
+import importlib
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from time import perf_counter
+from typing import Callable, List, Optional
+
+from dem4water.orchestration.checkpoint import Checkpoint, stage_entry
+from dem4water.orchestration.cost_model import peak_rss, reset_peak_rss
+from dem4water.orchestration.stage_cache import StageCache
+
+logger = logging.getLogger("pipeline")
+
+
+@dataclass
+class Stage:
+    """A stage of the chain."""
+
+    name: str
+    module: str
+    function: str
+    outputs: Callable[[dict], List[str]]
+    # Modules loaded otherwise than by an import statement
+    sources: List[str] = field(default_factory=list)
+    skip: Optional[Callable[[dict], Optional[str]]] = None
+    # Bound by reads of the national DEM and watermap rather than by the CPU
+    io_bound: bool = False
+
+    @property
+    def modules(self):
+        """Return the modules of the code fingerprint of the stage."""
+        return [self.module] + self.sources
+
+    def run(self, params):
+        """Import the stage function and call it with its parameters."""
+        function = getattr(importlib.import_module(self.module), self.function)
+        return function(**params)
+
+
+def extract_dem(config):
+    """Return the DEM extract written by area_mapping."""
+    if "find_pdb_and_cutline" in config:
+        return config["find_pdb_and_cutline"]["dem"]
+    return config["find_cutline_and_pdb"]["dem_raster"]
+
+
+def skip_area_mapping(config):
+    """Skip the extraction when the DEM extract already exists."""
+    if os.path.exists(extract_dem(config)):
+        return f"{extract_dem(config)} already exists. Skipping area_mapping"
+    return None
+
+
+def skip_cutline(config):
+    """Skip the cutline and daminfo generation when custom files are provided."""
+    if (
+        "_custom" in config["cut_contourlines"]["info"]
+        and "_custom" in config["cut_contourlines"]["cutline"]
+    ):
+        return "Skip cutline and daminfo generation because customs files found."
+    return None
+
+
+def cutline_outputs(config):
+    """Return the daminfo and cutline files used by cut_contourlines."""
+    return [config["cut_contourlines"]["info"], config["cut_contourlines"]["cutline"]]
+
+
+def json_output(stage):
+    """Return the function giving the json file written next to a stage outfile."""
+    return lambda config: [os.path.splitext(config[stage]["outfile"])[0] + ".json"]
+
+
+STAGES = [
+    Stage(
+        "area_mapping",
+        "dem4water.area_mapping_v2",
+        "area_mapping",
+        lambda config: [extract_dem(config)],
+        skip=skip_area_mapping,
+        io_bound=True,
+    ),
+    Stage(
+        "find_cutline_and_pdb",
+        "dem4water.find_cutline_and_pdb",
+        "find_cutline_and_pdb",
+        cutline_outputs,
+        skip=skip_cutline,
+    ),
+    Stage(
+        "find_pdb_and_cutline",
+        "dem4water.find_pdb_and_cutline",
+        "find_pdb_and_cutline",
+        cutline_outputs,
+        skip=skip_cutline,
+    ),
+    Stage(
+        "cut_contourlines",
+        "dem4water.cut_contourlines",
+        "cut_countourlines",
+        lambda config: [config["szi_to_model"]["szi_file"]],
+    ),
+    Stage(
+        "szi_to_model",
+        "dem4water.szi_to_model",
+        "szi_to_model",
+        json_output("szi_to_model"),
+    ),
+    Stage(
+        "val_report",
+        "dem4water.val_report",
+        "val_report",
+        json_output("val_report"),
+    ),
+]
+
+
+def checkpoint_file(input_config_json):
+    """Return the stage manifest of a dam configuration."""
+    return os.path.splitext(input_config_json)[0] + "_stages.json"
+
+
+def run_stage(
+    stage, config, checkpoint=None, cache=None, force=False, measure_memory=True
+):
+    """Run a stage unless its checkpoint shows nothing changed since its last run.
+
+    With a stage cache, the outputs of a run with the same inputs, parameters
+    and code are copied instead of running the stage, and new runs are stored.
+    With force, the stage runs whatever its checkpoint and the cache content.
+    Without measure_memory, for a stage run in a thread sharing the process
+    with other stages, its peak memory is recorded as None.
+
+    Returns
+    -------
+    True if the stage ran or was restored from the cache
+    """
+    params = config[stage.name]
+    outputs = stage.outputs(config)
+    if checkpoint is not None:
+        entry = stage_entry(params, stage.modules, outputs)
+        if not force and checkpoint.is_done(stage.name, entry, outputs):
+            logger.info(f"{stage.name}: inputs, parameters and code unchanged, skipped")
+            return False
+    # Duration and peak memory of the stage, recorded for the cost model
+    if measure_memory:
+        children_start = reset_peak_rss()
+    t_start = perf_counter()
+    restored = False
+    try:
+        key = None
+        if cache is not None:
+            key = cache.key(stage.name, params, stage.modules, outputs)
+        if key is not None and not force and cache.restore(key):
+            logger.info(f"{stage.name}: outputs restored from the stage cache")
+            restored = True
+        else:
+            if cache is not None:
+                folders = cache.folders(params, outputs)
+                before = cache.snapshot(folders)
+            stage.run(params)
+            if cache is not None:
+                cache.store(key, stage.name, folders, before)
+    except BaseException:
+        if checkpoint is not None:
+            checkpoint.invalidate(stage.name)
+        raise
+    if checkpoint is not None:
+        checkpoint.record(
+            stage.name,
+            entry,
+            outputs,
+            perf_counter() - t_start,
+            peak_rss(children_start) if measure_memory else None,
+            restored,
+        )
+    return True
+
+
+def get_stage_cache(config, excluded):
+    """Return the stage cache set in the chain section of a dam configuration."""
+    chain = config.get("chain", {})
+    if not chain.get("stage_cache"):
+        return None
+    # Configurations written before the output path was stored in the chain
+    output_path = chain.get("output_path", os.path.dirname(chain["log_folder"]))
+    return StageCache(chain["stage_cache"], output_path, excluded)
+
+
+def load_pipeline(input_config_json):
+    """Return the configuration, checkpoint and stage cache of a dam."""
+    with open(input_config_json, encoding="utf-8") as in_config:
+        config = json.load(in_config)
+    checkpoint = Checkpoint(checkpoint_file(input_config_json))
+    cache = get_stage_cache(
+        config, [input_config_json, checkpoint.manifest_file, checkpoint.manifest_file + ".tmp"]
+    )
+    return config, checkpoint, cache
+
+
+def dam_stages(config):
+    """Return the stages of the chain present in a dam configuration."""
+    return [stage for stage in STAGES if stage.name in config]
+
+
+def run_config_stage(stage, config, checkpoint, cache, force=False, measure_memory=True):
+    """Run a stage of a dam unless its skip rule applies."""
+    reason = stage.skip(config) if stage.skip is not None else None
+    if reason is not None:
+        logging.info(reason)
+        return False
+    return run_stage(stage, config, checkpoint, cache, force, measure_memory)
+
+
+def run_pipeline(input_config_json, force=False):
+    """Run the stages of a dam configuration, skipping the unchanged ones.
+
+    Parameters
+    ----------
+    input_config_json:
+        the dam configuration, as written by write_json
+    force:
+        run every stage whatever its checkpoint and the stage cache
+    """
+    config, checkpoint, cache = load_pipeline(input_config_json)
+    for stage in dam_stages(config):
+        run_config_stage(stage, config, checkpoint, cache, force)
+    return 0
@@ -17,6 +17,7 @@ import shutil
 import subprocess
 import time
 import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 
@@ -131,9 +132,27 @@ def find_corrected_input(path, dam_name, opt_path=None):
     return additionnal_params
 
 
+def run_command(cmd, stdout_param, stderr_param):
+    """Run a shell command, return its exit status and duration.
+
+    :param cmd : the command to run
+    :type cmd : str
+    :param stdout_param : opened stdout file
+    :param stderr_param : opened stderr file
+    """
+    start = time.monotonic()
+    status = subprocess.run(
+        cmd, stdout=stdout_param, stderr=stderr_param, shell=True, check=False
+    ).returncode
+    return {"command": cmd, "status": status, "duration": time.monotonic() - start}
+
+
 def run_processing(cmd_list, stdoutfile, stderrfile, title="", nb_procs="1"):
     """Run qsub processings.
 
+    The commands run in nb_procs threads each waiting for its child process,
+    a command starting as soon as another one ends.
+
     :param cmd_list : the commands to run
     :type cmd_list : str
     :param stdoutfile : name of stdoutfile
@@ -144,51 +163,38 @@ def run_processing(cmd_list, stdoutfile, stderrfile, title="", nb_procs="1"):
     :type title : str
     :param nb_procs :number of processors
     :type nb_procs : str
+    :return: the command, exit status and duration of each command, in the
+        order of cmd_list
     """
     nb_cmd = len(cmd_list)
     start = time.time()
-    pids = []
-    stdout_param = open(stdoutfile, "a")
-    stderr_param = open(stderrfile, "a")
+    records = [None] * nb_cmd
 
     logging.info(f"Running :  {title} {cmd_list}")
 
-    while len(cmd_list) > 0 or len(pids) > 0:
-        if (len(pids) < int(nb_procs)) and (len(cmd_list) > 0):
-            pids.append(
-                [
-                    subprocess.Popen(
-                        cmd_list[0],
-                        stdout=stdout_param,
-                        stderr=stderr_param,
-                        shell=True,
-                    ),
-                    cmd_list[0],
-                ]
-            )
-            cmd_list.remove(cmd_list[0])
-
-        for i, pid in enumerate(pids):
-            status = pid[0].poll()
-
-            if status is not None and status != 0:
-                print("!! ERROR in pid #" + str(i) + " id=" + str(pid[0]))
-                print(pid[1])
-                del pids[i]
-                break
-            if status == 0:
-                del pids[i]
+    with open(stdoutfile, "a") as stdout_param, open(
+        stderrfile, "a"
+    ) as stderr_param, ThreadPoolExecutor(max_workers=int(nb_procs)) as executor:
+        futures = {
+            executor.submit(run_command, cmd, stdout_param, stderr_param): i
+            for i, cmd in enumerate(cmd_list)
+        }
+        for nb_done, future in enumerate(as_completed(futures), start=1):
+            i = futures[future]
+            records[i] = future.result()
+            if records[i]["status"] != 0:
                 print(
-                    title
-                    + "... "
-                    + str(int((nb_cmd - (len(cmd_list) + len(pids))) * 100.0 / nb_cmd))
-                    + "%"
+                    "!! ERROR in command #"
+                    + str(i)
+                    + " exit status="
+                    + str(records[i]["status"])
                 )
-                time.sleep(0.2)
-                break
+                print(records[i]["command"])
+            print(title + "... " + str(int(nb_done * 100.0 / nb_cmd)) + "%")
     end = time.time()
 
     print(str(title + " done, elapsed time : " + str(end - start)))
+    return records
 
 
 def mk_dir(path):
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""Content addressed cache of stage results shared between campaigns.
+
+A stage result is stored under a key computed from the content of its input
+files, its other parameters (paths inside the campaign being made relative to
+it) and the fingerprint of its source modules. The files written by the stage
+in the campaign folders are stored once per content:
+
+    <cache>/objects/<sha[:2]>/<sha>    file contents
+    <cache>/entries/<key>.json         stage, relative path and sha of each file
+
+A campaign of another revision, or in another output folder, finding the key
+of a stage copies its files instead of running it. As the key depends on the
+content of the inputs, a stage whose code changed invalidates all the
+downstream stages whose inputs actually changed, and only them.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from dem4water.orchestration.checkpoint import (
+    file_fingerprint,
+    input_files,
+    normalize_parameters,
+    sha256_file,
+    source_fingerprint,
+)
+
+logger = logging.getLogger("stage_cache")
+
+
+class StageCache:
+    """Stage results of the campaigns written in output_path, stored in cache_dir."""
+
+    def __init__(self, cache_dir, output_path, excluded=()):
+        """Create the cache folders if needed.
+
+        excluded lists the files of the campaign never cached, like the dam
+        configuration and its checkpoint manifest.
+        """
+        self.cache_dir = cache_dir
+        self.output_path = os.path.abspath(output_path)
+        self.excluded = {os.path.abspath(path) for path in excluded}
+        for folder in ("objects", "entries"):
+            os.makedirs(os.path.join(cache_dir, folder), exist_ok=True)
+
+    def in_campaign(self, path):
+        """Check if a path is inside the campaign output folder."""
+        return os.path.abspath(path).startswith(self.output_path + os.sep)
+
+    def relative(self, value):
+        """Return a path inside the campaign relative to it, other values unchanged."""
+        if isinstance(value, str) and self.in_campaign(value):
+            return "<output>/" + os.path.relpath(os.path.abspath(value), self.output_path)
+        return value
+
+    def key(self, stage, params, modules, outputs):
+        """Return the cache key of a stage run.
+
+        Input files are identified by their content, the campaign files being
+        always hashed whatever their size.
+        """
+        params = normalize_parameters(params)
+        for path in input_files(params, outputs):
+            for name, value in params.items():
+                if value == path:
+                    params[name] = (
+                        f"sha256:{sha256_file(path)}"
+                        if self.in_campaign(path)
+                        else file_fingerprint(path)
+                    )
+        params = {name: self.relative(value) for name, value in params.items()}
+        description = {
+            "stage": stage,
+            "params": params,
+            "code": source_fingerprint(tuple(modules)),
+        }
+        return hashlib.sha256(
+            json.dumps(description, sort_keys=True).encode()
+        ).hexdigest()
+
+    def folders(self, params, outputs):
+        """Return the campaign folders a stage writes to.
+
+        These are the campaign folders among its parameters and the folders
+        of its outputs.
+        """
+        candidates = [
+            value
+            for value in params.values()
+            if isinstance(value, str) and os.path.isdir(value)
+        ] + [os.path.dirname(output) for output in outputs]
+        return sorted(
+            {os.path.abspath(folder) for folder in candidates if self.in_campaign(folder)}
+        )
+
+    def snapshot(self, folders):
+        """Return the size and modification time of the files of folders."""
+        files = {}
+        for folder in folders:
+            for root, _, names in os.walk(folder):
+                for name in names:
+                    path = os.path.join(root, name)
+                    if path not in self.excluded:
+                        stat = os.stat(path)
+                        files[path] = (stat.st_size, stat.st_mtime_ns)
+        return files
+
+    def object_file(self, sha):
+        """Return the cache file storing a content."""
+        return os.path.join(self.cache_dir, "objects", sha[:2], sha)
+
+    def entry_file(self, key):
+        """Return the cache entry of a key."""
+        return os.path.join(self.cache_dir, "entries", f"{key}.json")
+
+    @staticmethod
+    def replace_file(target, write):
+        """Write a cache file through a temporary file of its own, then move it.
+
+        write receives the temporary file path. Each writer has its own
+        temporary file, so that concurrent campaigns storing the same object
+        or key replace the target one after the other with the same content.
+        """
+        handle, temp_file = tempfile.mkstemp(
+            dir=os.path.dirname(target), prefix=".", suffix=".tmp"
+        )
+        os.close(handle)
+        try:
+            write(temp_file)
+            os.replace(temp_file, target)
+        except BaseException:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise
+
+    def store(self, key, stage, folders, before):
+        """Store the files created or modified by a stage since the before snapshot."""
+        files = {}
+        for path, stat in self.snapshot(folders).items():
+            if before.get(path) == stat:
+                continue
+            sha = sha256_file(path)
+            object_file = self.object_file(sha)
+            # An object already stored, or being stored, has the same content
+            if not os.path.exists(object_file):
+                os.makedirs(os.path.dirname(object_file), exist_ok=True)
+                self.replace_file(
+                    object_file,
+                    lambda temp_file, path=path: shutil.copyfile(path, temp_file),
+                )
+            files[os.path.relpath(path, self.output_path)] = sha
+
+        def write_entry(temp_file):
+            with open(temp_file, "w", encoding="utf-8") as entry_out:
+                json.dump({"stage": stage, "files": files}, entry_out, indent=4)
+
+        self.replace_file(self.entry_file(key), write_entry)
+        logger.debug(f"{stage}: {len(files)} files stored under {key}")
+
+    def restore(self, key):
+        """Copy the files of a cache entry into the campaign.
+
+        Returns
+        -------
+        True if the entry exists and all its files were restored
+        """
+        if not os.path.exists(self.entry_file(key)):
+            return False
+        with open(self.entry_file(key), encoding="utf-8") as entry_in:
+            entry = json.load(entry_in)
+        if not all(os.path.exists(self.object_file(sha)) for sha in entry["files"].values()):
+            logger.warning(f"{entry['stage']}: incomplete cache entry {key}, ignored")
+            return False
+        for relative_path, sha in entry["files"].items():
+            path = os.path.join(self.output_path, relative_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copyfile(self.object_file(sha), path)
+        return True
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""Shared filesystem work queue for campaigns.
+
+The dams of a campaign manifest (one configuration file per line) are claimed
+by long running workers through exclusive lock files, so that the workers
+keep pulling dams until the queue is empty whatever the duration of each
+dam. The queue lives next to the manifest:
+
+    <manifest>_queue/claims/<index>.<attempt>.lock   worker which claimed the dam
+    <manifest>_queue/results/<index>.json            status and duration of the dam
+
+The worker processing a dam touches its lock file every lease / 4 seconds. A
+claim without result whose lock file was not touched for a lease belongs to
+an interrupted worker (killed, walltime reached): the next worker claims the
+following attempt of the dam. A dam interrupted MAX_CLAIMS times is abandoned.
+The workers go over the manifest until no dam is pending or running, so that
+the claims expiring after their last pass are taken over.
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from dem4water.orchestration.local_executor import run_dam_process
+
+logger = logging.getLogger("work_queue")
+
+# Duration (s) after which a claim without heartbeat is taken over
+LEASE = 600
+MAX_CLAIMS = 3
+
+
+def read_manifest(manifest):
+    """Return the configuration files listed in a manifest."""
+    with open(manifest, encoding="utf-8") as manifest_file:
+        return [line.strip() for line in manifest_file if line.strip()]
+
+
+def queue_folders(manifest):
+    """Return the claims and results folders of a manifest, created if needed."""
+    queue = os.path.splitext(manifest)[0] + "_queue"
+    folders = (os.path.join(queue, "claims"), os.path.join(queue, "results"))
+    for folder in folders:
+        os.makedirs(folder, exist_ok=True)
+    return folders
+
+
+def claim_file(claims_folder, index, attempt):
+    """Return the lock file of an attempt of the dam at index."""
+    return os.path.join(claims_folder, f"{index}.{attempt}.lock")
+
+
+def claim_state(claims_folder, index, lease=LEASE):
+    """Return the number of claims of a dam and whether the last one is alive."""
+    for attempt in range(MAX_CLAIMS):
+        try:
+            age = time.time() - os.path.getmtime(claim_file(claims_folder, index, attempt))
+        except FileNotFoundError:
+            return attempt, False
+        if age < lease:
+            return attempt + 1, True
+    return MAX_CLAIMS, False
+
+
+def claim(claims_folder, index, worker_id, lease=LEASE):
+    """Claim the dam at index of the manifest.
+
+    The lock file of the first attempt not claimed yet is created with
+    O_CREAT | O_EXCL, only one worker succeeds even when several try at once
+    on a shared filesystem. The next attempt is only tried when the lock file
+    of the previous one is older than lease.
+
+    Returns
+    -------
+    the lock file if the dam was claimed by this worker, None otherwise
+    """
+    nb_claims, alive = claim_state(claims_folder, index, lease)
+    if alive or nb_claims == MAX_CLAIMS:
+        return None
+    if nb_claims:
+        logger.warning(f"Claim {nb_claims - 1} of dam {index} expired, taking it over")
+    lock_file = claim_file(claims_folder, index, nb_claims)
+    try:
+        lock = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return None
+    with os.fdopen(lock, "w", encoding="utf-8") as lock_out:
+        json.dump({"worker": worker_id, "claimed": time.time()}, lock_out)
+    return lock_file
+
+
+@contextmanager
+def heartbeat(lock_file, lease=LEASE):
+    """Touch the lock file of a claim every lease / 4 seconds in a thread."""
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(lease / 4):
+            try:
+                os.utime(lock_file)
+            except OSError as error:
+                logger.warning(f"Heartbeat of {lock_file} failed: {error}")
+
+    thread = threading.Thread(target=beat, name="heartbeat", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def queue_status(manifest, lease=LEASE):
+    """Count the pending, running (claim alive without result), finished and abandoned dams."""
+    claims_folder, results_folder = queue_folders(manifest)
+    nb_dams = len(read_manifest(manifest))
+    status = {"dams": nb_dams, "success": 0, "failed": 0, "timeout": 0}
+    status.update({"running": 0, "pending": 0, "abandoned": 0})
+    for index in range(nb_dams):
+        result_file = os.path.join(results_folder, f"{index}.json")
+        if os.path.exists(result_file):
+            with open(result_file, encoding="utf-8") as result_in:
+                status[json.load(result_in)["status"]] += 1
+            continue
+        nb_claims, alive = claim_state(claims_folder, index, lease)
+        if alive:
+            status["running"] += 1
+        elif nb_claims == MAX_CLAIMS:
+            status["abandoned"] += 1
+        else:
+            status["pending"] += 1
+    return status
+
+
+def process_claimable(manifest, worker_id, timeout, max_memory, lease):
+    """Go over the manifest once, processing the dams this worker can claim.
+
+    Returns
+    -------
+    the records of the dams processed
+    """
+    claims_folder, results_folder = queue_folders(manifest)
+    records = []
+    for index, conf in enumerate(read_manifest(manifest)):
+        result_file = os.path.join(results_folder, f"{index}.json")
+        if os.path.exists(result_file):
+            continue
+        lock_file = claim(claims_folder, index, worker_id, lease)
+        # A dam finished by the worker of an expired claim is not run again
+        if lock_file is None or os.path.exists(result_file):
+            continue
+        logger.info(f"{worker_id} claimed {index}: {conf}")
+        with heartbeat(lock_file, lease):
+            record = run_dam_process(conf, timeout, max_memory)
+        record.update({"index": index, "worker": worker_id})
+        with open(result_file + ".tmp", "w", encoding="utf-8") as result_out:
+            json.dump(record, result_out, indent=4)
+        # Readers never see a partial result
+        os.replace(result_file + ".tmp", result_file)
+        log = logger.info if record["status"] == "success" else logger.error
+        log(f"{record['status']} {conf} in {record['duration']:.1f}s")
+        records.append(record)
+    return records
+
+
+def run_worker(
+    manifest, worker_id=None, timeout=None, max_memory=None, debug=False, lease=LEASE
+):
+    """Process the dams of a manifest until none is pending or running.
+
+    While the claims of other workers are alive, the worker goes over the
+    manifest again every lease / 4 seconds to take over those which expire.
+
+    Parameters
+    ----------
+    manifest:
+        the campaign manifest, one dam configuration file per line
+    worker_id:
+        name of the worker in the claims, <host>_<pid> if None
+    timeout:
+        maximum duration of a dam in seconds, the dam is killed beyond
+    max_memory:
+        maximum memory of a dam process in GB
+    lease:
+        duration (s) after which the claim of an interrupted worker is taken over
+
+    Returns
+    -------
+    the records of the dams processed by this worker
+    """
+    logging_format = (
+        "%(asctime)s - %(filename)s:%(lineno)s - %(levelname)s - %(message)s"
+    )
+    if debug is True:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.DEBUG, format=logging_format
+        )
+    else:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.INFO, format=logging_format
+        )
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    if worker_id is None:
+        worker_id = f"{socket.gethostname()}_{os.getpid()}"
+
+    records = []
+    while True:
+        processed = process_claimable(manifest, worker_id, timeout, max_memory, lease)
+        records += processed
+        status = queue_status(manifest, lease)
+        if status["pending"] == 0 and status["running"] == 0:
+            break
+        if not processed:
+            logger.debug(f"{worker_id}: {status['running']} dams claimed by other workers")
+            time.sleep(lease / 4)
+    logger.info(f"{worker_id}: no dam left, {len(records)} dams processed.")
+    logger.info(f"Queue status: {status}")
+    return records
+
+
+def work_queue_parameters():
+    """Define work_queue parser arguments."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("-manifest", help="Campaign manifest", required=True)
+    parser.add_argument("-worker_id", default=None, help="Name of the worker")
+    parser.add_argument(
+        "-timeout", type=float, default=None, help="Maximum duration of a dam (s)"
+    )
+    parser.add_argument(
+        "-max_memory", type=float, default=None, help="Maximum memory of a dam (GB)"
+    )
+    parser.add_argument(
+        "-lease",
+        type=float,
+        default=LEASE,
+        help="Duration (s) after which the claim of an interrupted worker is taken over",
+    )
+    parser.add_argument(
+        "-status", action="store_true", help="Print the queue status and exit"
+    )
+    parser.add_argument("-debug", action="store_true", help="Activate Debug Mode")
+    return parser
+
+
+def main():
+    """Cli for work_queue.py."""
+    parser = work_queue_parameters()
+    args = parser.parse_args()
+    if args.status:
+        print(json.dumps(queue_status(args.manifest, args.lease), indent=4))
+    else:
+        run_worker(
+            args.manifest,
+            args.worker_id,
+            args.timeout,
+            args.max_memory,
+            args.debug,
+            args.lease,
+        )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -133,6 +133,37 @@ def get_table(measure, sites, rep_files, func):
     return table
 
 
+def run_cached_campaign(args):
+    """Run the baseline campaign through dem4water camp_ref with a stage cache.
+
+    The stages whose inputs, parameters and code are unchanged since a
+    previous campaign sharing the cache are restored instead of being run,
+    the sites parameters being the campaign configurations of data/.
+    """
+    logging.info("Using the stage cache " + args.stage_cache)
+    subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "dem4water.cli",
+            "camp_ref",
+            "-output_folder",
+            str(pathlib.Path(args.outdir).absolute()),
+            "-name",
+            args.name if args.name is not None else get_current_git_rev(),
+            "-sites",
+            *[pathlib.Path(site).stem for site in args.sites],
+            "-scheduler_type",
+            "local",
+            "-workers",
+            str(args.workers),
+            "-stage_cache",
+            str(pathlib.Path(args.stage_cache).absolute()),
+        ],
+        check=True,
+    )
+
+
 def run_campaign(args):
     """Run the baseline campaign."""
     logging.info("Starting baseline campaign execution.")
@@ -144,6 +175,9 @@ def run_campaign(args):
         opath = str(pathlib.Path(args.outdir, args.name))
     else:
         opath = str(pathlib.Path(args.outdir, get_current_git_rev()).absolute())
+    if args.stage_cache is not None:
+        run_cached_campaign(args)
+        return
     # Retrieve baseline sites info
     aux_cmd = ""
     if args.radius is not None:
@@ -332,6 +366,16 @@ def main(arguments):
     parser_camp.add_argument(
         "--select_mode", type=str, help="Select szi", default="best"
     )
+    parser_camp.add_argument(
+        "--stage_cache",
+        help="Run dem4water camp_ref, reusing the stage results of previous campaigns, "
+        "with the parameters of the data/ campaign configurations: --radius, "
+        "--elev_off, --jump_ratio and --select_mode can not be changed",
+        default=None,
+    )
+    parser_camp.add_argument(
+        "--workers", type=int, help="Dams processed simultaneously", default=1
+    )
 
     # ###########################
     # Report sub-command
@@ -404,6 +448,18 @@ def main(arguments):
     )
 
     args = parser.parse_args(arguments)
+    if args.mode == "campaign" and args.stage_cache is not None:
+        # camp_ref runs the data/ campaign configurations, without overrides
+        changed = [
+            f"--{name}"
+            for name in ("radius", "elev_off", "jump_ratio", "select_mode")
+            if getattr(args, name) != parser_camp.get_default(name)
+        ]
+        if changed:
+            parser_camp.error(
+                f"{', '.join(changed)} can not be used with --stage_cache, the "
+                "cached campaign runs the parameters of the data/ configurations"
+            )
 
     # Setup Logger
     logging_format = (
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Measure the start-up time of the dem4water command line.
+
+Each command is run several times in a fresh interpreter and the median wall
+time is reported, with the slowest imports of the dem4water.cli module.
+Exits with an error if a median exceeds -max_seconds.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+from time import perf_counter
+
+COMMANDS = {
+    "python": [sys.executable, "-c", "pass"],
+    "import cli": [sys.executable, "-c", "import dem4water.cli"],
+    "dem4water -h": [sys.executable, "-m", "dem4water.cli", "-h"],
+    "dem4water campaign -h": [sys.executable, "-m", "dem4water.cli", "campaign", "-h"],
+}
+
+
+def time_command(command, repeat):
+    """Return the wall times of repeat runs of a command."""
+    durations = []
+    for _ in range(repeat):
+        t_start = perf_counter()
+        subprocess.run(command, check=True, capture_output=True)
+        durations.append(perf_counter() - t_start)
+    return durations
+
+
+def slowest_imports(module, count):
+    """Return the count slowest cumulated imports of a module (-X importtime)."""
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stderr
+    imports = []
+    for line in output.splitlines()[1:]:
+        # import time: self [us] | cumulative | imported package
+        fields = line.split("|")
+        if len(fields) == 3:
+            imports.append((int(fields[1]), fields[2].strip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def startup_time(repeat=5, max_seconds=None, nb_imports=10):
+    """Print the median start-up time of each command.
+
+    Returns
+    -------
+    the dict of median durations (s) per command
+    """
+    medians = {}
+    for name, command in COMMANDS.items():
+        durations = time_command(command, repeat)
+        medians[name] = statistics.median(durations)
+        print(
+            f"{name:<24} median {medians[name]:.3f}s "
+            f"(min {min(durations):.3f}s, max {max(durations):.3f}s)"
+        )
+    print("\nSlowest imports of dem4water.cli (cumulated):")
+    for cumulated, module in slowest_imports("dem4water.cli", nb_imports):
+        print(f"{cumulated / 1e6:8.3f}s {module}")
+    if max_seconds is not None:
+        slow = [name for name, median in medians.items() if median > max_seconds]
+        if slow:
+            sys.exit(f"Start-up slower than {max_seconds}s: {', '.join(slow)}")
+    return medians
+
+
+def main():
+    """Cli for startup_time.py."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("-repeat", type=int, default=5, help="Runs per command")
+    parser.add_argument(
+        "-max_seconds", type=float, default=None, help="Maximum median duration"
+    )
+    parser.add_argument(
+        "-imports", type=int, default=10, help="Number of slowest imports shown"
+    )
+    args = parser.parse_args()
+    startup_time(args.repeat, args.max_seconds, args.imports)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
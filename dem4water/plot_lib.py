@@ -10,10 +10,12 @@ import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib import ticker
 
+from dem4water import model as hsv
+
 
 matplotlib.use("agg")
 
-def plot_szi_points(r_elev, r_area, pdb_elev, damname, outfile):
+def plot_szi_points(r_elev, r_area, pdb_elev, damname, outfile, dpi=100):
     """Plot the szi using area and altitudes."""
     fig, ax1 = plt.subplots()
     # Trick to display in Ha
@@ -37,10 +39,29 @@ def plot_szi_points(r_elev, r_area, pdb_elev, damname, outfile):
     ax1.grid(visible=True, which="minor", linestyle="--")
     plt.minorticks_on()
     plt.title(damname + ": S(Z_i)")
-    fig.savefig(outfile)
+    fig.savefig(outfile, dpi=dpi)
     plt.close()
 
 
+def plot_pdb_profile(
+    rad_l, alt_l, d, rad_pdb, alt_pdb, d_pdb, outfile, detection=None, dpi=100
+):
+    """Plot the minimum elevation profile used for the PDB search."""
+    fig, axs = plt.subplots(2)
+    axs[0].plot(rad_l, alt_l, "r")
+    axs[0].set(xlabel="Search Area to the Dam (m)", ylabel="Minimum Elevation")
+    axs[0].label_outer()
+    axs[1].plot(rad_l, abs(d), "b")
+    axs[1].set(xlabel="Search Area to the Dam (m)", ylabel="d(Minimum Elevation)")
+    axs[1].label_outer()
+    if detection is not None:
+        fig.suptitle(f"PDB profile ({detection} detection)")
+        axs[0].plot(rad_pdb, alt_pdb, "x")
+        axs[1].plot(rad_pdb, abs(d_pdb), "x")
+    fig.savefig(outfile, dpi=dpi)
+    plt.close(fig)
+
+
 def plot_slope(
     model_zi,
     model_mae,
@@ -53,10 +74,11 @@ def plot_slope(
     l_slope,
     best_p,
     outfile,
+    dpi=300,
 ):
     """Plot slope graph."""
     alt = range(int(model_zi[0]) + 1, int(model_zi[-1]))
-    ms_fig = plt.figure(dpi=300)
+    ms_fig = plt.figure(dpi=dpi)
     ms_fig.subplots_adjust(hspace=0)
     ms_gs = ms_fig.add_gridspec(3, 1, height_ratios=[1, 1, 1])
 
@@ -130,7 +152,8 @@ def plot_slope(
     plt.minorticks_on()
 
     # if args.debug is True:
-    plt.savefig(outfile, dpi=300)
+    plt.savefig(outfile, dpi=dpi)
+    plt.close()
 
 
 def plot_model_combo(
@@ -151,9 +174,10 @@ def plot_model_combo(
     abs_mae,
     best,
     outfile,
+    dpi=300,
 ):
     """Plot combo graph."""
-    fig = plt.figure(dpi=300)
+    fig = plt.figure(dpi=dpi)
     fig.subplots_adjust(hspace=0)
     g_s = fig.add_gridspec(2, 1, height_ratios=[4, 1])
 
@@ -235,17 +259,15 @@ def plot_model_combo(
         f" * ( Z - {all_zi[0]:.2F}  ) ^ {beta:.3E}",
         fontsize=10,
     )
-    plt.savefig(outfile, dpi=300)
+    plt.savefig(outfile, dpi=dpi)
     plt.close()
 
 
 
-def plot_model(model_szi, model_zi, z_0, sz_0, alpha, beta, damname, outfile):
+def plot_model(model_szi, model_zi, z_0, sz_0, alpha, beta, damname, outfile, dpi=300):
     """Plot model."""
     alt = range(int(model_zi[0]) + 1, int(model_zi[-1] + 1))
-    mod_sz = []
-    for curr_alt in alt:
-        mod_sz.append(sz_0 + alpha * math.pow((curr_alt - z_0), beta))
+    mod_sz = hsv.surface(alt, z_0, sz_0, alpha, beta)
 
     _, axe = plt.subplots()
     axe.plot(alt, mod_sz, "r--", label="S(z)")
@@ -285,25 +307,19 @@ def plot_model(model_szi, model_zi, z_0, sz_0, alpha, beta, damname, outfile):
     axe.yaxis.set_major_formatter(ticks_m2)
     plt.minorticks_on()
     plt.legend(prop={"size": 6}, loc="upper left")
-    plt.savefig(outfile, dpi=300)
+    plt.savefig(outfile, dpi=dpi)
     plt.close()
 
 
 
-def plot_vs(all_zi, all_szi, damelev, alpha, beta, damname, outfile):
+def plot_vs(all_zi, all_szi, damelev, alpha, beta, damname, outfile, dpi=300):
     """Plot V(S)."""
     print(damelev)
     print(all_zi[0])
     print(float(damelev) - all_zi[0])
-    s_dam = all_szi[0] + alpha * math.pow((float(damelev) - all_zi[0]), beta)
-    surf = range(0, math.ceil(s_dam) + 10000)
-    vol0 = 0.0
-    vol_s = []
-    for area in surf:
-        volume = vol0 + math.pow(((area - all_szi[0]) / alpha), 1 / beta) * (
-            all_szi[0] + ((area - all_szi[0]) / (beta + 1.0))
-        )
-        vol_s.append(volume)
+    s_dam = float(hsv.surface(float(damelev), all_zi[0], all_szi[0], alpha, beta))
+    surf = np.arange(0, math.ceil(s_dam) + 10000)
+    vol_s = hsv.volume_from_surface(surf, all_szi[0], 0.0, alpha, beta)
 
     # V(S) Moldel Plot
     _, axv = plt.subplots()
@@ -328,17 +344,24 @@ def plot_vs(all_zi, all_szi, damelev, alpha, beta, damname, outfile):
     axv.yaxis.set_major_formatter(ticks_m3)
     plt.minorticks_on()
     plt.legend(prop={"size": 6}, loc="upper left")
-    plt.savefig(outfile, dpi=300)
+    plt.savefig(outfile, dpi=dpi)
     plt.close()
 
 
 
 def plot_report_sz(
-    alt, sz_ref_scatter, sz_model_scatter, ref_zmax, damelev, damname, outfile
+    alt,
+    sz_ref_scatter,
+    sz_model_scatter,
+    ref_zmax,
+    damelev,
+    damname,
+    outfile,
+    dpi=300,
 ):
     """Plot Sz ref and model."""
     ticks_m2 = ticker.FuncFormatter(lambda x, pos: f"{x/10000.0:g}")
-    fig = plt.figure(dpi=300)
+    fig = plt.figure(dpi=dpi)
     #  fig.subplots_adjust(hspace=0)
     g_s = fig.add_gridspec(2, 1, height_ratios=[1, 1])
 
@@ -380,18 +403,18 @@ def plot_report_sz(
     plt.legend(prop={"size": 6}, loc="upper left")
 
     plt.suptitle(damname + ": S(z)", fontsize=10)
-    plt.savefig(outfile, dpi=300)
+    plt.savefig(outfile, dpi=dpi)
     plt.close()
 
 
 
 def plot_report_vs(
-    surf, vs_ref_scatter, vs_model_scatter, s_r_zmax_m2, damname, outfile
+    surf, vs_ref_scatter, vs_model_scatter, s_r_zmax_m2, damname, outfile, dpi=300
 ):
     """Plot VS report."""
     ticks_m2 = ticker.FuncFormatter(lambda x, pos: f"{x/10000.0:g}")
     ticks_m3 = ticker.FuncFormatter(lambda x, pos: f"{x / 1000000.0:g}")
-    fig = plt.figure(dpi=300)
+    fig = plt.figure(dpi=dpi)
     #  fig.subplots_adjust(hspace=0)
     g_v = fig.add_gridspec(2, 1, height_ratios=[1, 1])
 
@@ -429,17 +452,17 @@ def plot_report_vs(
     plt.legend(prop={"size": 6}, loc="upper left")
 
     plt.suptitle(damname + ": V(S)", fontsize=10)
-    plt.savefig(outfile, dpi=300)
+    plt.savefig(outfile, dpi=dpi)
     plt.close()
 
 
 
 def plot_report_volume_rate(
-    surf, tx_ref_scatter, tx_model_scatter, s_r_zmax_m2, damname, outfile
+    surf, tx_ref_scatter, tx_model_scatter, s_r_zmax_m2, damname, outfile, dpi=300
 ):
     """Plot Volume Rate report."""
     ticks_m2 = ticker.FuncFormatter(lambda x, pos: f"{x/10000.0:g}")
-    fig = plt.figure(dpi=300)
+    fig = plt.figure(dpi=dpi)
     #  fig.subplots_adjust(hspace=0)
     gt = fig.add_gridspec(2, 1, height_ratios=[1, 1])
 
@@ -473,6 +496,6 @@ def plot_report_volume_rate(
     plt.legend(prop={"size": 6}, loc="upper left")
 
     plt.suptitle(damname + ": Volume Rate", fontsize=10)
-    plt.savefig(outfile, dpi=300)
+    plt.savefig(outfile, dpi=dpi)
     plt.close()
 
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Draw the figures of the chain now or record their data to draw them later.
+
+In deferred plots mode, the arguments of each plot_lib call are stored in a
+compact <prefix>_plots.npz file next to the stage outputs, and the figures are
+rebuilt afterwards by render_plots. This module does not import matplotlib.
+"""
+import os
+
+import numpy as np
+
+PLOTS_SUFFIX = "_plots.npz"
+SEPARATOR = "__"
+
+
+def draw_plot(name, **kwargs):
+    """Draw a figure with the plot_lib function name."""
+    # matplotlib is only imported when figures are drawn
+    from dem4water import plot_lib  # pylint: disable=import-outside-toplevel
+
+    getattr(plot_lib, name)(**kwargs)
+
+
+def record_plot(plots_file, name, **kwargs):
+    """Store the arguments of a plot_lib call in a plots file.
+
+    The plots file is completed if it exists, a previous record of the same
+    figure being replaced. The output file is stored without its folder, the
+    figure is written next to the plots file when rendered.
+    """
+    records = {}
+    if os.path.exists(plots_file):
+        with np.load(plots_file) as previous:
+            records = {
+                key: previous[key]
+                for key in previous.files
+                if key.split(SEPARATOR)[0] != name
+            }
+    kwargs["outfile"] = os.path.basename(kwargs["outfile"])
+    for arg, value in kwargs.items():
+        # None arguments keep the plot_lib default value
+        if value is not None:
+            records[f"{name}{SEPARATOR}{arg}"] = np.asarray(value)
+    np.savez_compressed(plots_file, **records)
+
+
+def load_plots(plots_file):
+    """Read a plots file.
+
+    Returns
+    -------
+    a dict of plot_lib function names to the keyword arguments of their call
+    """
+    plots = {}
+    with np.load(plots_file) as records:
+        for key in records.files:
+            name, arg = key.split(SEPARATOR, 1)
+            value = records[key]
+            # Scalars are given back as python objects, e.g. data_shortage is False
+            plots.setdefault(name, {})[arg] = value.item() if value.ndim == 0 else value
+    return plots
+
+
+def get_plotter(plots, plots_file):
+    """Return the function drawing the figures of a stage.
+
+    The returned function takes the plot_lib function name and its keyword
+    arguments, and records them in plots_file in deferred plots mode.
+    """
+    if plots == "deferred":
+        return lambda name, **kwargs: record_plot(plots_file, name, **kwargs)
+    return draw_plot
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Render the figures recorded by the chain in deferred plots mode.
+
+The _plots.npz files of the campaign dams are read and their figures are
+drawn in a process pool with the Agg backend, the dpi being selectable to
+browse many dams quickly.
+"""
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from itertools import repeat
+from time import perf_counter
+
+from dem4water.plot_record import PLOTS_SUFFIX, load_plots
+
+logger = logging.getLogger("render_plots")
+
+
+def find_plots_files(campaign_path, dams=None):
+    """List the plots files of a campaign, optionally for a subset of dams.
+
+    Parameters
+    ----------
+    campaign_path:
+        the campaign output path, containing the camp folder
+    dams:
+        names of the dam folders to render, all the dams if None
+
+    Returns
+    -------
+    a list of (dam folder name, plots file)
+    """
+    camp_path = os.path.join(campaign_path, "camp")
+    plots_files = []
+    for plots_file in sorted(
+        glob(os.path.join(camp_path, "*", "**", "*" + PLOTS_SUFFIX), recursive=True)
+    ):
+        dam_path = os.path.relpath(plots_file, camp_path).split(os.sep)[0]
+        if dams is None or dam_path in dams:
+            plots_files.append((dam_path, plots_file))
+    return plots_files
+
+
+def render_plots_file(plots_file, outdir=None, dpi=None):
+    """Draw all the figures of a plots file.
+
+    The figures are written next to the plots file, or in outdir if provided.
+    dpi overrides the resolution of every figure if provided.
+
+    Returns
+    -------
+    the list of written figures
+    """
+    # pylint: disable=import-outside-toplevel
+    from dem4water import plot_lib
+
+    if outdir is None:
+        outdir = os.path.dirname(plots_file)
+    written = []
+    for name, kwargs in load_plots(plots_file).items():
+        kwargs["outfile"] = os.path.join(outdir, str(kwargs["outfile"]))
+        if dpi is not None:
+            kwargs["dpi"] = dpi
+        getattr(plot_lib, name)(**kwargs)
+        written.append(kwargs["outfile"])
+    return written
+
+
+def render_dam(dam_path, plots_file, outdir=None, dpi=None):
+    """Render one plots file, a failing dam does not stop the rendering."""
+    if outdir is not None:
+        outdir = os.path.join(outdir, dam_path)
+        os.makedirs(outdir, exist_ok=True)
+    try:
+        return render_plots_file(plots_file, outdir, dpi)
+    except Exception as err:  # pylint: disable=broad-except
+        logger.error(f"{plots_file}: {err}")
+        return []
+
+
+def render_plots(
+    campaign_path, dams=None, outdir=None, dpi=None, workers=None, debug=False
+):
+    """Render the recorded figures of a campaign.
+
+    Parameters
+    ----------
+    campaign_path:
+        the campaign output path, containing the camp folder
+    dams:
+        names of the dam folders to render, all the dams if None
+    outdir:
+        folder receiving one sub folder of figures per dam, the figures are
+        written next to the plots files if None
+    dpi:
+        resolution of the figures, the one of the chain if None
+    workers:
+        number of processes, all the CPUs if None
+    """
+    t1_start = perf_counter()
+    logging_format = (
+        "%(asctime)s - %(filename)s:%(lineno)s - %(levelname)s - %(message)s"
+    )
+    if debug is True:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.DEBUG, format=logging_format
+        )
+    else:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.INFO, format=logging_format
+        )
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    logging.getLogger("matplotlib").setLevel(logging.ERROR)
+
+    plots_files = find_plots_files(campaign_path, dams)
+    logger.info(f"{len(plots_files)} plots files found in {campaign_path}")
+    if workers is None:
+        workers = os.cpu_count()
+    chunksize = max(1, len(plots_files) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        written = list(
+            executor.map(
+                render_dam,
+                [dam_path for dam_path, _ in plots_files],
+                [plots_file for _, plots_file in plots_files],
+                repeat(outdir),
+                repeat(dpi),
+                chunksize=chunksize,
+            )
+        )
+    nb_figures = sum(len(figures) for figures in written)
+    logger.info(f"{nb_figures} figures written.")
+    logger.info(f"Elapsed time: {perf_counter() - t1_start}s")
+    return written
+
+
+def render_plots_parameters():
+    """Define render_plots parser arguments."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "-campaign_path",
+        help="Campaign output path, containing the camp folder",
+        required=True,
+    )
+    parser.add_argument(
+        "-dams", nargs="+", default=None, help="Dam folders to render, all if omitted"
+    )
+    parser.add_argument(
+        "-outdir", default=None, help="Output folder, next to the plots files if omitted"
+    )
+    parser.add_argument("-dpi", type=int, default=None, help="Figures resolution")
+    parser.add_argument("-workers", type=int, default=None, help="Number of processes")
+    parser.add_argument("-debug", action="store_true", help="Activate Debug Mode")
+    return parser
+
+
+def main():
+    """Cli for render_plots.py."""
+    parser = render_plots_parameters()
+    args = parser.parse_args()
+    render_plots(
+        args.campaign_path,
+        args.dams,
+        args.outdir,
+        args.dpi,
+        args.workers,
+        args.debug,
+    )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
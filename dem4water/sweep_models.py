@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""Rank szi_to_model parameter sets against reference models.
+
+The S(Z_i) of each dam are read once and every parameter set of the grid is
+evaluated on them, the window models being shared between the parameter sets
+which only change the model selection. Each set is scored with the val_report
+metrics and the sets are ranked per region.
+
+Configuration example:
+
+    {
+        "regions": {
+            "occitanie": {
+                "campaign_path": "/path/to/campaign/output_path",
+                "reference": "/path/to/occitanie_ref.json"
+            }
+        },
+        "grid": {
+            "winsize": [9, 11, 13],
+            "maemode": ["absolute", "first", "hybrid"],
+            "zminoffset": [5, 10, 20]
+        },
+        "szi_to_model": {"jump_ratio": 10}
+    }
+
+Parameters missing from the grid keep the "szi_to_model" value of the
+configuration, or the szi_to_model default.
+"""
+import argparse
+import csv
+import itertools
+import json
+import logging
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+
+from dem4water import compute_model as cm
+from dem4water.fit_models import MODEL_PARAMETERS, find_campaign_dams
+from dem4water.szi_to_model import (
+    compute_hsv_model,
+    prepare_szi,
+    szi_to_model_parameters,
+)
+from dem4water.val_report import compute_report
+
+logger = logging.getLogger("sweep_models")
+
+MEASURES = [
+    ["S(z)_quality", "glob"],
+    ["V(S)_quality", "glob"],
+    ["Vr(S)_quality", "glob"],
+]
+
+
+def build_grid(config):
+    """Expand the configuration grid into the list of parameter sets."""
+    defaults = vars(szi_to_model_parameters().parse_args([]))
+    base = {key: defaults[key] for key in MODEL_PARAMETERS}
+    base.update(
+        {
+            key: value
+            for key, value in config.get("szi_to_model", {}).items()
+            if key in MODEL_PARAMETERS
+        }
+    )
+    grid = config.get("grid", {})
+    for key in grid:
+        if key not in MODEL_PARAMETERS:
+            raise ValueError(f"{key} is not a szi_to_model parameter")
+    keys = list(grid)
+    return [
+        {**base, **dict(zip(keys, values))}
+        for values in itertools.product(*(grid[key] for key in keys))
+    ]
+
+
+def sweep_dam(dam, ref_model, param_sets):
+    """Evaluate all the parameter sets on one dam.
+
+    The S(Z_i) file is read once, the series is prepared once per
+    (jump_ratio, filter_area) and the window models are kept for all the
+    parameter sets sharing them.
+
+    Returns
+    -------
+    the list of val_report results, None where the fit or the report failed
+    """
+    try:
+        damname, damelev, _ = cm.get_info_dam(dam["daminfo"])
+        with_area = any(params["filter_area"] == "enabled" for params in param_sets)
+        series = cm.SziSeries.from_file(
+            dam["szi_file"], dam["database"] if with_area else None
+        )
+    # SziSeries exits when the S(Z_i) file is empty
+    except (Exception, SystemExit) as err:  # pylint: disable=broad-except
+        logger.error(f"{dam['dam_path']}: {err}")
+        return [None] * len(param_sets)
+    prepared = {}
+    reports = []
+    for params in param_sets:
+        prepare_key = (params["jump_ratio"], params["filter_area"])
+        try:
+            if prepare_key not in prepared:
+                prepared[prepare_key] = (
+                    prepare_szi(series, params["jump_ratio"], params["filter_area"]),
+                    {},
+                )
+            (z_i, s_zi), models_cache = prepared[prepare_key]
+            fit = compute_hsv_model(
+                z_i,
+                s_zi,
+                damname,
+                damelev,
+                params["winsize"],
+                params["maemode"],
+                params["zmaxoffset"],
+                params["zminoffset"],
+                params["dslopethresh"],
+                params["selection_mode"],
+                models_cache,
+            )
+            model = {
+                "ID": ref_model["ID"],
+                "Name": damname,
+                "Elevation": damelev,
+                "Model": {
+                    "Z0": fit["z_i"][0],
+                    "S0": fit["s_zi"][0],
+                    "V0": 0.0,
+                    "alpha": fit["alpha"],
+                    "beta": fit["beta"],
+                },
+            }
+            report, _ = compute_report(model, ref_model)
+        except Exception as err:  # pylint: disable=broad-except
+            logger.debug(f"{dam['dam_path']} {params}: {err}")
+            report = None
+        reports.append(report)
+    return reports
+
+
+def score_region(param_sets, dam_reports):
+    """Aggregate the dam reports of a region for each parameter set.
+
+    The score of a measure is the mean absolute value of its glob mean over the
+    dams. The sets are ranked on the number of scored dams then on the V(S) score.
+    """
+    rows = []
+    for k, params in enumerate(param_sets):
+        reports = [reports[k] for reports in dam_reports if reports[k] is not None]
+        row = {**params, "nb_dams": len(dam_reports), "nb_scored": len(reports)}
+        for measure in MEASURES:
+            values = [
+                abs(report[measure[0]][measure[1]]["mean"])
+                for report in reports
+                if report[measure[0]][measure[1]]["mean"] != "NaN"
+            ]
+            row[f"{measure[0]}_{measure[1]}"] = (
+                float(sum(values) / len(values)) if values else math.nan
+            )
+        errors = [
+            report["Dam_bottom_estimation"]["Dam_bottom_error"] for report in reports
+        ]
+        row["Dam_bottom_error"] = float(sum(errors) / len(errors)) if errors else math.nan
+        rows.append(row)
+
+    def rank_key(row):
+        score = row["V(S)_quality_glob"]
+        return (-row["nb_scored"], math.inf if math.isnan(score) else score)
+
+    rows.sort(key=rank_key)
+    return [{"rank": rank, **row} for rank, row in enumerate(rows, start=1)]
+
+
+def sweep_models(config_file, outdir, workers=None, debug=False):
+    """Run the parameter sweep of every region and write one ranking per region.
+
+    Parameters
+    ----------
+    config_file:
+        the sweep configuration json file
+    outdir:
+        folder receiving the sweep_<region>.csv rankings
+    workers:
+        number of processes, all the CPUs if None
+    """
+    t1_start = perf_counter()
+    logging_format = (
+        "%(asctime)s - %(filename)s:%(lineno)s - %(levelname)s - %(message)s"
+    )
+    if debug is True:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.DEBUG, format=logging_format
+        )
+    else:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.INFO, format=logging_format
+        )
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    # The per dam and per parameter set logs are only useful for debugging
+    for name in ["szi_to_model", "compute_model"]:
+        logging.getLogger(name).setLevel(logging.DEBUG if debug else logging.ERROR)
+
+    with open(config_file, encoding="utf-8") as in_config:
+        config = json.load(in_config)
+    param_sets = build_grid(config)
+    logger.info(f"{len(param_sets)} parameter sets to evaluate.")
+    if not os.path.exists(outdir):
+        os.mkdir(outdir)
+    if workers is None:
+        workers = os.cpu_count()
+
+    rankings = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for region, region_cfg in config["regions"].items():
+            with open(region_cfg["reference"], encoding="utf-8") as ref_in:
+                ref_db = json.load(ref_in)
+            dams = []
+            refs = []
+            for dam in find_campaign_dams(region_cfg["campaign_path"]):
+                _, _, dam_id = cm.get_info_dam(dam["daminfo"])
+                if str(dam_id) in ref_db:
+                    dams.append(dam)
+                    refs.append({"ID": dam_id, **ref_db[str(dam_id)]})
+            logger.info(f"{region}: {len(dams)} dams with a reference model.")
+            dam_reports = list(
+                executor.map(
+                    sweep_dam, dams, refs, itertools.repeat(param_sets, len(dams))
+                )
+            )
+            rows = score_region(param_sets, dam_reports)
+            out_file = os.path.join(outdir, f"sweep_{region}.csv")
+            with open(out_file, "w", encoding="utf-8", newline="") as csv_file:
+                writer = csv.DictWriter(csv_file, fieldnames=list(rows[0]))
+                writer.writeheader()
+                writer.writerows(rows)
+            logger.info(f"{region}: best parameters {rows[0]}")
+            logger.info(f"{region}: ranking written to {out_file}")
+            rankings[region] = rows
+    logger.info(f"Elapsed time: {perf_counter() - t1_start}s")
+    return rankings
+
+
+def sweep_models_parameters():
+    """Define sweep_models parser arguments."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("-config", help="Sweep configuration file", required=True)
+    parser.add_argument("-outdir", help="Output folder", required=True)
+    parser.add_argument("-workers", type=int, default=None, help="Number of processes")
+    parser.add_argument("-debug", action="store_true", help="Activate Debug Mode")
+    return parser
+
+
+def main():
+    """Cli for sweep_models.py."""
+    parser = sweep_models_parameters()
+    args = parser.parse_args()
+    sweep_models(args.config, args.outdir, args.workers, args.debug)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,7 +3,6 @@
 import argparse
 import json
 import logging
-import math
 import os
 import sys
 from statistics import median
@@ -12,7 +11,8 @@ from time import perf_counter
 import numpy as np
 
 from dem4water import compute_model as cm
-from dem4water import plot_lib as pl
+from dem4water import model as hsv
+from dem4water.plot_record import PLOTS_SUFFIX, get_plotter
 
 
 logger = logging.getLogger("szi_to_model")
@@ -198,74 +198,157 @@ def found_mae_hybrid(
     return best_i, best_p, best, best_alpha, best_beta
 
 
-def szi_to_model(
-    szi_file,
-    database,
-    watermap,
-    daminfo,
-    winsize,
-    maemode,
-    outfile,
-    zmaxoffset,
-    zminoffset,
-    dslopethresh,
-    selection_mode,
-    jump_ratio,
-    filter_area,
-    debug,
-):  # noqa: C901  #FIXME: Function is too complex
+def compute_window_models(z_i, s_zi, winsize):
+    """Compute the local models of all the windows a model selection can use.
+
+    The window starting at i covers z_i[i : i + winsize] and is only used while
+    (i + winsize) < (len(z_i) - 1). The result does not depend on the search
+    range, hence it can be shared between parameter sets.
+
+    Returns
+    -------
+    a compute_model.ModelBatch indexed by window start, or None if no window fits
     """
-    Prototype scrip allowing to derive a HSV model from a set of S(Z_i) values.
+    if len(z_i) - 1 - winsize <= 0:
+        return None
+    return cm.compute_sliding_models(
+        z_i[: len(z_i) - 2], s_zi[: len(s_zi) - 2], z_i[0], s_zi[0], winsize
+    )
 
-    The first value of the set should be S_0 = S(Z_0) = 0 with Z_0 the altitude of dam bottom
 
-    The output
-    - the list of parameters [alpha;beta]
-    - a quality measurment of how well the model fit the S(Z_i) values
-    - additionnaly the plot of S(Z) and V(S)
+def compute_local_models(z_i, s_zi, start_i, winsize, zmaxoffset, damelev, models=None):
+    """Compute the local models of every window used by the model selection.
+
+    Every window start i >= start_i satisfying (i + winsize) < (len(z_i) - 1) is
+    computed at once, then the search stops at the first window whose median
+    elevation reaches zmaxoffset over the dam elevation.
+
+    Parameters
+    ----------
+    models:
+        optional result of compute_window_models for the same z_i and winsize
+
+    Returns
+    -------
+    the arrays of window starts, median elevations, median surfaces, linear fits,
+    slopes, local MAE, alpha and beta
     """
-    t1_start = perf_counter()
-    logging_format = (
-        "%(asctime)s - %(filename)s:%(lineno)s - %(levelname)s - %(message)s"
+    stop_i = len(z_i) - 1 - winsize
+    if stop_i <= start_i:
+        return [], [], [], [], [], [], [], []
+    if models is None:
+        models = compute_window_models(z_i, s_zi, winsize)
+    z_med = models.z_med[start_i:stop_i]
+    nb_models = np.argmax(np.append(z_med >= zmaxoffset + float(damelev), True))
+    last_i = start_i + nb_models
+    l_i = np.arange(start_i, last_i)
+    l_p = models.poly[start_i:last_i]
+    # Select MEA to be used:
+    #  mae = glo_mae
+    l_mae = models.mae[start_i:last_i]
+    if logger.isEnabledFor(logging.DEBUG):
+        for i in l_i:
+            logger.debug(
+                f"i: {i} - Zrange [{z_i[i]}; {z_i[i + winsize]}] --> alpha="
+                f" {models.alpha[i]} - beta= {models.beta[i]} with a local mae of:"
+                f" {models.mae[i]} m2"
+            )
+            logger.debug(
+                f"i: {i} - Slope= {models.poly[i][0]} - z_med= {models.z_med[i]} - "
+                f"Sz_med= {models.s_med[i]}"
+            )
+    return (
+        l_i,
+        z_med[:nb_models],
+        models.s_med[start_i:last_i],
+        l_p,
+        l_p[:, 0],
+        l_mae,
+        models.alpha[start_i:last_i],
+        models.beta[start_i:last_i],
     )
-    if debug is True:
-        logging.basicConfig(
-            stream=sys.stdout, level=logging.DEBUG, format=logging_format
-        )
-    else:
-        logging.basicConfig(
-            stream=sys.stdout, level=logging.INFO, format=logging_format
-        )
 
-    logger.info("Starting szi_to_model.py")
+
+def prepare_szi(series, jump_ratio, filter_area):
+    """Drop the unreliable values of a S(Z_i) series.
+
+    Parameters
+    ----------
+    series:
+        the compute_model.SziSeries of the dam, its water body area is required
+        when filter_area is enabled
+    jump_ratio:
+        ratio between two surfaces above which the S(Z_i) are dropped
+    filter_area:
+        "enabled" to remove the surfaces too small compared to the database
+
+    Returns
+    -------
+    the elevations and surfaces, sorted from Z_0 upward
+    """
     if filter_area not in ["enabled", "disabled"]:
         raise ValueError(
             f"{filter_area} is not a correct value for 'filter_area' parameter"
         )
-    # load GeoJSON file containing info
-    with open(daminfo, encoding="utf-8") as i:
-        jsi = json.load(i)
-    for feature in jsi["features"]:
-        if feature["properties"]["name"] == "Dam":
-            logger.debug(feature)
-            damname = feature["properties"]["damname"]
-            damelev = feature["properties"]["elev"]
-            dam_id = feature["properties"]["ID"]
-        # if feature["properties"]["name"] == "PDB":
-        #     pdbelev = feature["properties"]["elev"]
     # shp_wmap = wb.create_water_mask(watermap, 0.05)
     # water_body_area = wb.compute_area_from_database_geom(database, damname, shp_wmap)
     # wm_thres = (water_body_area * 15)/100
     if filter_area == "enabled":
         logger.info("Filter small surfaces enabled.")
-        z_i, s_zi = cm.filter_szi(szi_file, database, watermap, damname, 100000, 0)
-    else:
-        z_i = None
-        s_zi = None
-    z_i, s_zi = cm.remove_jump_szi(szi_file, z_i, s_zi, int(jump_ratio))
-    logger.debug(f"Number of S_Zi used for compute model: {len(s_zi)}")
-    z_i = z_i[::-1]
-    s_zi = s_zi[::-1]
+        series = series.filter_area(100000, 0)
+    series = series.remove_jump(int(jump_ratio))
+    logger.debug(f"Number of S_Zi used for compute model: {len(series.s_zi)}")
+    return series.z_i[::-1], series.s_zi[::-1]
+
+
+def load_szi(szi_file, database, jump_ratio, filter_area):
+    """Read a S(Z_i) file and drop the unreliable values.
+
+    The database is only read when filter_area is enabled, see prepare_szi.
+    """
+    series = cm.SziSeries.from_file(
+        szi_file, database if filter_area == "enabled" else None
+    )
+    return prepare_szi(series, jump_ratio, filter_area)
+
+
+def compute_hsv_model(
+    z_i,
+    s_zi,
+    damname,
+    damelev,
+    winsize,
+    maemode,
+    zmaxoffset,
+    zminoffset,
+    dslopethresh,
+    selection_mode,
+    models_cache=None,
+):
+    """Select the S(Z) model of a dam from its S(Z_i) values.
+
+    Nothing is written nor plotted, which allows to fit many dams in a row.
+
+    Parameters
+    ----------
+    z_i, s_zi:
+        the S(Z_i) values sorted from Z_0 upward, as returned by load_szi
+    damname:
+        the dam name
+    damelev:
+        the dam elevation
+    models_cache:
+        optional dict keeping the window models between calls made on the same
+        z_i and s_zi, when only the selection parameters change
+
+    Other parameters are the ones of szi_to_model.
+
+    Returns
+    -------
+    a dict holding the selected model (alpha, beta, mae, best_i and the window
+    slice of the S(Z_i) it was computed on), the absolute best one (abs_*), the
+    local models (l_z, l_mae, l_slope) and the S(Z_i) used
+    """
     # find start_i
     start_i = 0
     all_zi = z_i[:]
@@ -295,14 +378,6 @@ def szi_to_model(
     best_p = 0
     best_alpha = 0
     best_beta = 0
-    l_i = []
-    l_z = []
-    l_sz = []
-    l_p = []
-    l_slope = []
-    l_mae = []
-    l_alpha = []
-    l_beta = []
 
     # Shortcut if just enough data
     data_shortage = False
@@ -324,6 +399,7 @@ def szi_to_model(
         best = mae
 
         best_i = 1
+        best_window = slice(1, None)
 
         best_p = poly
         best_alpha = alpha
@@ -331,7 +407,7 @@ def szi_to_model(
 
     # Enough data but not in specified distance to the dam
     # (maybe estimated dam elevation is false, maybe offsets are to strict)
-    print(z_i, i, winsize)
+    logger.debug(f"{z_i}, {i}, {winsize}")
     # TODO : mettre un elif
     # Test si z_i[] est pas vide
     if median(z_i[i : i + winsize]) >= zmaxoffset + float(damelev):
@@ -355,47 +431,33 @@ def szi_to_model(
 
         best = mae
         best_i = i
+        best_window = slice(i, i + winsize)
         best_p = poly
         best_alpha = alpha
         best_beta = beta
 
     # Si on est pas dans les deux premiers cas
-    while ((i + winsize) < (len(z_i) - 1)) and (
-        median(z_i[i : i + winsize]) < zmaxoffset + float(damelev)
-    ):
-        logger.debug(f"len(z_i[i:i+winsize]): {len(z_i[i : i + winsize])}")
-        alpha, beta, loc_mae, poly = cm.compute_model(
-            z_i[i : i + winsize], s_zi[i : i + winsize], z_i[0], s_zi[0]
-        )
-        logger.debug(
-            f"i: {i} - Zrange [{z_i[i]}; {z_i[i + winsize]}] --> alpha="
-            f" {alpha} - beta= {beta} with a local mae of: {loc_mae} m2"
-        )
-        logger.debug(
-            f"i: {i} - Slope= {poly[0]} - z_med="
-            f" {median(z_i[i : i + winsize])} - "
-            f"Sz_med= {median(s_zi[i : i + winsize])}"
-        )
-
-        # Select MEA to be used:
-        #  mae = glo_mae
-        mae = loc_mae
-        l_i.append(i)
-        l_z.append(median(z_i[i : i + winsize]))
-        l_sz.append(median(s_zi[i : i + winsize]))
-        l_p.append(poly)
-        l_slope.append(poly[0])
-        l_mae.append(mae)
-        l_alpha.append(alpha)
-        l_beta.append(beta)
-
-        if (best == -10000) or (mae < best):
-            best = mae
-            best_i = i
-            best_p = poly
-            best_alpha = alpha
-            best_beta = beta
-        i = i + 1
+    models = None
+    if models_cache is not None:
+        # firsts selection reduces the S(Zi) set according to zmaxoffset
+        cache_key = (winsize, zmaxoffset if selection_mode == "firsts" else None)
+        if cache_key not in models_cache:
+            models_cache[cache_key] = compute_window_models(z_i, s_zi, winsize)
+        models = models_cache[cache_key]
+    l_i, l_z, l_sz, l_p, l_slope, l_mae, l_alpha, l_beta = compute_local_models(
+        z_i, s_zi, i, winsize, zmaxoffset, damelev, models
+    )
+    if len(l_i) > 0:
+        # First minimum, a NaN in first position is kept as the loop did
+        best_j = 0 if np.isnan(l_mae[0]) else int(np.nanargmin(l_mae))
+        best = l_mae[best_j]
+        best_i = l_i[best_j]
+        best_p = l_p[best_j]
+        best_alpha = l_alpha[best_j]
+        best_beta = l_beta[best_j]
+        # Last computed model, as left by the former sliding loop
+        alpha = l_alpha[-1]
+        beta = l_beta[-1]
 
     # For testing
     abs_i = best_i
@@ -461,6 +523,97 @@ def szi_to_model(
             f"{damname}: S(Z) = {s_zi[0]:.2F} + {best_alpha:.3E} *"
             f" ( Z - {z_i[0]:.2F}) ^ {best_beta:.3E}"
         )
+    if data_shortage is False:
+        best_window = slice(best_i, best_i + winsize)
+
+    return {
+        "z_i": z_i,
+        "s_zi": s_zi,
+        "all_zi": all_zi,
+        "all_szi": all_szi,
+        "data_shortage": data_shortage,
+        "best_i": best_i,
+        "window": best_window,
+        "best_p": best_p,
+        "mae": best,
+        "alpha": best_alpha,
+        "beta": best_beta,
+        "abs_i": abs_i,
+        "abs_mae": abs_mae,
+        "abs_alpha": abs_alpha,
+        "abs_beta": abs_beta,
+        "last_alpha": alpha,
+        "last_beta": beta,
+        "l_z": l_z,
+        "l_mae": l_mae,
+        "l_slope": l_slope,
+    }
+
+
+def szi_to_model(
+    szi_file,
+    database,
+    watermap,
+    daminfo,
+    winsize,
+    maemode,
+    outfile,
+    zmaxoffset,
+    zminoffset,
+    dslopethresh,
+    selection_mode,
+    jump_ratio,
+    filter_area,
+    debug,
+    resampling=None,
+    resampling_size=None,
+    confidence=95,
+    plots="full",
+):
+    """
+    Prototype scrip allowing to derive a HSV model from a set of S(Z_i) values.
+
+    The first value of the set should be S_0 = S(Z_0) = 0 with Z_0 the altitude of dam bottom
+
+    The output
+    - the list of parameters [alpha;beta]
+    - a quality measurment of how well the model fit the S(Z_i) values
+    - optionally the confidence intervals of alpha and beta, obtained by
+      resampling (bootstrap or jackknife) the window of the selected model
+    - additionnaly the plot of S(Z) and V(S), according to plots: none, minimal
+      (the combined MAE / model plot only), full or deferred (recorded for
+      render_plots)
+    """
+    t1_start = perf_counter()
+    logging_format = (
+        "%(asctime)s - %(filename)s:%(lineno)s - %(levelname)s - %(message)s"
+    )
+    if debug is True:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.DEBUG, format=logging_format
+        )
+    else:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.INFO, format=logging_format
+        )
+
+    logger.info("Starting szi_to_model.py")
+    damname, damelev, dam_id = cm.get_info_dam(daminfo)
+    z_i, s_zi = load_szi(szi_file, database, jump_ratio, filter_area)
+    fit = compute_hsv_model(
+        z_i,
+        s_zi,
+        damname,
+        damelev,
+        winsize,
+        maemode,
+        zmaxoffset,
+        zminoffset,
+        dslopethresh,
+        selection_mode,
+    )
+    z_i = fit["z_i"]
+    s_zi = fit["s_zi"]
 
     model_json = {
         "ID": dam_id,
@@ -470,89 +623,118 @@ def szi_to_model(
             "Z0": z_i[0],
             "S0": s_zi[0],
             "V0": 0.0,
-            "alpha": best_alpha,
-            "beta": best_beta,
+            "alpha": fit["alpha"],
+            "beta": fit["beta"],
         },
     }
 
+    if resampling is not None:
+        # Fixed seed, running twice the chain gives the same intervals
+        model_json["Uncertainty"] = cm.compute_model_intervals(
+            z_i[fit["window"]],
+            s_zi[fit["window"]],
+            z_i[0],
+            s_zi[0],
+            resampling,
+            resampling_size,
+            confidence,
+            seed=0,
+        )
+
     with open(
         os.path.splitext(outfile)[0] + ".json", "w", encoding="utf-8"
     ) as write_file:
         json.dump(model_json, write_file)
 
-    z = range(int(z_i[0]) + 1, int(z_i[-1]))
-    mod_sz = []
-    abs_sz = []
-    for h in z:
-        val_s = s_zi[0] + best_alpha * math.pow((h - z_i[0]), best_beta)
-        mod_sz.append(val_s)
-        val_s = s_zi[0] + abs_alpha * math.pow((h - z_i[0]), abs_beta)
-        abs_sz.append(val_s)
+    if plots != "none":
+        plot_hsv_model(fit, damname, damelev, winsize, outfile, plots)
 
-    # Moldel Plot
-    pl.plot_model(
-        s_zi[best_i : best_i + winsize],
-        z_i[best_i : best_i + winsize],
-        z_i[0],
-        s_zi[0],
-        best_alpha,
-        best_beta,
-        damname,
-        outfile,
-    )
+    t1_stop = perf_counter()
+    logger.info(f"Elapsed time: {t1_stop}s, {t1_start}s")
 
-    # Plot Local MAE
-    # TODO : call function plot_slope()
-    pl.plot_slope(
-        z_i[best_i : best_i + winsize],
-        l_mae,
-        damelev,
-        z_i[abs_i : abs_i + winsize],
-        abs_mae,
-        best,
-        damname,
-        l_z,
-        l_slope,
-        best_p,
-        os.path.splitext(outfile)[0] + "_slope.png",
-    )
+    logger.info(f"Elapsed time during the whole program in s :{t1_stop-t1_start}s")
+
+
+def plot_hsv_model(fit, damname, damelev, winsize, outfile, plots="full"):
+    """Plot the model computed by compute_hsv_model.
+
+    Only the combined MAE / model plot is drawn in minimal plots mode. In
+    deferred plots mode, the figures data are recorded in <outfile>_plots.npz.
+    """
+    plot = get_plotter(plots, os.path.splitext(outfile)[0] + PLOTS_SUFFIX)
+    z_i = fit["z_i"]
+    s_zi = fit["s_zi"]
+    best_i = fit["best_i"]
+    abs_i = fit["abs_i"]
+    z = np.arange(int(z_i[0]) + 1, int(z_i[-1]))
+    mod_sz = hsv.surface(z, z_i[0], s_zi[0], fit["alpha"], fit["beta"])
+    abs_sz = hsv.surface(z, z_i[0], s_zi[0], fit["abs_alpha"], fit["abs_beta"])
 
     # Combined Local MAE / model plot
-    pl.plot_model_combo(
-        all_zi,
-        all_szi,
-        z_i[best_i : best_i + winsize],
-        s_zi[best_i : best_i + winsize],
-        damelev,
-        data_shortage,
-        alpha,
-        beta,
-        damname,
-        z,
-        abs_sz,
-        mod_sz,
-        l_z,
-        l_mae,
-        abs_mae,
-        best,
-        os.path.splitext(outfile)[0] + "_combo.png",
+    plot(
+        "plot_model_combo",
+        all_zi=fit["all_zi"],
+        all_szi=fit["all_szi"],
+        model_zi=z_i[best_i : best_i + winsize],
+        model_szi=s_zi[best_i : best_i + winsize],
+        damelev=damelev,
+        data_shortage=fit["data_shortage"],
+        alpha=fit["last_alpha"],
+        beta=fit["last_beta"],
+        damname=damname,
+        alt_sz=z,
+        abs_sz=abs_sz,
+        mod_sz=mod_sz,
+        l_z=fit["l_z"],
+        l_mae=fit["l_mae"],
+        abs_mae=fit["abs_mae"],
+        best=fit["mae"],
+        outfile=os.path.splitext(outfile)[0] + "_combo.png",
     )
 
-    # V(S)
-    pl.plot_vs(
-        z_i,
-        s_zi,
-        damelev,
-        best_alpha,
-        best_beta,
-        damname,
-        os.path.splitext(outfile)[0] + "_VS.png",
+    if plots == "minimal":
+        return
+
+    # Moldel Plot
+    plot(
+        "plot_model",
+        model_szi=s_zi[best_i : best_i + winsize],
+        model_zi=z_i[best_i : best_i + winsize],
+        z_0=z_i[0],
+        sz_0=s_zi[0],
+        alpha=fit["alpha"],
+        beta=fit["beta"],
+        damname=damname,
+        outfile=outfile,
     )
 
-    t1_stop = perf_counter()
-    logger.info(f"Elapsed time: {t1_stop}s, {t1_start}s")
+    # Plot Local MAE
+    plot(
+        "plot_slope",
+        model_zi=z_i[best_i : best_i + winsize],
+        model_mae=fit["l_mae"],
+        damelev=damelev,
+        abs_zi=z_i[abs_i : abs_i + winsize],
+        abs_mae=fit["abs_mae"],
+        best=fit["mae"],
+        damname=damname,
+        l_z=fit["l_z"],
+        l_slope=fit["l_slope"],
+        best_p=fit["best_p"],
+        outfile=os.path.splitext(outfile)[0] + "_slope.png",
+    )
 
-    logger.info(f"Elapsed time during the whole program in s :{t1_stop-t1_start}s")
+    # V(S)
+    plot(
+        "plot_vs",
+        all_zi=z_i,
+        all_szi=s_zi,
+        damelev=damelev,
+        alpha=fit["alpha"],
+        beta=fit["beta"],
+        damname=damname,
+        outfile=os.path.splitext(outfile)[0] + "_VS.png",
+    )
 
 
 def szi_to_model_parameters():
@@ -596,6 +778,12 @@ def szi_to_model_parameters():
 
     parser.add_argument("-outfile", help="Output file")
     parser.add_argument("-debug", action="store_true", help="Activate Debug Mode")
+    parser.add_argument(
+        "-plots",
+        default="full",
+        choices=["none", "minimal", "full", "deferred"],
+        help="Figures to draw, none skips matplotlib entirely",
+    )
     parser.add_argument(
         "-filter_area",
         type=str,
@@ -603,6 +791,24 @@ def szi_to_model_parameters():
         help="Enable the filtering of low szi",
         choices=["enabled", "disabled"],
     )
+    parser.add_argument(
+        "-resampling",
+        default=None,
+        choices=["bootstrap", "jackknife"],
+        help="Resample the selected S(Zi) window to estimate alpha/beta intervals",
+    )
+    parser.add_argument(
+        "-resampling_size",
+        type=int,
+        default=None,
+        help="Number of bootstrap resamples (1000 by default), not allowed with jackknife",
+    )
+    parser.add_argument(
+        "-confidence",
+        type=float,
+        default=95,
+        help="Confidence level of the intervals, in %%",
+    )
     return parser
 
 
@@ -610,6 +816,8 @@ def main():
     """Cli for szi_to_model.py."""
     parser = szi_to_model_parameters()
     args = parser.parse_args()
+    if args.resampling == "jackknife" and args.resampling_size is not None:
+        parser.error("-resampling_size can not be set with jackknife resampling")
     szi_to_model(
         args.szi_file,
         args.database,
@@ -625,6 +833,10 @@ def main():
         args.jump_ratio,
         args.filter_area,
         args.debug,
+        args.resampling,
+        args.resampling_size,
+        args.confidence,
+        args.plots,
     )
 
 
@@ -86,6 +86,7 @@ def write_json(
     concat=False,
     ref_only=False,
     input_force_list=None,
+    stage_cache=None,
 ):
     """."""
     generated_json = []
@@ -110,6 +111,11 @@ def write_json(
         dam_id_column = config["campaign"]["id_dam_column"]
         dam_name_column = config["campaign"]["dam_name_column"]
         mode = config["campaign"]["mode"]
+        # Campaign wide setting, older configuration files draw all the figures
+        plots = config["campaign"].get("plots", "full")
+        # Stage results shared between campaigns, see orchestration/stage_cache.py
+        if stage_cache is None:
+            stage_cache = config["campaign"].get("stage_cache")
         # Ensure output path exists
         output_list = os.path.join(output_path, "dam_list.txt")
         if input_force_list is not None:
@@ -194,6 +200,8 @@ def write_json(
 
             dam_log = ensure_log_name(dam_path_name)
             dict_dam["chain"] = {
+                "output_path": output_path,
+                "stage_cache": stage_cache,
                 "log_folder": os.path.join(output_path, "log"),
                 "log_out": os.path.join(
                     output_path, "log", f"{dam_log}_{id_dam}_out.log"
@@ -231,6 +239,7 @@ def write_json(
                     "info": daminfo_file,
                     "tmp": output_dam_tmp,
                     **config["find_pdb_and_cutline"],
+                    "plots": plots,
                 }
 
 
@@ -251,6 +260,7 @@ def write_json(
                 "mode": mode,
 
                 **config["cut_contourlines"],
+                "plots": plots,
             }
 
             dict_dam["szi_to_model"] = {
@@ -263,6 +273,7 @@ def write_json(
                 ),
                 # "custom_szi": szi_dat_file,
                 **config["szi_to_model"],
+                "plots": plots,
             }
 
             if reference is not None:
@@ -275,6 +286,7 @@ def write_json(
                     ),
                     "reffile": reference,
                     **config["val_report"],
+                    "plots": plots,
                 }
             json_out_file = os.path.join(
                 output_dam_camp_path, f"params_{dam_path_name}.json"
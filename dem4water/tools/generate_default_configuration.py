@@ -29,6 +29,8 @@ def get_all_parameters(output_path, mode):
         "reference": None,
         "customs_files": None,
         "mode": mode,
+        "plots": "full",
+        "stage_cache": None,
     }
     if not os.path.exists(output_path):
         os.mkdir(output_path)
@@ -92,6 +94,11 @@ def get_all_parameters(output_path, mode):
         if value is not None:
             all_parameters["val_report"][arg] = value
 
+    # The figures are set for the whole campaign
+    for stage, params in all_parameters.items():
+        if stage != "campaign":
+            params.pop("plots", None)
+
     with open(
         os.path.join(output_path, "campaign_template_file.json"), "w", encoding="utf-8"
     ) as write_file:
@@ -6,34 +6,219 @@ import json
 import logging
 import math
 import os
-import statistics
 import sys
+from glob import glob
 
-from dem4water import plot_lib as pl
+import numpy as np
+
+from dem4water import model as hsv
+from dem4water.plot_record import PLOTS_SUFFIX, get_plotter
 
 
 def secured_mean(vals):
     """Compute mean or return NaN."""
-    try:
-        result = statistics.mean(vals)
-    except statistics.StatisticsError:
+    if len(vals) == 0:
         return "NaN"
 
-    return result
+    return float(np.mean(vals))
 
 
 def secured_stdev(vals):
     """Compute stdev or return NaN."""
-    try:
-        result = statistics.stdev(vals)
-    except statistics.StatisticsError:
+    if len(vals) < 2:
         return "NaN"
 
-    return result
+    return float(np.std(vals, ddof=1))
+
+
+def compute_report(model, ref_model):
+    """Compute the quality metrics of a model against its reference.
 
+    Parameters
+    ----------
+    model:
+        the content of a dam_model.json file
+    ref_model:
+        the entry of the dam in the validation database
 
-def val_report(infile, outfile, reffile, debug):
-    """Compare a model to a reference file."""
+    Returns
+    -------
+    the report as written in the json file, and the S(Z), V(S) and filling rate
+    curves of both laws used for the plots
+    """
+    damname = model["Name"]
+    damelev = model["Elevation"]
+    z_0 = model["Model"]["Z0"]
+    s_0 = model["Model"]["S0"]
+    v_0 = model["Model"]["V0"]
+    alpha = model["Model"]["alpha"]
+    beta = model["Model"]["beta"]
+
+    ref_z0 = ref_model["Model"]["Z0"]
+    ref_s0 = ref_model["Model"]["S0"]  # original values in m2 in DB
+    ref_v0 = ref_model["Model"]["V0"]  # original values in m3 in DB
+    ref_alpha = ref_model["Model"]["alpha"]
+    ref_beta = ref_model["Model"]["beta"]
+    ref_zmax = ref_model["Model"]["Zmax"]
+    ref_zmin = ref_model["Model"]["Zmin"]
+    ref_z25 = ref_zmin + 0.25 * (ref_zmax - ref_zmin)
+    ref_z75 = ref_zmin + 0.75 * (ref_zmax - ref_zmin)
+
+    # Figures:
+    z_min = max(int(float(z_0)), int(float(ref_z0)))
+    alt = np.arange(z_min, int(float(damelev) * 1.1))
+
+    s_m_zmax = float(hsv.surface(float(ref_zmax), z_0, s_0, alpha, beta))
+
+    s_r_zmax_m2, s_r_zmin_m2, s_r_z25_m2, s_r_z75_m2 = hsv.surface(
+        [float(ref_zmax), float(ref_zmin), float(ref_z25), float(ref_z75)],
+        ref_z0,
+        ref_s0,
+        ref_alpha,
+        ref_beta,
+    ).tolist()
+
+    surf = np.arange(0, math.ceil(s_r_zmax_m2) + 10000, 10000)
+
+    # Bottom elevations are truncated as in the original reports
+    sz_model_scatter = hsv.surface(alt, int(z_0), s_0, alpha, beta)
+    sz_ref_scatter = hsv.surface(alt, int(ref_z0), ref_s0, ref_alpha, ref_beta)  # m2
+
+    valid = (sz_ref_scatter != 0) & (alt >= ref_zmin)
+    s_r = sz_ref_scatter[valid]
+    sz_err = (s_r - sz_model_scatter[valid]) / s_r
+    sz_alt = alt[valid]
+    szg = sz_err
+    szh = sz_err[sz_alt >= ref_z75]
+    szm = sz_err[(sz_alt < ref_z75) & (sz_alt >= ref_z25)]
+    szl = sz_err[sz_alt < ref_z25]
+
+    v_m_zmax, vs_model_scatter = np.split(
+        hsv.volume_from_surface(np.append(s_r_zmax_m2, surf), s_0, v_0, alpha, beta),
+        [1],
+    )
+    v_r_zmax, vs_ref_scatter = np.split(
+        hsv.volume_from_surface(
+            np.append(s_r_zmax_m2, surf), ref_s0, ref_v0, ref_alpha, ref_beta
+        ),
+        [1],
+    )
+    v_m_zmax = float(v_m_zmax[0])
+    v_r_zmax = float(v_r_zmax[0])
+    tx_model_scatter = vs_model_scatter / v_m_zmax
+    tx_ref_scatter = vs_ref_scatter / (v_r_zmax)
+
+    valid = (vs_ref_scatter != 0) & (surf >= s_r_zmin_m2)
+    v_r = vs_ref_scatter[valid]
+    vs_err = (v_r - vs_model_scatter[valid]) / (v_r)
+    ts_err = (tx_ref_scatter[valid] - tx_model_scatter[valid]) / tx_ref_scatter[valid]
+    vs_area = surf[valid]
+    # The mid band starts at S_25 without upper bound, thus includes the high band
+    high = vs_area >= s_r_z75_m2
+    mid = vs_area >= s_r_z25_m2
+    vsg, vsh, vsm, vsl = vs_err, vs_err[high], vs_err[mid], vs_err[~mid]
+    tsg, tsh, tsm, tsl = ts_err, ts_err[high], ts_err[mid], ts_err[~mid]
+
+    results_json = {
+        "ID": model["ID"],
+        "Name": damname,
+        "Zmin": ref_zmin,
+        "Z_25": ref_z25,
+        "Z_75": ref_z75,
+        "Zmax": ref_zmax,
+        "Smin": s_r_zmin_m2,
+        "S_25": s_r_z25_m2,
+        "S_75": s_r_z75_m2,
+        "Smax": s_r_zmax_m2,
+        "S(z)_quality": {
+            "glob": {"mean": secured_mean(szg), "stdev": secured_stdev(szg)},
+            "high": {"mean": secured_mean(szh), "stdev": secured_stdev(szh)},
+            "mid": {"mean": secured_mean(szm), "stdev": secured_stdev(szm)},
+            "low": {"mean": secured_mean(szl), "stdev": secured_stdev(szl)},
+        },
+        "V(S)_quality": {
+            "glob": {"mean": secured_mean(vsg), "stdev": secured_stdev(vsg)},
+            "high": {"mean": secured_mean(vsh), "stdev": secured_stdev(vsh)},
+            "mid": {"mean": secured_mean(vsm), "stdev": secured_stdev(vsm)},
+            "low": {"mean": secured_mean(vsl), "stdev": secured_stdev(vsl)},
+        },
+        "Vr(S)_quality": {
+            "glob": {"mean": secured_mean(tsg), "stdev": secured_stdev(tsg)},
+            "high": {"mean": secured_mean(tsh), "stdev": secured_stdev(tsh)},
+            "mid": {"mean": secured_mean(tsm), "stdev": secured_stdev(tsm)},
+            "low": {"mean": secured_mean(tsl), "stdev": secured_stdev(tsl)},
+        },
+        "Dam_bottom_estimation": {
+            "Z0_mod": z_0,
+            "Z0_ref": ref_z0,
+            "Dam_bottom_error": abs(z_0 - ref_z0),
+        },
+    }
+    curves = {
+        "alt": alt,
+        "sz_ref": sz_ref_scatter,
+        "sz_model": sz_model_scatter,
+        "s_m_zmax": s_m_zmax,
+        "surf": surf,
+        "vs_ref": vs_ref_scatter,
+        "vs_model": vs_model_scatter,
+        "v_m_zmax": v_m_zmax,
+        "v_r_zmax": v_r_zmax,
+        "tx_ref": tx_ref_scatter,
+        "tx_model": tx_model_scatter,
+    }
+    return results_json, curves
+
+
+def plot_report(results_json, curves, damelev, damname, outfile, plots="full"):
+    """Plot the S(z), V(S) and filling rate comparisons computed by compute_report.
+
+    Only the S(z) comparison is drawn in minimal plots mode, nothing in none mode.
+    In deferred plots mode, the figures data are recorded in <outfile>_plots.npz.
+    """
+    if plots == "none":
+        return
+    plot = get_plotter(plots, os.path.splitext(outfile)[0] + PLOTS_SUFFIX)
+
+    plot(
+        "plot_report_sz",
+        alt=curves["alt"],
+        sz_ref_scatter=curves["sz_ref"],
+        sz_model_scatter=curves["sz_model"],
+        ref_zmax=results_json["Zmax"],
+        damelev=damelev,
+        damname=damname,
+        outfile=os.path.splitext(outfile)[0] + "_Sz.png",
+    )
+    if plots == "minimal":
+        return
+
+    plot(
+        "plot_report_vs",
+        surf=curves["surf"],
+        vs_ref_scatter=curves["vs_ref"],
+        vs_model_scatter=curves["vs_model"],
+        s_r_zmax_m2=results_json["Smax"],
+        damname=damname,
+        outfile=os.path.splitext(outfile)[0] + "_Vs.png",
+    )
+
+    plot(
+        "plot_report_volume_rate",
+        surf=curves["surf"],
+        tx_ref_scatter=curves["tx_ref"],
+        tx_model_scatter=curves["tx_model"],
+        s_r_zmax_m2=results_json["Smax"],
+        damname=damname,
+        outfile=os.path.splitext(outfile)[0] + "_VolumeRate.png",
+    )
+
+
+def val_report(infile, outfile, reffile, debug, plots="full"):
+    """Compare a model to a reference file.
+
+    plots is one of none, minimal, full or deferred and sets the figures drawn.
+    """
     # Silence Mathplotlib related debug messages (font matching)
     logging.getLogger("matplotlib").setLevel(logging.ERROR)
 
@@ -59,7 +244,6 @@ def val_report(infile, outfile, reffile, debug):
     print("\ninfile =", infile)
     print("reffile =", reffile)
 
-    damid = model["ID"]
     damname = model["Name"]
     damelev = model["Elevation"]
     z_0 = model["Model"]["Z0"]
@@ -97,190 +281,41 @@ def val_report(infile, outfile, reffile, debug):
             "No reference model available for " + str(model["ID"]) + " in reference DB."
         )
 
-    ref_z0 = ref_db[str(model["ID"])]["Model"]["Z0"]
-    ref_s0 = ref_db[str(model["ID"])]["Model"]["S0"]  # original values in m2 in DB
-    ref_v0 = ref_db[str(model["ID"])]["Model"]["V0"]  # original values in m3 in DB
-    ref_alpha = ref_db[str(model["ID"])]["Model"]["alpha"]
-    ref_beta = ref_db[str(model["ID"])]["Model"]["beta"]
-    ref_zmax = ref_db[str(model["ID"])]["Model"]["Zmax"]
-    ref_zmin = ref_db[str(model["ID"])]["Model"]["Zmin"]
-    ref_z25 = ref_zmin + 0.25 * (ref_zmax - ref_zmin)
-    ref_z75 = ref_zmin + 0.75 * (ref_zmax - ref_zmin)
-
-    print("\nref_Z0 =", ref_z0)
-    print("ref_S0 =", ref_s0)
-    print("ref_V0 =", ref_v0)
-    print("ref_alpha =", ref_alpha)
-    print("ref_beta =", ref_beta)
+    ref_model = ref_db[str(model["ID"])]
+    print("\nref_Z0 =", ref_model["Model"]["Z0"])
+    print("ref_S0 =", ref_model["Model"]["S0"])
+    print("ref_V0 =", ref_model["Model"]["V0"])
+    print("ref_alpha =", ref_model["Model"]["alpha"])
+    print("ref_beta =", ref_model["Model"]["beta"])
 
     logging.info(
         "Reference for "
         + damname
         + ": S(Z) = "
-        + format(ref_s0, ".2F")
+        + format(ref_model["Model"]["S0"], ".2F")
         + " + "
-        + format(ref_alpha, ".3E")
+        + format(ref_model["Model"]["alpha"], ".3E")
         + " * ( Z - "
-        + format(ref_z0, ".2F")
+        + format(ref_model["Model"]["Z0"], ".2F")
         + " ) ^ "
-        + format(ref_beta, ".3E")
+        + format(ref_model["Model"]["beta"], ".3E")
     )
 
     print("\ndamelev  =", damelev)
-    print("ref_Zmax =", ref_zmax)
-
-    # Figures:
-    z_min = max(int(float(z_0)), int(float(ref_z0)))
-    alt = range(z_min, int(float(damelev) * 1.1))
-
-    s_m_zmax = s_0 + alpha * math.pow((float(ref_zmax) - z_0), beta)
-
-    s_r_zmax_m2 = ref_s0 + ref_alpha * math.pow((float(ref_zmax) - ref_z0), ref_beta)
-    s_r_zmin_m2 = ref_s0 + ref_alpha * math.pow((float(ref_zmin) - ref_z0), ref_beta)
-    s_r_z25_m2 = ref_s0 + ref_alpha * math.pow((float(ref_z25) - ref_z0), ref_beta)
-    s_r_z75_m2 = ref_s0 + ref_alpha * math.pow((float(ref_z75) - ref_z0), ref_beta)
-
-    surf = range(0, math.ceil(s_r_zmax_m2) + 10000, 10000)
-
-    sz_model_scatter = []
-    sz_ref_scatter = []
-    szg = []
-    szh = []
-    szm = []
-    szl = []
-    for elev in alt:
-        s_m = s_0 + alpha * math.pow((elev - int(z_0)), beta)
-        sz_model_scatter.append(s_m)
-        s_r = ref_s0 + ref_alpha * math.pow((elev - int(ref_z0)), ref_beta)
-        sz_ref_scatter.append(s_r)  # m2
-
-        if s_r != 0 and elev >= ref_zmin:
-            szg.append((s_r - s_m) / (s_r))
-            if elev >= ref_z75:
-                szh.append((s_r - s_m) / (s_r))
-            elif elev >= ref_z25:
-                szm.append((s_r - s_m) / (s_r))
-            else:
-                szl.append((s_r - s_m) / (s_r))
-
-    print("\n== s_m =", s_m)
-    print("== s_r =", s_r)
-
-    print("\n== Zmax model =", s_m_zmax)
-    print("== Zmax ref   =", s_r_zmax_m2)
-
-    vs_model_scatter = []
-    vs_ref_scatter = []
-
-    v_m_zmax = v_0 + math.pow(((s_r_zmax_m2 - s_0) / alpha), 1 / beta) * (
-        s_0 + ((s_r_zmax_m2 - s_0) / (beta + 1.0))
-    )
-    v_r_zmax = ref_v0 + math.pow(((s_r_zmax_m2 - ref_s0) / ref_alpha), 1 / ref_beta) * (
-        ref_s0 + ((s_r_zmax_m2 - ref_s0) / (ref_beta + 1.0))
-    )
+    print("ref_Zmax =", ref_model["Model"]["Zmax"])
 
-    tx_model_scatter = []
-    tx_ref_scatter = []
-    vsg = []
-    vsh = []
-    vsm = []
-    vsl = []
-    tsg = []
-    tsh = []
-    tsm = []
-    tsl = []
-    for area in surf:
-        v_m = v_0 + math.pow(((area - s_0) / alpha), 1 / beta) * (
-            s_0 + ((area - s_0) / (beta + 1.0))
-        )
-        vs_model_scatter.append(v_m)
-        tx_model_scatter.append(v_m / v_m_zmax)
+    results_json, curves = compute_report(model, ref_model)
 
-        v_r = ref_v0 + math.pow(((area - ref_s0) / ref_alpha), 1 / ref_beta) * (
-            ref_s0 + ((area - ref_s0) / (ref_beta + 1.0))
-        )
-        vs_ref_scatter.append(v_r)
-        tx_ref_scatter.append(v_r / (v_r_zmax))
-
-        if v_r != 0 and area >= s_r_zmin_m2:
-            vsg.append((v_r - v_m) / (v_r))
-            tsg.append(((v_r / v_r_zmax) - (v_m / v_m_zmax)) / (v_r / v_r_zmax))
-            if area >= s_r_z75_m2:
-                vsh.append((v_r - v_m) / (v_r))
-                tsh.append(((v_r / v_r_zmax) - (v_m / v_m_zmax)) / (v_r / v_r_zmax))
-            if area >= s_r_z25_m2:
-                vsm.append((v_r - v_m) / (v_r))
-                tsm.append(((v_r / v_r_zmax) - (v_m / v_m_zmax)) / (v_r / v_r_zmax))
-            else:
-                vsl.append((v_r - v_m) / (v_r))
-                tsl.append(((v_r / v_r_zmax) - (v_m / v_m_zmax)) / (v_r / v_r_zmax))
-
-    print("\n== v_m_Zmax =", v_m_zmax)
-    print("== v_r_Zmax =", v_r_zmax)
-
-    pl.plot_report_sz(
-        alt,
-        sz_ref_scatter,
-        sz_model_scatter,
-        ref_zmax,
-        damelev,
-        damname,
-        os.path.splitext(outfile)[0] + "_Sz.png",
-    )
+    print("\n== s_m =", curves["sz_model"][-1])
+    print("== s_r =", curves["sz_ref"][-1])
 
-    pl.plot_report_vs(
-        surf,
-        vs_ref_scatter,
-        vs_model_scatter,
-        s_r_zmax_m2,
-        damname,
-        os.path.splitext(outfile)[0] + "_Vs.png",
-    )
+    print("\n== Zmax model =", curves["s_m_zmax"])
+    print("== Zmax ref   =", results_json["Smax"])
 
-    pl.plot_report_volume_rate(
-        surf,
-        tx_ref_scatter,
-        tx_model_scatter,
-        s_r_zmax_m2,
-        damname,
-        os.path.splitext(outfile)[0] + "_VolumeRate.png",
-    )
+    print("\n== v_m_Zmax =", curves["v_m_zmax"])
+    print("== v_r_Zmax =", curves["v_r_zmax"])
 
-    results_json = {
-        "ID": damid,
-        "Name": damname,
-        "Zmin": ref_zmin,
-        "Z_25": ref_z25,
-        "Z_75": ref_z75,
-        "Zmax": ref_zmax,
-        "Smin": s_r_zmin_m2,
-        "S_25": s_r_z25_m2,
-        "S_75": s_r_z75_m2,
-        "Smax": s_r_zmax_m2,
-        "S(z)_quality": {
-            "glob": {"mean": secured_mean(szg), "stdev": secured_stdev(szg)},
-            "high": {"mean": secured_mean(szh), "stdev": secured_stdev(szh)},
-            "mid": {"mean": secured_mean(szm), "stdev": secured_stdev(szm)},
-            "low": {"mean": secured_mean(szl), "stdev": secured_stdev(szl)},
-        },
-        "V(S)_quality": {
-            "glob": {"mean": secured_mean(vsg), "stdev": secured_stdev(vsg)},
-            "high": {"mean": secured_mean(vsh), "stdev": secured_stdev(vsh)},
-            "mid": {"mean": secured_mean(vsm), "stdev": secured_stdev(vsm)},
-            "low": {"mean": secured_mean(vsl), "stdev": secured_stdev(vsl)},
-        },
-        "Vr(S)_quality": {
-            "glob": {"mean": secured_mean(tsg), "stdev": secured_stdev(tsg)},
-            "high": {"mean": secured_mean(tsh), "stdev": secured_stdev(tsh)},
-            "mid": {"mean": secured_mean(tsm), "stdev": secured_stdev(tsm)},
-            "low": {"mean": secured_mean(tsl), "stdev": secured_stdev(tsl)},
-        },
-        "Dam_bottom_estimation": {
-            "Z0_mod": z_0,
-            "Z0_ref": ref_z0,
-            "Dam_bottom_error": abs(z_0 - ref_z0),
-        },
-    }
+    plot_report(results_json, curves, damelev, damname, outfile, plots)
 
     with open(
         os.path.splitext(outfile)[0] + ".json", "w", encoding="utf-8"
@@ -288,6 +323,65 @@ def val_report(infile, outfile, reffile, debug):
         json.dump(results_json, write_file, indent=4)
 
 
+def val_report_campaign(campaign_path, reffile, outfile, plots="none", debug=False):
+    """Compare all the models of a campaign to the reference file at once.
+
+    Parameters
+    ----------
+    campaign_path:
+        the campaign output path, the camp/*/*_model.json files are compared
+    reffile:
+        the validation database, read once for all the dams
+    outfile:
+        the json file receiving the list of reports, as gathered by
+        perf/gen_report.py report mode
+    plots:
+        one of none, minimal, full or deferred, the figures of plot_report
+        written next to each model file
+    """
+    logging.getLogger("matplotlib").setLevel(logging.ERROR)
+    logging_format = (
+        "%(asctime)s - %(filename)s:%(lineno)s - %(levelname)s - %(message)s"
+    )
+    if debug is True:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.DEBUG, format=logging_format
+        )
+    else:
+        logging.basicConfig(
+            stream=sys.stdout, level=logging.INFO, format=logging_format
+        )
+    logging.info("Starting campaign val_report")
+
+    with open(reffile, encoding="utf-8") as ref_in:
+        ref_db = json.load(ref_in)
+
+    model_files = sorted(glob(os.path.join(campaign_path, "camp", "*", "*_model.json")))
+    reports = []
+    for model_file in model_files:
+        with open(model_file, encoding="utf-8") as model_in:
+            model = json.load(model_in)
+        if str(model["ID"]) not in ref_db:
+            logging.debug(f"No reference model available for {model['ID']}.")
+            continue
+        results_json, curves = compute_report(model, ref_db[str(model["ID"])])
+        reports.append(results_json)
+        plot_report(
+            results_json,
+            curves,
+            model["Elevation"],
+            model["Name"],
+            model_file.replace("_model.json", "_report.png"),
+            plots,
+        )
+    logging.info(
+        f"{len(reports)} reports over {len(model_files)} models written to {outfile}"
+    )
+    with open(outfile, "w", encoding="utf-8") as write_file:
+        json.dump(reports, write_file, indent=4)
+    return reports
+
+
 def val_report_parameters():
     """Define val_report.py parameters."""
     parser = argparse.ArgumentParser(
@@ -298,6 +392,12 @@ def val_report_parameters():
     parser.add_argument("-r", "--reffile", help="validation_DB.json file in SI units")
     parser.add_argument("-o", "--outfile", help="Report.png file")
     parser.add_argument("--debug", action="store_true", help="Activate Debug Mode")
+    parser.add_argument(
+        "--plots",
+        default="full",
+        choices=["none", "minimal", "full", "deferred"],
+        help="Figures to draw, none skips matplotlib entirely",
+    )
     return parser
 
 
@@ -305,7 +405,7 @@ def main():
     """Cli function to val_report."""
     parser = val_report_parameters()
     args = parser.parse_args()
-    val_report(args.infile, args.outfile, args.reffile, args.debug)
+    val_report(args.infile, args.outfile, args.reffile, args.debug, args.plots)
 
 
 if __name__ == "__main__":
@@ -9,6 +9,7 @@ with open("README.md", encoding="utf-8") as readme_file:
 
 requirements = [
     "geopandas",
+    "shapely>=2.0",
     "scipy",
     "numpy",
     "matplotlib",